@@ -0,0 +1,204 @@
+"""
+Local stand-in for the OpenWeather geocoding and timemachine endpoints.
+
+Answers are deterministic: a city always geocodes to the same coordinates and
+a location and timestamp always get the same observation, so benchmark runs
+and tests are comparable. Latency, a share of 5xx errors and of 429 responses
+(with Retry-After) can be added to exercise the client's retry logic.
+Cities whose name starts with "Nowhere" are not found.
+
+Point the program at it with OPENWEATHER_BASE_URL, e.g.:
+    python benchmarks/fake_openweather.py --port 8765 --latency 0.05
+    OPENWEATHER_BASE_URL=http://127.0.0.1:8765 OPENWEATHER_API_KEY=fake python main.py enrich
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+GEO_PATH = "/geo/1.0/direct"
+TIMEMACHINE_PATH = "/data/3.0/onecall/timemachine"
+
+CONDITIONS = [
+    ("Clear", "clear sky"),
+    ("Clouds", "few clouds"),
+    ("Clouds", "overcast clouds"),
+    ("Rain", "light rain"),
+    ("Rain", "moderate rain"),
+    ("Snow", "light snow"),
+    ("Mist", "mist"),
+]
+
+
+def _unit(*parts):
+    """A number in [0, 1) derived from the parts, the same on every run."""
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2 ** 64
+
+
+def geocode(city):
+    """Coordinates of a made-up city, on land in central Europe."""
+    if city.lower().startswith("nowhere"):
+        return []
+    key = city.strip().lower()
+    lat = round(44.0 + 6.0 * _unit("lat", key), 4)
+    lon = round(6.0 + 10.0 * _unit("lon", key), 4)
+    return [{"name": city, "lat": lat, "lon": lon, "country": "XX"}]
+
+
+def observation(lat, lon, dt):
+    """A timemachine payload for a location and UTC timestamp."""
+    day, hour = divmod(int(dt) // 3600, 24)
+    # A seasonal and daily curve plus noise, so aggregates look plausible
+    season = -math.cos(2 * math.pi * ((day + 10) % 365.25) / 365.25)
+    daily = -math.cos(2 * math.pi * (hour - 3) / 24)
+    temp = round(12 + 10 * season + 3 * daily + 6 * (_unit("t", lat, lon, day) - 0.5), 2)
+    main, description = CONDITIONS[int(_unit("w", lat, lon, day) * len(CONDITIONS))]
+    hourly = {
+        "dt": int(dt),
+        "temp": temp,
+        "feels_like": round(temp - 3 * _unit("f", lat, lon, day), 2),
+        "wind_speed": round(8 * _unit("v", lat, lon, day) * (0.5 + _unit("v", lat, lon, day, hour)), 2),
+        "weather": [{"id": 800, "main": main, "description": description, "icon": "01d"}],
+    }
+    # On rainy or snowy days, it does so in about half of the hours
+    if main in ("Rain", "Snow") and _unit("p", lat, lon, day, hour) < 0.5:
+        hourly[main.lower()] = {"1h": round(4 * _unit("mm", lat, lon, day, hour), 2)}
+    return {"lat": lat, "lon": lon, "timezone": "Europe/Zurich", "timezone_offset": 3600, "data": [hourly]}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=None, headers=None):
+        payload = json.dumps(body if body is not None else {"cod": status}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+        return len(payload)
+
+    def do_GET(self):
+        fake = self.server.fake
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        fake.count(url.path)
+        if fake.latency:
+            time.sleep(fake.latency)
+
+        if "appid" not in query:
+            status, body, headers = 401, {"cod": 401, "message": "Invalid API key"}, None
+        elif fake.roll() < fake.rate_limit_rate:
+            status, body, headers = 429, None, {"Retry-After": str(fake.retry_after)}
+        elif fake.roll() < fake.error_rate:
+            status, body, headers = 503, None, None
+        elif url.path == GEO_PATH and "q" in query:
+            status, body, headers = 200, geocode(query["q"]), None
+        elif url.path == TIMEMACHINE_PATH and {"lat", "lon", "dt"} <= query.keys():
+            status, body, headers = 200, observation(float(query["lat"]), float(query["lon"]), query["dt"]), None
+        else:
+            status, body, headers = 404, None, None
+        sent = self._send(status, body, headers)
+        fake.count(f"status_{status}", sent)
+
+
+class FakeOpenWeather:
+    """
+    Run the stand-in on a background thread.
+
+    `latency` is added to every request, in seconds. `error_rate` and
+    `rate_limit_rate` are the shares of requests answered with 503 and 429.
+    Use as a context manager; `url` is the base URL to configure.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0, rate_limit_rate=0.0,
+                 retry_after=1, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._counters = Counter()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def roll(self):
+        with self._lock:
+            return self._random.random()
+
+    def count(self, name, sent=None):
+        with self._lock:
+            self._counters[name] += 1
+            if sent is not None:
+                self._counters["bytes_sent"] += sent
+
+    @property
+    def counters(self):
+        """Requests per path and per status code, and the bytes sent."""
+        with self._lock:
+            return dict(self._counters)
+
+    def reset_counters(self):
+        with self._lock:
+            self._counters.clear()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-openweather", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After of 429 responses, in seconds")
+    args = parser.parse_args(argv)
+
+    fake = FakeOpenWeather(args.host, args.port, args.latency, args.error_rate, args.rate_limit_rate,
+                           args.retry_after)
+    print(f"Fake OpenWeather listening on {fake.url} (Ctrl+C to stop)")
+    try:
+        fake._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake._server.server_close()
+        print(json.dumps(fake.counters))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+Benchmark suite.
+
+Measures insert throughput (add_revenue), bulk import throughput, the
+latency of each read function on a synthetic database, and end-to-end
+weather enrichment throughput against the local OpenWeather stand-in.
+Results are printed as JSON together with the git commit, so runs on two
+commits can be compared:
+
+Usage:
+    python benchmarks/run.py [--rows 100000] [--only reads,enrichment] [--output results.json]
+    python benchmarks/run.py --compare before.json [--threshold 10]
+
+With --compare the exit code is 1 when a metric regressed by more than the
+threshold (in percent).
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from revenue_tracker import config, connection, database
+from benchmarks import synth
+from benchmarks.fake_openweather import FakeOpenWeather
+
+SECTIONS = ["insert", "import", "reads", "enrichment"]
+
+
+def _git(*args):
+    try:
+        return subprocess.run(["git", *args], cwd=PROJECT_ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _use_database(path):
+    """Point the program at another database file."""
+    connection.close_connection()
+    config.DATABASE_PATH = Path(path)
+
+
+def _latency(function, repeat):
+    """Median and 95th percentile of `repeat` calls, in milliseconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    p95 = statistics.quantiles(times, n=20)[18] if len(times) > 1 else times[0]
+    return {"median_ms": statistics.median(times), "p95_ms": p95, "runs": repeat}
+
+
+#### BENCHMARKS ####
+
+def bench_insert(workdir, rows):
+    """add_revenue one row at a time, each in its own transaction."""
+    _use_database(workdir / "insert.db")
+    database.create_table()
+    data = [row[:6] for row in synth.generate_rows(rows, weather=0.0)]
+    start = time.perf_counter()
+    for date, city, revenue, declared, kind, who in data:
+        database.add_revenue(date, city, declared, revenue, kind, who)
+    seconds = time.perf_counter() - start
+    return {"rows": rows, "seconds": seconds, "rows_per_second": rows / seconds}
+
+
+def bench_import(workdir, rows):
+    """importer.import_revenues of a synthetic CSV file into an empty database."""
+    from revenue_tracker import importer
+    _use_database(workdir / "import.db")
+    path = workdir / "import.csv"
+    synth.write_csv(path, rows)
+    summary = importer.import_revenues(path, progress=False)
+    return {"rows": rows, "inserted": summary["inserted"], "seconds": summary["seconds"],
+            "rows_per_second": rows / summary["seconds"]}
+
+
+def bench_reads(workdir, rows, repeat, table_limit):
+    """Latency of the read functions on a synthetic database of `rows` rows."""
+    path = workdir / "reads.db"
+    synth.create_database(path, rows)
+    _use_database(path)
+    cities = synth.cities_for(rows)
+    last_date = (synth.START + timedelta(days=(rows - 1) // len(cities))).isoformat()
+
+    functions = {
+        "get_last_revenues": lambda: database.get_last_revenues(100),
+        "get_revenue_by_date": lambda: database.get_revenue_by_date(last_date),
+        "iter_revenues": lambda: sum(len(df) for df in database.iter_revenues(batch_size=5000)),
+        "query_revenues_city_range": lambda: database.query_revenues(
+            city=cities[0], start=synth.START.isoformat(), end=last_date),
+        "query_revenues_group_by": lambda: database.query_revenues(group_by=["city", "month"]),
+    }
+    if rows <= table_limit:
+        functions["get_table"] = database.get_table
+
+    results = {"rows": rows}
+    for name, function in functions.items():
+        # Scans of the whole table are repeated less often
+        runs = max(2, repeat // 10) if name in ("iter_revenues", "get_table") else repeat
+        results[name] = _latency(function, runs)
+    return results
+
+
+def bench_enrichment(workdir, rows, cities, latency, error_rate, rate_limit_rate, workers):
+    """drain_queue over `rows` pending rows, with weather served by the stand-in."""
+    from revenue_tracker import enrichment, weather
+    path = workdir / "enrichment.db"
+    synth.create_database(path, rows, weather=0.0, cities=cities)
+    _use_database(path)
+
+    with FakeOpenWeather(latency=latency, error_rate=error_rate, rate_limit_rate=rate_limit_rate,
+                         retry_after=0) as fake:
+        config.OPENWEATHER_BASE_URL = fake.url
+        config.OPENWEATHER_API_KEY = config.OPENWEATHER_API_KEY or "benchmark"
+        # The request budget of the real API is not what is measured here
+        weather.rate_limiter = weather.TokenBucket(rate_per_minute=1e9, capacity=1e6)
+        weather.timezone_at.cache_clear()
+        weather.get_timezone_finder()  # loading the polygon data is a one-off cost
+
+        start = time.perf_counter()
+        summary = enrichment.drain_queue(max_workers=workers)
+        seconds = time.perf_counter() - start
+        requests = fake.counters
+    return {
+        "rows": rows, "cities": cities, "latency_s": latency, "error_rate": error_rate,
+        "rate_limit_rate": rate_limit_rate, "workers": workers or config.OPENWEATHER_WORKERS,
+        **summary, "seconds": seconds, "rows_per_second": summary["enriched"] / seconds,
+        "requests": requests,
+    }
+
+
+#### COMPARISON ####
+
+def _metrics(results):
+    """Flatten the comparable metrics: latencies (lower is better) and throughputs (higher is better)."""
+    flat = {}
+    for section, values in results.items():
+        for name, value in values.items():
+            if isinstance(value, dict):
+                for key in ("median_ms", "p95_ms"):
+                    if key in value:
+                        flat[f"{section}.{name}.{key}"] = value[key]
+            elif name.endswith("_per_second"):
+                flat[f"{section}.{name}"] = value
+    return flat
+
+
+def compare(before, after, threshold):
+    """Print the change of every metric found in both runs. Returns the regressed metrics."""
+    old, new = _metrics(before["results"]), _metrics(after["results"])
+    print(f"\n{'metric':50} {before.get('commit', '?')[:10]:>12} {after.get('commit', '?')[:10]:>12} {'change':>9}")
+    regressions = []
+    for name in sorted(old.keys() & new.keys()):
+        if not old[name]:
+            continue
+        change = (new[name] - old[name]) / old[name] * 100
+        worse = -change if name.endswith("_per_second") else change
+        flag = ""
+        if worse > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:50} {old[name]:12.2f} {new[name]:12.2f} {change:+8.1f}%{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--only", type=lambda v: v.split(","), default=SECTIONS,
+                        help=f"comma separated sections: {', '.join(SECTIONS)}")
+    parser.add_argument("--rows", type=int, default=100000, help="rows of the database the reads run on")
+    parser.add_argument("--insert-rows", type=int, default=2000)
+    parser.add_argument("--import-rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=50, help="calls per read function")
+    parser.add_argument("--table-limit", type=int, default=1000000,
+                        help="skip get_table on databases larger than this")
+    parser.add_argument("--enrich-rows", type=int, default=1000)
+    parser.add_argument("--enrich-cities", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every weather request")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, help="concurrent weather requests")
+    parser.add_argument("--output", help="also write the results to this file")
+    parser.add_argument("--compare", help="results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold, in percent")
+    args = parser.parse_args(argv)
+
+    unknown = set(args.only) - set(SECTIONS)
+    if unknown:
+        parser.error(f"unknown section(s): {', '.join(sorted(unknown))}")
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="revenue-bench-") as tmp:
+        workdir = Path(tmp)
+        if "insert" in args.only:
+            results["insert"] = bench_insert(workdir, args.insert_rows)
+        if "import" in args.only:
+            results["import"] = bench_import(workdir, args.import_rows)
+        if "reads" in args.only:
+            results["reads"] = bench_reads(workdir, args.rows, args.repeat, args.table_limit)
+        if "enrichment" in args.only:
+            results["enrichment"] = bench_enrichment(workdir, args.enrich_rows, args.enrich_cities, args.latency,
+                                                     args.error_rate, args.rate_limit_rate, args.workers)
+        connection.close_connection()
+
+    run = {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    print(json.dumps(run, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(run, indent=2) + "\n")
+
+    if args.compare:
+        before = json.loads(Path(args.compare).read_text())
+        # The table goes to stderr, so stdout stays valid JSON
+        stdout, sys.stdout = sys.stdout, sys.stderr
+        try:
+            regressions = compare(before, run, args.threshold)
+        finally:
+            sys.stdout = stdout
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""
+Startup time benchmark.
+
+Measures how long it takes to import the modules needed to show the menu,
+with a breakdown of the slowest imports from `python -X importtime`, and
+checks that the heavy dependencies are not loaded at startup.
+
+Usage:
+    python benchmarks/startup.py [--runs 5] [--top 15] [--json]
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+ENTRY_MODULE = "revenue_tracker.interface"
+HEAVY_MODULES = ["pandas", "numpy", "requests", "timezonefinder", "dotenv"]
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def _run(code, extra_args=()):
+    env = dict(os.environ)
+    # Startup must work without a configured API key
+    env.pop("OPENWEATHER_API_KEY", None)
+    return subprocess.run(
+        [sys.executable, *extra_args, "-c", code],
+        cwd=PROJECT_ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+
+
+def import_breakdown():
+    """Return (total microseconds, list of (cumulative us, self us, module)) for the entry module."""
+    result = _run(f"import {ENTRY_MODULE}", ["-X", "importtime"])
+    # Children are printed before their parent: keep the subtree of the entry
+    # module and drop what the interpreter imports at startup (site, ...)
+    subtree = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, module = int(match[1]), int(match[2]), match[3], match[4]
+        subtree.append((cumulative_us, self_us, module))
+        if len(indent) == 1:
+            if module == ENTRY_MODULE:
+                return cumulative_us, subtree
+            subtree = []
+    return 0, []
+
+
+def wall_time(runs):
+    """Wall-clock seconds for a fresh interpreter to import the entry module, one per run."""
+    code = (
+        "import time; t = time.perf_counter(); "
+        f"import {ENTRY_MODULE}; "
+        "print(time.perf_counter() - t)"
+    )
+    return [float(_run(code).stdout) for _ in range(runs)]
+
+
+def loaded_heavy_modules():
+    code = f"import sys, {ENTRY_MODULE}; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    return _run(code).stdout.split()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="number of fresh interpreters to time")
+    parser.add_argument("--top", type=int, default=15, help="number of slowest imports to show")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args(argv)
+
+    total_us, rows = import_breakdown()
+    times = wall_time(args.runs)
+    heavy = loaded_heavy_modules()
+    own = sorted((r for r in rows if r[2].startswith("revenue_tracker")), reverse=True)
+    slowest = sorted(rows, reverse=True)[:args.top]
+
+    results = {
+        "entry_module": ENTRY_MODULE,
+        "import_ms_median": statistics.median(times) * 1000,
+        "import_ms_min": min(times) * 1000,
+        "importtime_ms": total_us / 1000,
+        "heavy_modules_loaded": heavy,
+        "revenue_tracker_modules_ms": {m: c / 1000 for c, _, m in own},
+        "slowest_imports_ms": {m: c / 1000 for c, _, m in slowest},
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 1 if heavy else 0
+
+    print(f"import {ENTRY_MODULE}: median {results['import_ms_median']:.1f} ms, "
+          f"min {results['import_ms_min']:.1f} ms over {args.runs} runs")
+    print(f"\nSlowest imports (cumulative ms, -X importtime):")
+    for cumulative_us, self_us, module in slowest:
+        print(f"  {cumulative_us / 1000:8.1f}  {module}")
+    print(f"\nHeavy modules loaded at startup: {', '.join(heavy) if heavy else 'none'}")
+    return 1 if heavy else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
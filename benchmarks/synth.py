@@ -0,0 +1,142 @@
+"""
+Synthetic revenue datasets for benchmarks.
+
+Creates a revenues database with the current schema, or a CSV file for the
+importer, with a given number of rows (10k to 10M and more). Dates cover up
+to ten years per city and more cities are added as the row count grows, so
+every (date, city) key stays unique. The same seed gives the same data.
+
+Usage:
+    python benchmarks/synth.py data/bench.db --rows 1000000 [--weather 0.9] [--seed 0]
+    python benchmarks/synth.py data/bench.csv --rows 100000
+"""
+import argparse
+import csv
+import math
+import random
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from revenue_tracker import connection, migrations, rollups, storage
+from benchmarks.fake_openweather import CONDITIONS
+
+DAYS = 3650
+START = date(2015, 1, 1)
+CHUNK_SIZE = 50000
+BASE_CITIES = ["Zurich", "Basel", "Bern", "Lugano", "Milano", "Bergamo", "Como", "Torino", "Genova", "Verona"]
+STAFF = ["Marco", "Liam", "Sofia", "Anna", "Luca"]
+
+
+def cities_for(rows, count=None):
+    """City names holding `rows` unique (date, city) keys within DAYS days, at least `count` of them."""
+    count = max(1, math.ceil(rows / DAYS), count or 0)
+    names = BASE_CITIES[:count]
+    names += [f"{BASE_CITIES[i % len(BASE_CITIES)]} {i // len(BASE_CITIES)}" for i in range(len(names), count)]
+    return names
+
+
+def generate_rows(rows, seed=0, weather=1.0, cities=None):
+    """
+    Yield (date, city, revenue, declared_revenue, kind, who, weather columns...,
+    weather_status) tuples in date order. `weather` is the share of rows whose
+    weather is filled in; the others are 'pending'.
+    """
+    rng = random.Random(seed)
+    cities = cities_for(rows, cities)
+    for i in range(rows):
+        day, city = divmod(i, len(cities))
+        declared = round(rng.uniform(200, 3000), 2)
+        row = (
+            (START + timedelta(days=day)).isoformat(), cities[city],
+            round(declared * rng.uniform(0.9, 1.3), 2) if rng.random() < 0.7 else None,
+            declared,
+            "market" if rng.random() < 0.2 else "ordinary",
+            ", ".join(rng.sample(STAFF, rng.randint(1, 2))),
+        )
+        if rng.random() < weather:
+            temp = round(rng.uniform(-5, 32), 1)
+            main, description = rng.choice(CONDITIONS)
+            row += (temp, round(temp - rng.uniform(0, 3), 1), round(rng.uniform(0, 10), 1), main, description, "ok")
+        else:
+            row += (None, None, None, None, None, "pending")
+        yield row
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def create_database(path, rows, seed=0, weather=1.0, cities=None, progress=False):
+    """
+    Write a new database at `path` with `rows` synthetic revenues. Rows
+    without weather are queued for enrichment. Returns the seconds taken.
+    """
+    path = Path(path)
+    for suffix in ("", "-wal", "-shm"):
+        Path(f"{path}{suffix}").unlink(missing_ok=True)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    start = time.perf_counter()
+    conn = connection._open(str(path))
+    try:
+        migrations.migrate(conn)
+        columns = ["date", "city", "revenue", "declared_revenue", "kind", "who",
+                   *migrations.WEATHER_COLUMNS, "weather_status"]
+        done = 0
+        with conn, rollups.bulk_insert(conn):
+            for chunk in _chunks(generate_rows(rows, seed, weather, cities), CHUNK_SIZE):
+                storage.insert_entries(conn, [dict(zip(columns, row), notes=None) for row in chunk])
+                done += len(chunk)
+                if progress:
+                    print(f"{done}/{rows} rows", file=sys.stderr)
+            now = time.time()
+            conn.execute('''
+            INSERT INTO weather_queue (revenue_id, next_attempt_at, enqueued_at)
+            SELECT id, ?, ? FROM revenue_entries WHERE weather_status = 'pending'
+            ''', (now, now))
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+    return time.perf_counter() - start
+
+
+def write_csv(path, rows, seed=0, cities=None):
+    """Write `rows` synthetic revenues as an import file, without weather columns."""
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["date", "city", "revenue", "declared_revenue", "kind", "who", "notes"])
+        for row in generate_rows(rows, seed, weather=0.0, cities=cities):
+            writer.writerow([*row[:6], ""])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path", help="a .db file, or a .csv file for the importer")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--weather", type=float, default=1.0, help="share of rows with weather filled in")
+    parser.add_argument("--cities", type=int, help="spread the rows over at least this many cities")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.path.endswith(".csv"):
+        write_csv(args.path, args.rows, args.seed, args.cities)
+        print(f"Wrote {args.rows} rows to {args.path}")
+    else:
+        seconds = create_database(args.path, args.rows, args.seed, args.weather, args.cities, progress=True)
+        print(f"Wrote {args.rows} rows over {len(cities_for(args.rows, args.cities))} cities to {args.path} "
+              f"in {seconds:.1f} s ({args.rows / seconds:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,22 @@
+import sys
 import revenue_tracker.interface as interface
 
 
 def main():
 
+    if len(sys.argv) > 1:
+        # Non-interactive use, e.g. python main.py query --format ndjson
+        from revenue_tracker import cli
+        sys.exit(cli.main(sys.argv[1:]))
+
     print("\n", "-"*40, 'REVENUE TRACKER', "-"*40, "\n")
 
+    from revenue_tracker import config
+    if config.WEATHER_PREFETCH:
+        # Weather of the scheduled market days, fetched before their revenue is entered
+        from revenue_tracker import prefetch
+        prefetch.start_scheduler()
+
     choice = None
      
     while choice != -1:
@@ -0,0 +1,276 @@
+import numpy as np
+import pandas as pd
+from revenue_tracker import database, stats
+
+# Revenue against weather: correlations, grouped statistics and a ridge
+# regression, computed with NumPy over the whole history.
+#
+# load_dataset() streams the rows through database.iter_revenues and encodes
+# them as a feature matrix: temperature, felt temperature, wind speed and
+# one-hot main weather, weekday and kind of day, plus the day aggregates of
+# the hourly market weather when asked for. Cities are not one-hot
+# encoded; every model has a separate intercept per city (fixed effects),
+# computed from per-city sums, so thousands of cities cost no more than one.
+# All statistics come from sums over rows (np.bincount, X.T @ X), which keeps
+# millions of rows to a few seconds, most of them spent reading SQLite.
+
+NUMERIC = ["temperature", "temperature_felt", "wind_speed"]
+# Day aggregates of the hourly market weather, used with hourly=True
+HOURLY = ["market_temperature_mean", "market_temperature_max", "market_rain_hours"]
+CATEGORICAL = ["main_weather", "weekday", "kind"]
+TARGETS = ["revenue", "declared_revenue"]
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+ALPHAS = [0.01, 0.1, 1.0, 10.0, 100.0]
+
+
+class Dataset:
+    """
+    Rows usable for analysis, as arrays.
+
+    X holds one column per entry of `features`, the `numeric` ones first, y
+    the target, and `city` the index of each row's city in `cities`.
+    `dropped` counts the rows left out because the date was malformed or the
+    target or the weather was missing.
+    """
+
+    def __init__(self, X, y, features, city, cities, target, dropped, numeric=NUMERIC):
+        self.X = X
+        self.y = y
+        self.features = features
+        self.city = city
+        self.cities = cities
+        self.target = target
+        self.dropped = dropped
+        self.numeric = numeric
+
+    def __len__(self):
+        return len(self.y)
+
+
+#### FEATURES ####
+
+@stats.timed("analytics.load_dataset")
+def load_dataset(target="revenue", city=None, batch_size=100000, hourly=False):
+    """
+    Read the revenues with known target and weather and build the feature
+    matrix. With hourly=True the market hour aggregates are features too, and
+    rows without them are left out.
+    """
+    if target not in TARGETS:
+        raise ValueError(f"Target must be one of: {', '.join(TARGETS)}")
+    numeric_columns = NUMERIC + HOURLY if hourly else NUMERIC
+    columns = ["date", "city", "kind", target, *numeric_columns, "main_weather"]
+
+    chunks, dropped = [], 0
+    rows = database.iter_revenues(batch_size=batch_size, columns=columns, filters={"city": city})
+    for df in rows or []:
+        # A malformed date leaves the row out instead of failing the whole dataset
+        df["date"] = pd.to_datetime(df["date"], format="%Y-%m-%d", errors="coerce")
+        keep = df[["date", target, *numeric_columns, "main_weather"]].notna().all(axis=1).to_numpy()
+        dropped += int((~keep).sum())
+        chunks.append(df[keep])
+    if not chunks:
+        return None
+    df = pd.concat(chunks, ignore_index=True)
+
+    numeric = df[numeric_columns].to_numpy(dtype=np.float64)
+    days = df["date"].to_numpy(dtype="datetime64[D]").astype(np.int64)
+    categories = {
+        "main_weather": df["main_weather"].to_numpy(dtype=object),
+        # 1970-01-01 was a Thursday
+        "weekday": np.array(WEEKDAYS, dtype=object)[(days + 3) % 7],
+        "kind": df["kind"].fillna("ordinary").to_numpy(dtype=object),
+    }
+    blocks, features = [numeric], list(numeric_columns)
+    for name in CATEGORICAL:
+        codes, levels = pd.factorize(categories[name], sort=True)
+        blocks.append(np.eye(len(levels))[codes])
+        features += [f"{name}={level}" for level in levels]
+    city_codes, city_names = pd.factorize(df["city"].to_numpy(dtype=object), sort=True)
+
+    return Dataset(np.hstack(blocks), df[target].to_numpy(dtype=np.float64), features,
+                   city_codes, list(city_names), target, dropped, numeric_columns)
+
+
+#### STATISTICS ####
+
+def correlations(ds):
+    """Pearson correlation of the target with every feature, over all rows."""
+    X = ds.X - ds.X.mean(axis=0)
+    y = ds.y - ds.y.mean()
+    denominator = np.sqrt((X * X).sum(axis=0) * (y @ y))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        r = (X.T @ y) / denominator
+    return pd.Series(r, index=ds.features, name=f"{ds.target}_correlation")
+
+
+def grouped_stats(ds, by):
+    """Count, mean and standard deviation of the target per city or per categorical feature level."""
+    if by == "city":
+        codes, levels = ds.city, ds.cities
+    elif by in CATEGORICAL:
+        columns = [i for i, f in enumerate(ds.features) if f.startswith(f"{by}=")]
+        codes = ds.X[:, columns].argmax(axis=1)
+        levels = [ds.features[i].split("=", 1)[1] for i in columns]
+    else:
+        raise ValueError(f"Cannot group by {by}. Use city or one of: {', '.join(CATEGORICAL)}")
+    n = np.bincount(codes, minlength=len(levels))
+    total = np.bincount(codes, weights=ds.y, minlength=len(levels))
+    squares = np.bincount(codes, weights=ds.y * ds.y, minlength=len(levels))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / n
+        std = np.sqrt(np.clip((squares - total * mean) / (n - 1), 0, None))
+    return pd.DataFrame({by: levels, "entries": n, "mean": mean, "std": np.where(n > 1, std, np.nan)})
+
+
+#### RIDGE REGRESSION ####
+
+def _scale(X):
+    scale = X.std(axis=0)
+    scale[scale == 0] = 1.0
+    return X / scale, scale
+
+
+def _city_sums(Xs, y, city, n_cities):
+    """Per-city row counts and sums of the features and the target."""
+    n = np.bincount(city, minlength=n_cities).astype(np.float64)
+    Sx = np.stack([np.bincount(city, weights=Xs[:, j], minlength=n_cities) for j in range(Xs.shape[1])], axis=1)
+    Sy = np.bincount(city, weights=y, minlength=n_cities)
+    return n, Sx, Sy
+
+
+def _within(XX, Xy, n, Sx, Sy):
+    """Gram matrix and moment vector after removing per-city means, from sums."""
+    known = n > 0
+    G = XX - (Sx[known].T / n[known]) @ Sx[known]
+    b = Xy - (Sx[known].T / n[known]) @ Sy[known]
+    return G, b
+
+
+def _solve(G, b, alphas):
+    """Ridge coefficients for every alpha at once, one column per alpha."""
+    eigenvalues, Q = np.linalg.eigh(G)
+    projected = Q.T @ b
+    return Q @ (projected[:, None] / (eigenvalues[:, None] + np.asarray(alphas)[None, :]))
+
+
+@stats.timed("analytics.cross_validate")
+def cross_validate(ds, alphas=ALPHAS, folds=5, seed=0):
+    """
+    Score ridge models with city intercepts by k-fold cross-validation, for
+    all alphas in one batch.
+
+    Each fold's training statistics are the totals minus the fold's own, so
+    the data is passed over once. Returns R² and RMSE per alpha, averaged
+    over the folds, best first.
+    """
+    Xs, _ = _scale(ds.X)
+    y, n_cities = ds.y, len(ds.cities)
+    fold = np.random.default_rng(seed).integers(0, folds, len(y))
+
+    total_XX, total_Xy = Xs.T @ Xs, Xs.T @ y
+    total_n, total_Sx, total_Sy = _city_sums(Xs, y, ds.city, n_cities)
+    r2, rmse = np.zeros((folds, len(alphas))), np.zeros((folds, len(alphas)))
+    for k in range(folds):
+        test = fold == k
+        Xk, yk, ck = Xs[test], y[test], ds.city[test]
+        n_k, Sx_k, Sy_k = _city_sums(Xk, yk, ck, n_cities)
+        n, Sx, Sy = total_n - n_k, total_Sx - Sx_k, total_Sy - Sy_k
+        G, b = _within(total_XX - Xk.T @ Xk, total_Xy - Xk.T @ yk, n, Sx, Sy)
+        W = _solve(G, b, alphas)
+
+        # Intercept of each city from the training rows; cities only in the test fold get the overall one
+        with np.errstate(invalid="ignore", divide="ignore"):
+            intercepts = (Sy[:, None] - Sx @ W) / n[:, None]
+        overall = (Sy.sum() - Sx.sum(axis=0) @ W) / n.sum()
+        intercepts = np.where(n[:, None] > 0, intercepts, overall[None, :])
+        predicted = Xk @ W + intercepts[ck]
+        residuals = yk[:, None] - predicted
+        rmse[k] = np.sqrt((residuals ** 2).mean(axis=0))
+        r2[k] = 1 - (residuals ** 2).sum(axis=0) / ((yk - yk.mean()) ** 2).sum()
+
+    scores = pd.DataFrame({"alpha": alphas, "r2": r2.mean(axis=0), "rmse": rmse.mean(axis=0),
+                           "r2_std": r2.std(axis=0)})
+    return scores.sort_values("r2", ascending=False, ignore_index=True)
+
+
+@stats.timed("analytics.fit")
+def fit(ds, alpha=1.0):
+    """
+    Fit a ridge model with an intercept per city on all rows.
+
+    Returns the coefficients in the units of the features (revenue per degree,
+    per m/s, per weather or weekday level) and the intercept of every city.
+    """
+    Xs, scale = _scale(ds.X)
+    n, Sx, Sy = _city_sums(Xs, ds.y, ds.city, len(ds.cities))
+    G, b = _within(Xs.T @ Xs, Xs.T @ ds.y, n, Sx, Sy)
+    w = _solve(G, b, [alpha])[:, 0]
+    intercepts = (Sy - Sx @ w) / n
+    return {
+        "alpha": alpha,
+        "coefficients": dict(zip(ds.features, (w / scale).tolist())),
+        "intercepts": dict(zip(ds.cities, intercepts.tolist())),
+    }
+
+
+#### PER CITY ####
+
+def city_breakdown(ds, alpha=1.0):
+    """
+    Per city: entries, mean and standard deviation of the target, its
+    correlation with each weather measure, and the slopes of a ridge model
+    on the weather measures fitted to the city's rows alone.
+    """
+    c, y, m = ds.city, ds.y, len(ds.cities)
+    numeric = ds.numeric
+    X = ds.X[:, :len(numeric)]
+    n = np.bincount(c, minlength=m).astype(np.float64)
+
+    def centered_sum(a, b):
+        return np.bincount(c, weights=a * b, minlength=m) - \
+            np.bincount(c, weights=a, minlength=m) * np.bincount(c, weights=b, minlength=m) / n
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        syy = centered_sum(y, y)
+        table = {"city": ds.cities, "entries": n.astype(int), "mean": np.bincount(c, weights=y, minlength=m) / n,
+                 "std": np.sqrt(np.clip(syy, 0, None) / (n - 1))}
+        # Centered cross products per city: (cities, features, features) and (cities, features)
+        G = np.empty((m, len(numeric), len(numeric)))
+        b = np.empty((m, len(numeric)))
+        for i in range(len(numeric)):
+            b[:, i] = centered_sum(X[:, i], y)
+            for j in range(i, len(numeric)):
+                G[:, i, j] = G[:, j, i] = centered_sum(X[:, i], X[:, j])
+        for i, name in enumerate(numeric):
+            table[f"corr_{name}"] = b[:, i] / np.sqrt(G[:, i, i] * syy)
+        slopes = np.linalg.solve(G + alpha * np.eye(len(numeric)), b[:, :, None])[:, :, 0]
+    for i, name in enumerate(numeric):
+        table[f"slope_{name}"] = slopes[:, i]
+    return pd.DataFrame(table)
+
+
+def report(target="revenue", city=None, alphas=ALPHAS, folds=5, hourly=False):
+    """Run the whole analysis and return it as a JSON-serializable dict, or None without usable rows."""
+    ds = load_dataset(target, city, hourly=hourly)
+    if ds is None or len(ds) < folds * 2:
+        return None
+    scores = cross_validate(ds, alphas, folds)
+    model = fit(ds, float(scores["alpha"][0]))
+    breakdown = city_breakdown(ds)
+
+    def records(df):
+        return df.astype(object).where(df.notna(), None).to_dict("records")
+
+    correlation = correlations(ds)
+    return {
+        "target": target,
+        "rows": len(ds),
+        "dropped": ds.dropped,
+        "correlations": {k: (None if np.isnan(v) else v) for k, v in correlation.items()},
+        "by_weather": records(grouped_stats(ds, "main_weather")),
+        "by_weekday": records(grouped_stats(ds, "weekday")),
+        "cross_validation": records(scores),
+        "model": model,
+        "cities": records(breakdown),
+    }
@@ -0,0 +1,269 @@
+import os
+import sqlite3
+import stat
+from datetime import date as _date
+from pathlib import Path
+from revenue_tracker import config, journal, rollups, stats, storage
+
+# Archives of closed years.
+#
+# archive_year() moves the entries of a year out of the database into a file
+# of its own next to it (data/revenues-archive/revenues-2023.db): the rows
+# of the revenues view as one flat table, the staff of every entry, the
+# hourly weather, the rollups of the year and its part of the change
+# journal, compacted and made read-only.
+# The database keeps only the years still in use, so scans, VACUUM and
+# backups no longer grow with the whole history.
+#
+# Readers attach the archives they need to their connection, read-only and
+# without locking since the files never change. Queries compile into one
+# SELECT per database joined with UNION ALL (see database._union), and only
+# the archives of the years a date filter overlaps are attached, so queries
+# on recent dates never open them. A year with an archive is closed: entries
+# are no longer added to or deleted from it.
+
+SCHEMA_PREFIX = "archive_"
+
+
+def directory():
+    path = Path(config.DATABASE_PATH)
+    return path.with_name(f"{path.stem}-archive")
+
+
+def path(year):
+    return directory() / f"{Path(config.DATABASE_PATH).stem}-{year}.db"
+
+
+def schema(year):
+    """Name of the attached archive of `year`."""
+    return f"{SCHEMA_PREFIX}{year}"
+
+
+def years(start=None, end=None):
+    """
+    The archived years, or only those overlapping the inclusive YYYY-MM-DD
+    range from `start` to `end`. Dates are compared as text, like SQLite does.
+    """
+    prefix = f"{Path(config.DATABASE_PATH).stem}-"
+    try:
+        names = [entry.name for entry in os.scandir(directory())]
+    except FileNotFoundError:
+        return []
+    found = sorted(int(name[len(prefix):-3]) for name in names
+                   if name.startswith(prefix) and name.endswith(".db") and name[len(prefix):-3].isdigit())
+    return [y for y in found if (not start or f"{y}-12-31" >= start) and (not end or f"{y}-01-01" <= end)]
+
+
+def is_archived(date):
+    """Whether the year of a YYYY-MM-DD date is archived."""
+    year = str(date)[:4]
+    return year.isdigit() and path(int(year)).exists()
+
+
+def attach(conn, years):
+    """
+    Attach the archives of `years` to a connection, if they are not already.
+    Archives attached for earlier queries stay until the connection needs
+    their slot: SQLite allows only a few attached databases at once.
+    """
+    attached = [name for _, name, _ in conn.execute("PRAGMA database_list") if name.startswith(SCHEMA_PREFIX)]
+    missing = [y for y in years if schema(y) not in attached]
+    if not missing:
+        return
+    limit = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    if len(years) > limit:
+        raise RuntimeError(f"Cannot read {len(years)} archived years at once, SQLite attaches at most {limit}. "
+                           f"Narrow the date range.")
+    wanted = {schema(y) for y in years}
+    unused = [name for name in attached if name not in wanted]
+    for name in unused[:max(0, len(attached) + len(missing) - limit)]:
+        conn.execute(f"DETACH DATABASE {name}")
+    for year in missing:
+        uri = f"{path(year).resolve().as_uri()}?mode=ro&immutable=1"
+        conn.execute(f"ATTACH DATABASE ? AS {schema(year)}", (uri,))
+        stats.incr("archive.attach")
+
+
+def year_of_id(revenue_id):
+    """The archived year holding the entry with this id, or None."""
+    for year in years():
+        conn = sqlite3.connect(f"{path(year).resolve().as_uri()}?mode=ro&immutable=1", uri=True)
+        try:
+            if conn.execute("SELECT 1 FROM revenues WHERE id = ?", (revenue_id,)).fetchone():
+                return year
+        finally:
+            conn.close()
+    return None
+
+
+def set_aside(conn):
+    """
+    Detach the archives from a connection and rename their files so that
+    they no longer count as archived. Returns the renamed files, to restore()
+    or discard() them; if one cannot be renamed, the others are restored.
+    """
+    for _, name, _ in conn.execute("PRAGMA database_list").fetchall():
+        if name.startswith(SCHEMA_PREFIX):
+            conn.execute(f"DETACH DATABASE {name}")
+    moved = []
+    try:
+        for year in years():
+            aside = path(year).with_name(f"{path(year).name}.deleted")
+            path(year).rename(aside)
+            moved.append((path(year), aside))
+    except OSError:
+        restore(moved)
+        raise
+    return moved
+
+
+def restore(moved):
+    """Put archives renamed by set_aside() back in place."""
+    for original, aside in moved:
+        aside.rename(original)
+
+
+def discard(moved):
+    """Delete archives renamed by set_aside(), and their directory once empty."""
+    for _, aside in moved:
+        try:
+            aside.unlink()
+        except OSError as e:
+            print(f"\nWARNING: could not delete {aside}: {e}. Delete it by hand.\n")
+    try:
+        directory().rmdir()
+    except OSError:
+        # Not empty, e.g. a leftover of an interrupted archiving
+        pass
+
+
+#### ARCHIVING ####
+
+def closed_years(conn, before=None):
+    """Years with entries before the year `before` (default: the current one) that are not archived yet."""
+    before = before or _date.today().year
+    if before > _date.today().year:
+        raise ValueError(f"{before - 1} is not over yet; only years before {_date.today().year} can be archived.")
+    found = conn.execute("SELECT DISTINCT substr(date, 1, 4) FROM revenue_entries WHERE date < ?",
+                         (str(before),)).fetchall()
+    archived = set(years())
+    return sorted(int(y) for (y,) in found if y and y.isdigit() and int(y) not in archived)
+
+
+def pending(conn, year):
+    """Number of entries of `year` still waiting for their weather."""
+    return conn.execute('''
+    SELECT COUNT(*) FROM weather_queue q JOIN revenue_entries e ON e.id = q.revenue_id
+    WHERE e.date >= ? AND e.date < ?
+    ''', (str(year), str(year + 1))).fetchone()[0]
+
+
+def _copy(conn, year, file):
+    """Write the entries of `year`, their staff, hourly weather and changes into the new database `file`."""
+    bounds = (str(year), str(year + 1))
+    # The columns of the view, as they are, with the id as the rowid
+    columns = [(name, type_) for _, name, type_, *_ in conn.execute("PRAGMA table_info(revenues)")]
+    definition = ", ".join("id INTEGER PRIMARY KEY" if name == "id" else f"{name} {type_}".strip()
+                           for name, type_ in columns)
+    names = ", ".join(name for name, _ in columns)
+    conn.execute("ATTACH DATABASE ? AS archive_new", (str(file),))
+    try:
+        with conn:
+            conn.execute(f"CREATE TABLE archive_new.revenues ({definition})")
+            count = conn.execute(f'''
+            INSERT INTO archive_new.revenues ({names})
+            SELECT {names} FROM main.revenues WHERE date >= ? AND date < ? ORDER BY id
+            ''', bounds).rowcount
+            conn.execute('''
+            CREATE TABLE archive_new.revenue_staff (
+                name TEXT NOT NULL,
+                revenue_id INTEGER NOT NULL,
+                PRIMARY KEY (name, revenue_id)
+            ) WITHOUT ROWID
+            ''')
+            conn.execute('''
+            INSERT OR IGNORE INTO archive_new.revenue_staff (name, revenue_id)
+            SELECT s.name, e.id FROM revenue_entries e
+            JOIN revenue_staff rs ON rs.revenue_id = e.id JOIN staff s ON s.id = rs.staff_id
+            WHERE e.date >= ? AND e.date < ?
+            ''', bounds)
+            conn.execute('''
+            CREATE TABLE archive_new.weather_series (
+                city TEXT NOT NULL,
+                date TEXT NOT NULL,
+                first_hour INTEGER NOT NULL,
+                hours BLOB NOT NULL,
+                temperature_mean REAL,
+                temperature_max REAL,
+                rain_hours INTEGER NOT NULL,
+                updated_at REAL,
+                PRIMARY KEY (city, date)
+            ) WITHOUT ROWID
+            ''')
+            conn.execute('''
+            INSERT INTO archive_new.weather_series
+            SELECT c.name, ws.date, ws.first_hour, ws.hours, ws.temperature_mean, ws.temperature_max,
+                ws.rain_hours, ws.updated_at
+            FROM weather_series ws JOIN cities c ON c.id = ws.city_id
+            WHERE ws.date >= ? AND ws.date < ?
+            ''', bounds)
+            journal.copy_changes(conn, "archive_new", *bounds)
+            conn.execute("CREATE INDEX archive_new.idx_revenues_date ON revenues (date)")
+            conn.execute("CREATE INDEX archive_new.idx_revenues_city_date ON revenues (city, date)")
+    finally:
+        conn.execute("DETACH DATABASE archive_new")
+    return count
+
+
+def _compact(file):
+    """Add the rollups of the year to the archive, then compact it."""
+    conn = sqlite3.connect(file)
+    try:
+        with conn:
+            rollups.create_tables(conn)
+            rollups.rebuild(conn)
+        conn.execute("ANALYZE")
+        conn.commit()
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+def archive_year(conn, year):
+    """
+    Move the entries of `year` into its archive. The archive is written
+    aside and put in place in the transaction deleting the entries, so an
+    interruption leaves either the year in the database or its archive.
+
+    Returns the number of entries archived.
+    """
+    target = path(year)
+    if target.exists():
+        raise ValueError(f"{year} is already archived in {target}.")
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(target.name + ".tmp")
+    tmp.unlink(missing_ok=True)
+    try:
+        count = _copy(conn, year, tmp)
+        _compact(tmp)
+        os.chmod(tmp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+
+        bounds = (str(year), str(year + 1))
+        with conn:
+            with storage.versioned_once(conn), rollups.bulk_delete(conn, "date >= ? AND date < ?", bounds):
+                conn.execute("DELETE FROM weather_queue WHERE revenue_id IN "
+                             "(SELECT id FROM revenue_entries WHERE date >= ? AND date < ?)", bounds)
+                conn.execute("DELETE FROM revenue_entries WHERE date >= ? AND date < ?", bounds)
+                conn.execute("DELETE FROM weather_observations WHERE date >= ? AND date < ?", bounds)
+                conn.execute("DELETE FROM weather_series WHERE date >= ? AND date < ?", bounds)
+                journal.remove_changes(conn, *bounds)
+            os.replace(tmp, target)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        if target.exists() and conn.execute(
+            "SELECT 1 FROM revenue_entries WHERE date >= ? AND date < ? LIMIT 1", (str(year), str(year + 1))
+        ).fetchone():
+            # The deletion was rolled back after the archive was put in place
+            target.unlink()
+        raise
+    return count
@@ -0,0 +1,184 @@
+import json
+import time
+from collections import defaultdict
+from revenue_tracker import config, database, storage, weather
+from revenue_tracker.database import WEATHER_COLUMNS
+
+# Weather backfill: fills in missing weather columns of existing rows, or
+# refreshes observations older than a given age, in batches. After every batch
+# the last processed (date, city) key is stored in backfill_checkpoints, so an
+# interrupted run continues from there when started again with the same options.
+# With config.WEATHER_HOURLY the hourly market weather of the rows is
+# collected as well, in the same transactions.
+
+JOB = "weather"
+BATCH_SIZE = 200
+DAY = 86400
+
+
+def find_pairs(conn, cutoff=None, after=None):
+    """
+    Return the (date, city) keys of rows with missing weather, in key order.
+
+    With a cutoff timestamp, rows whose weather was fetched before it (or at
+    an unknown time) are included too. `after` skips keys up to a checkpoint.
+    In hourly mode, rows without a market weather series are missing weather too.
+    """
+    clauses = [f"{column} IS NULL" for column in WEATHER_COLUMNS]
+    if config.WEATHER_HOURLY:
+        clauses.append("market_rain_hours IS NULL")
+    params = []
+    if cutoff is not None:
+        clauses.append("weather_updated_at IS NULL OR weather_updated_at < ?")
+        params.append(cutoff)
+    where = f"({' OR '.join(clauses)})"
+    if after:
+        where += " AND (date > ? OR (date = ? AND city > ?))"
+        params += [after[0], after[0], after[1]]
+    return conn.execute(
+        f"SELECT DISTINCT date, city FROM revenues WHERE {where} ORDER BY date, city", params
+    ).fetchall()
+
+
+#### CHECKPOINTS ####
+
+def _load_checkpoint(conn, job):
+    row = conn.execute(
+        "SELECT params, last_date, last_city FROM backfill_checkpoints WHERE job = ?", (job,)
+    ).fetchone()
+    if row is None:
+        return None, None
+    params, last_date, last_city = row
+    return json.loads(params), (last_date, last_city) if last_date is not None else None
+
+
+def _save_checkpoint(conn, job, params, last_key):
+    conn.execute('''
+    INSERT INTO backfill_checkpoints (job, params, last_date, last_city, updated_at) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (job) DO UPDATE SET
+        params = excluded.params,
+        last_date = excluded.last_date,
+        last_city = excluded.last_city,
+        updated_at = excluded.updated_at
+    ''', (job, json.dumps(params), *(last_key or (None, None)), time.time()))
+
+
+def clear_checkpoint(job=JOB):
+    """Forget the progress of a backfill job, so the next run starts from the beginning."""
+    conn = database.get_connection()
+    if conn and database.table_exists():
+        with conn:
+            conn.execute("DELETE FROM backfill_checkpoints WHERE job = ?", (job,))
+
+
+#### BACKFILL ####
+
+def write_weather(conn, results, fetched_at=None):
+    """
+    Store fetched weather and mark the matching rows 'ok', in one batch.
+
+    `results` maps (city, date) to the tuple returned by get_day_weather;
+    entries holding an exception are skipped. Returns the number of rows updated.
+    """
+    fetched_at = fetched_at or time.time()
+    return storage.set_weather(conn, [(city, date, *values, fetched_at) for (city, date), values in results.items()
+                                      if not isinstance(values, Exception)])
+
+
+def write_series(conn, results, fetched_at=None):
+    """
+    Store fetched market weather series, as returned by get_many_day_series;
+    entries holding an exception are skipped. Returns the number of series stored.
+    """
+    fetched_at = fetched_at or time.time()
+    return storage.set_weather_series(conn, [(city, date, *values, fetched_at)
+                                             for (city, date), values in results.items()
+                                             if not isinstance(values, Exception)])
+
+
+def run_backfill(max_age_days=None, batch_size=BATCH_SIZE, max_workers=None, restart=False,
+                 progress=True, job=JOB):
+    """
+    Fetch weather for rows where it is missing, or older than max_age_days.
+
+    Distinct (city, date) pairs are fetched concurrently through
+    weather.get_many_day_weather and written back in one transaction per
+    batch, together with the checkpoint; in hourly mode their market weather
+    series through weather.get_many_day_series as well, a pair counting as
+    failed if either fails. Returns a summary with overall
+    throughput and, per city, the number of pairs, updated rows and failures.
+    """
+    if not database.table_exists():
+        print("Revenues table does not exist.")
+        return None
+    conn = database.get_connection()
+    if not conn:
+        print("Failed to update records due to connection issues.")
+        return None
+
+    params, last_key = (None, None) if restart else _load_checkpoint(conn, job)
+    resumed = params is not None and params.get("max_age_days") == max_age_days
+    if not resumed:
+        cutoff = time.time() - max_age_days * DAY if max_age_days is not None else None
+        params, last_key = {"max_age_days": max_age_days, "cutoff": cutoff}, None
+
+    pairs = find_pairs(conn, params["cutoff"], last_key)
+    if progress:
+        state = f"resuming after {last_key[0]} {last_key[1]}" if resumed and last_key else "starting"
+        print(f"Weather backfill {state}: {len(pairs)} date/city pairs to fetch.")
+
+    cities = defaultdict(lambda: {"pairs": 0, "updated": 0, "failed": 0, "last_error": None})
+    start = time.perf_counter()
+    done = 0
+    for i in range(0, len(pairs), batch_size):
+        batch = pairs[i:i + batch_size]
+        # Refreshing stale rows must not be answered from the weather cache
+        keys = [(city, date) for date, city in batch]
+        use_cache = params["cutoff"] is None
+        results = weather.get_many_day_weather(keys, max_workers=max_workers, use_cache=use_cache)
+        series = {}
+        if config.WEATHER_HOURLY:
+            series = weather.get_many_day_series(keys, max_workers=max_workers, use_cache=use_cache)
+        with conn:
+            updated = write_weather(conn, results)
+            write_series(conn, series)
+            _save_checkpoint(conn, job, params, batch[-1])
+        for key, values in series.items():
+            if isinstance(values, Exception) and not isinstance(results[key], Exception):
+                results[key] = values
+
+        for (city, date), values in results.items():
+            stats = cities[city]
+            stats["pairs"] += 1
+            if isinstance(values, Exception):
+                stats["failed"] += 1
+                stats["last_error"] = str(values)
+            else:
+                stats["updated"] += 1
+        done += len(batch)
+        if progress:
+            elapsed = time.perf_counter() - start
+            print(f"{done}/{len(pairs)} pairs, {updated} rows updated in this batch ({done / elapsed:.1f} pairs/s)")
+
+    with conn:
+        conn.execute("DELETE FROM backfill_checkpoints WHERE job = ?", (job,))
+
+    seconds = time.perf_counter() - start
+    summary = {
+        "resumed": resumed,
+        "pairs": done,
+        "updated": sum(c["updated"] for c in cities.values()),
+        "failed": sum(c["failed"] for c in cities.values()),
+        "seconds": seconds,
+        "pairs_per_second": done / seconds if seconds and done else 0.0,
+        "cities": dict(cities),
+    }
+    if progress:
+        print(f"\nBackfilled {summary['updated']} pairs in {seconds:.1f} s "
+              f"({summary['pairs_per_second']:.1f} pairs/s), {summary['failed']} failed.")
+        for city, stats in sorted(cities.items()):
+            line = f"  {city}: {stats['updated']}/{stats['pairs']} updated"
+            if stats["failed"]:
+                line += f", {stats['failed']} failed (last error: {stats['last_error']})"
+            print(line)
+    return summary
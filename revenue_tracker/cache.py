@@ -0,0 +1,196 @@
+import json
+import time
+from contextlib import contextmanager
+from revenue_tracker import config, connection
+from revenue_tracker.utils import _norm_city
+
+# Cache tables live in the same SQLite file as the revenues table, but they are
+# independent from it: dropping revenues does not forget known coordinates.
+
+DAY = 86400
+# Observations older than this when fetched are final and never expire
+FINAL_AGE = DAY
+# Observations of the last day may still be corrected by the provider,
+# unless they were marked final or kept for longer (see prefetch.py)
+RECENT_TTL = 3600
+
+_ready = set()
+
+
+def _create_tables(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS geocode_cache (
+        city_key TEXT PRIMARY KEY,
+        lat REAL,
+        lon REAL,
+        timezone TEXT,
+        fetched_at REAL NOT NULL
+    )
+    ''')
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(geocode_cache)")]
+    if "timezone" not in columns:
+        # Cache created before timezones were stored
+        conn.execute("ALTER TABLE geocode_cache ADD COLUMN timezone TEXT")
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS weather_cache (
+        lat REAL NOT NULL,
+        lon REAL NOT NULL,
+        dt INTEGER NOT NULL,
+        payload TEXT NOT NULL,
+        fetched_at REAL NOT NULL,
+        final INTEGER NOT NULL DEFAULT 0,
+        kept_until REAL,
+        PRIMARY KEY (lat, lon, dt)
+    )
+    ''')
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(weather_cache)")]
+    if "final" not in columns:
+        # Cache created before observations could be marked final
+        conn.execute("ALTER TABLE weather_cache ADD COLUMN final INTEGER NOT NULL DEFAULT 0")
+    if "kept_until" not in columns:
+        # Cache created before observations could be kept past RECENT_TTL
+        conn.execute("ALTER TABLE weather_cache ADD COLUMN kept_until REAL")
+
+
+def _connect():
+    """Return the shared connection, creating the cache tables once per database."""
+    conn = connection.get_connection()
+    path = str(config.DATABASE_PATH)
+    if path not in _ready:
+        with conn:
+            _create_tables(conn)
+        _ready.add(path)
+    return conn
+
+
+@contextmanager
+def _transaction():
+    conn = _connect()
+    with conn:
+        yield conn
+
+
+def _location_key(lat, lon):
+    # About 10 m of precision, enough to absorb float noise from the geocoder
+    return round(lat, 4), round(lon, 4)
+
+
+#### GEOCODING CACHE ####
+
+def get_coordinates(city):
+    """
+    Look up cached coordinates for a city.
+
+    Returns (lat, lon) for a fresh positive entry, (None, None) for a fresh
+    negative entry (city known not to exist) and None on a cache miss.
+    """
+    row = _connect().execute(
+        "SELECT lat, lon, fetched_at FROM geocode_cache WHERE city_key = ?",
+        (_norm_city(city),)
+    ).fetchone()
+    if row is None:
+        return None
+
+    lat, lon, fetched_at = row
+    ttl = config.GEOCODE_TTL_DAYS if lat is not None else config.GEOCODE_NEGATIVE_TTL_DAYS
+    if time.time() - fetched_at > ttl * DAY:
+        return None
+    return lat, lon
+
+
+def set_coordinates(city, lat, lon):
+    """Store coordinates for a city. Pass lat=lon=None to cache an unknown city."""
+    with _transaction() as conn:
+        conn.execute('''
+        INSERT INTO geocode_cache (city_key, lat, lon, fetched_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT(city_key) DO UPDATE SET
+            timezone = CASE WHEN lat IS excluded.lat AND lon IS excluded.lon THEN timezone END,
+            lat = excluded.lat,
+            lon = excluded.lon,
+            fetched_at = excluded.fetched_at
+        ''', (_norm_city(city), lat, lon, time.time()))
+
+
+def invalidate_coordinates(city=None):
+    """Forget cached coordinates for one city, or for all cities if none is given."""
+    with _transaction() as conn:
+        if city is None:
+            cursor = conn.execute("DELETE FROM geocode_cache")
+        else:
+            cursor = conn.execute("DELETE FROM geocode_cache WHERE city_key = ?", (_norm_city(city),))
+        count = cursor.rowcount
+    return count
+
+
+#### TIMEZONE CACHE ####
+
+def get_timezone(lat, lon):
+    """Return the timezone stored with these coordinates, or None if unknown."""
+    row = _connect().execute(
+        "SELECT timezone FROM geocode_cache WHERE lat = ? AND lon = ? AND timezone IS NOT NULL LIMIT 1",
+        (lat, lon)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def set_timezone(lat, lon, tz_name):
+    """Store the timezone for every cached city at these coordinates."""
+    with _transaction() as conn:
+        conn.execute(
+            "UPDATE geocode_cache SET timezone = ? WHERE lat = ? AND lon = ?",
+            (tz_name, lat, lon)
+        )
+
+
+#### WEATHER CACHE ####
+
+def get_observation(lat, lon, dt):
+    """Return the cached timemachine payload for a location and UTC timestamp, or None."""
+    row = _connect().execute(
+        "SELECT payload, fetched_at, final, kept_until FROM weather_cache WHERE lat = ? AND lon = ? AND dt = ?",
+        (*_location_key(lat, lon), dt)
+    ).fetchone()
+    if row is None:
+        return None
+
+    payload, fetched_at, final, kept_until = row
+    now = time.time()
+    if (not final and fetched_at - dt < FINAL_AGE and now - fetched_at > RECENT_TTL
+            and (kept_until is None or now > kept_until)):
+        return None
+    return json.loads(payload)
+
+
+def observation_state(lat, lon, dt):
+    """'final' or 'recent' for a cached observation, expired or not, or None if there is none."""
+    row = _connect().execute(
+        "SELECT fetched_at, final FROM weather_cache WHERE lat = ? AND lon = ? AND dt = ?",
+        (*_location_key(lat, lon), dt)
+    ).fetchone()
+    if row is None:
+        return None
+    fetched_at, final = row
+    return "final" if final or fetched_at - dt >= FINAL_AGE else "recent"
+
+
+def keep_observation(lat, lon, dt, until):
+    """Keep a cached recent observation until the timestamp `until` instead of RECENT_TTL."""
+    with _transaction() as conn:
+        conn.execute("UPDATE weather_cache SET kept_until = ? WHERE lat = ? AND lon = ? AND dt = ?",
+                     (until, *_location_key(lat, lon), dt))
+
+
+def finalize_observation(lat, lon, dt):
+    """Keep a cached observation for good, like one fetched a day after its time."""
+    with _transaction() as conn:
+        conn.execute("UPDATE weather_cache SET final = 1 WHERE lat = ? AND lon = ? AND dt = ?",
+                     (*_location_key(lat, lon), dt))
+
+
+def set_observation(lat, lon, dt, payload):
+    """Store a timemachine payload for a location and UTC timestamp."""
+    with _transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO weather_cache (lat, lon, dt, payload, fetched_at) VALUES (?, ?, ?, ?, ?)",
+            (*_location_key(lat, lon), dt, json.dumps(payload, separators=(",", ":")), time.time())
+        )
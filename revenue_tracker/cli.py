@@ -0,0 +1,523 @@
+"""
+Command line interface for scripted and batch use.
+
+Data is written to stdout in CSV, JSON or NDJSON; messages and progress go
+to stderr. The exit code tells how the command went:
+
+    0  success
+    1  error (database, file or network failure)
+    2  invalid arguments or input
+    3  nothing found (no table, no matching rows)
+    4  partial success (some rows were not inserted)
+"""
+import argparse
+import contextlib
+import csv
+import json
+import sys
+import time
+from datetime import datetime
+from revenue_tracker import database, cache, config, stats
+from revenue_tracker.utils import validate_date
+
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_USAGE = 2
+EXIT_NOT_FOUND = 3
+EXIT_PARTIAL = 4
+
+FORMATS = ["csv", "json", "ndjson"]
+
+
+#### OUTPUT ####
+
+def _records(df):
+    """Convert a DataFrame to a list of dicts with None for missing values."""
+    return df.astype(object).where(df.notna(), None).to_dict("records")
+
+
+def write_frames(frames, fmt, out):
+    """Stream DataFrames to `out` as one CSV, JSON or NDJSON document. Returns the number of rows."""
+    count = 0
+    if fmt == "json":
+        out.write("[")
+    for df in frames:
+        if fmt == "csv":
+            df.to_csv(out, header=count == 0, index=False)
+            count += len(df)
+            continue
+        for record in _records(df):
+            line = json.dumps(record, ensure_ascii=False)
+            if fmt == "json":
+                out.write(("\n" if count == 0 else ",\n") + line)
+            else:
+                out.write(line + "\n")
+            count += 1
+    if fmt == "json":
+        out.write("\n]\n" if count else "]\n")
+    out.flush()
+    return count
+
+
+def _read_rows(stream, fmt):
+    """Yield dicts from CSV (with header) or NDJSON input."""
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+#### COMMANDS ####
+
+def _float_or_none(value):
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    return float(value)
+
+
+def cmd_add(args):
+    if args.stdin:
+        rows = _read_rows(sys.stdin, args.input_format)
+    else:
+        if not (args.date and args.city):
+            print("add: give DATE and CITY, or --stdin", file=sys.stderr)
+            return EXIT_USAGE
+        rows = [{"date": args.date, "city": args.city, "declared_revenue": args.declared_revenue,
+                 "revenue": args.revenue, "kind": args.kind, "who": args.who, "notes": args.notes}]
+
+    database.create_table()
+    inserted = failed = 0
+    for line, row in enumerate(rows, start=1):
+        date, city = (row.get("date") or "").strip(), (row.get("city") or "").strip()
+        try:
+            if not city or not validate_date(date):
+                raise ValueError("a valid date (YYYY-MM-DD) and a city are required")
+            ok = database.add_revenue(
+                date, city,
+                _float_or_none(row.get("declared_revenue")),
+                _float_or_none(row.get("revenue")),
+                row.get("kind") or "ordinary",
+                row.get("who") or None,
+                row.get("notes") or None,
+            )
+        except ValueError as e:
+            print(f"Row {line}: {e}", file=sys.stderr)
+            ok = False
+        if ok:
+            inserted += 1
+        else:
+            failed += 1
+
+    result = {"inserted": inserted, "failed": failed}
+    if inserted and not args.no_enrich:
+        from revenue_tracker import enrichment
+        result["weather"] = enrichment.drain_queue()
+    print(json.dumps(result), file=args.out)
+    if failed:
+        return EXIT_PARTIAL if inserted else EXIT_ERROR
+    return EXIT_OK
+
+
+def cmd_import(args):
+    from revenue_tracker import importer  # loads pandas
+    try:
+        summary = importer.import_revenues(args.path, chunksize=args.chunksize, progress=not args.quiet)
+    except FileNotFoundError as e:
+        print(e, file=sys.stderr)
+        return EXIT_ERROR
+    except (ValueError, RuntimeError) as e:
+        print(f"Import failed: {e}", file=sys.stderr)
+        return EXIT_USAGE
+    if summary is None:
+        return EXIT_ERROR
+    print(json.dumps(summary), file=args.out)
+    return EXIT_PARTIAL if summary["invalid"] or summary["archived"] else EXIT_OK
+
+
+def cmd_query(args):
+    if not database.table_exists():
+        print("Revenues table does not exist.", file=sys.stderr)
+        return EXIT_NOT_FOUND
+
+    filters = {
+        "city": args.city, "start": args.start, "end": args.end, "weekday": args.weekday,
+        "kind": args.kind, "who": args.who, "weather": args.weather,
+    }
+    filters = {k: v for k, v in filters.items() if v}
+    if args.columns and (args.group_by or args.aggregate):
+        print("query: --columns selects columns of entries, not of --group-by or --aggregate totals",
+              file=sys.stderr)
+        return EXIT_USAGE
+    if filters or args.group_by or args.aggregate:
+        try:
+            df = database.query_revenues(**filters, group_by=args.group_by, aggregate=args.aggregate)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return EXIT_USAGE
+        frames = [df[args.columns] if args.columns else df]
+    else:
+        # The whole table is streamed in chunks, in constant memory
+        frames = database.iter_revenues(batch_size=args.batch_size, columns=args.columns)
+
+    count = write_frames(frames, args.format, args.out)
+    return EXIT_OK if count else EXIT_NOT_FOUND
+
+
+def cmd_delete(args):
+    if not database.table_exists():
+        print("Revenues table does not exist.", file=sys.stderr)
+        return EXIT_NOT_FOUND
+    if args.all:
+        if not args.yes:
+            print("delete --all needs --yes to confirm", file=sys.stderr)
+            return EXIT_USAGE
+        if not database.del_table(archives=args.archives):
+            return EXIT_USAGE
+        count = None
+    elif args.id is not None:
+        count = database.del_revenue_by_id(args.id)
+    elif args.date and args.city:
+        count = database.del_revenue_by_date(args.date, args.city)
+    else:
+        print("delete: give --id, --date with --city, or --all", file=sys.stderr)
+        return EXIT_USAGE
+    print(json.dumps({"deleted": count if count is not None else "all"}), file=args.out)
+    return EXIT_NOT_FOUND if count == 0 else EXIT_OK
+
+
+def cmd_backfill(args):
+    from revenue_tracker import backfill
+    summary = backfill.run_backfill(max_age_days=args.max_age_days, batch_size=args.batch_size,
+                                    max_workers=args.workers, restart=args.restart, progress=not args.quiet)
+    if summary is None:
+        return EXIT_NOT_FOUND
+    print(json.dumps(summary), file=args.out)
+    if summary["failed"]:
+        return EXIT_PARTIAL if summary["updated"] else EXIT_ERROR
+    return EXIT_OK
+
+
+def cmd_enrich(args):
+    from revenue_tracker import enrichment
+    summary = enrichment.drain_queue(max_items=args.limit, max_workers=args.workers)
+    summary["pending"] = enrichment.pending_count()
+    print(json.dumps(summary), file=args.out)
+    if summary["retry"] or summary["failed"]:
+        return EXIT_PARTIAL if summary["enriched"] else EXIT_ERROR
+    return EXIT_OK
+
+
+def cmd_prefetch(args):
+    from revenue_tracker import prefetch
+    while True:
+        summary = prefetch.prefetch(start=args.start, end=args.end, max_workers=args.workers)
+        print(json.dumps(summary), file=args.out, flush=True)
+        if args.watch is None:
+            break
+        time.sleep(args.watch)
+    return EXIT_PARTIAL if summary["failed"] else EXIT_OK
+
+
+def cmd_clear_geocache(args):
+    count = cache.invalidate_coordinates(args.city)
+    print(json.dumps({"removed": count}), file=args.out)
+    return EXIT_OK
+
+
+def cmd_analyze(args):
+    from revenue_tracker import analytics  # loads numpy and pandas
+    if not database.table_exists():
+        print("Revenues table does not exist.", file=sys.stderr)
+        return EXIT_NOT_FOUND
+    result = analytics.report(args.target, city=args.city, alphas=args.alphas, folds=args.folds,
+                              hourly=args.hourly)
+    if result is None:
+        print("Not enough revenues with weather data to analyze.", file=sys.stderr)
+        return EXIT_NOT_FOUND
+    print(json.dumps(result, indent=2, ensure_ascii=False), file=args.out)
+    return EXIT_OK
+
+
+def cmd_rollups(args):
+    if not database.table_exists():
+        print("Revenues table does not exist.", file=sys.stderr)
+        return EXIT_NOT_FOUND
+    if args.rebuild:
+        database.rebuild_rollups()
+        print("Rollups rebuilt.", file=sys.stderr)
+        if not args.by:
+            return EXIT_OK
+    df = database.get_rollups(args.by or "weekday", city=args.city)
+    count = write_frames([df], args.format, args.out)
+    return EXIT_OK if count else EXIT_NOT_FOUND
+
+
+def cmd_snapshot(args):
+    from revenue_tracker import snapshot  # loads pyarrow
+    if not database.table_exists():
+        print("Revenues table does not exist.", file=sys.stderr)
+        return EXIT_NOT_FOUND
+    try:
+        summary = snapshot.export_snapshot(args.path, args.format, partition_by=args.partition_by, full=args.full)
+    except (ValueError, RuntimeError) as e:
+        print(f"Snapshot failed: {e}", file=sys.stderr)
+        return EXIT_USAGE
+    if summary is None:
+        return EXIT_ERROR
+    print(json.dumps(summary), file=args.out)
+    return EXIT_OK
+
+
+def cmd_serve(args):
+    from revenue_tracker import server
+    api = server.ApiServer(args.host, args.port)
+    print(f"Serving revenues on http://{api.host}:{api.port} (Ctrl+C to stop)", file=sys.stderr)
+    api.serve_forever()
+    return EXIT_OK
+
+
+def cmd_archive(args):
+    if not database.table_exists():
+        print("Revenues table does not exist.", file=sys.stderr)
+        return EXIT_NOT_FOUND
+    try:
+        summary = database.archive_years(before=args.before, vacuum=args.vacuum)
+    except ValueError as e:
+        print(f"Archive failed: {e}", file=sys.stderr)
+        return EXIT_USAGE
+    if summary is None:
+        return EXIT_ERROR
+    print(json.dumps(summary), file=args.out)
+    return EXIT_PARTIAL if summary["skipped"] else EXIT_OK
+
+
+def cmd_sync(args):
+    from revenue_tracker import sync
+    try:
+        if args.action == "export":
+            summary = sync.export_delta(args.path, peer=args.peer, full=args.full)
+        elif args.action == "apply":
+            summary = sync.apply_delta(args.path)
+        else:
+            summary = sync.sync_status()
+    except FileNotFoundError as e:
+        print(f"Sync failed: {e}", file=sys.stderr)
+        return EXIT_NOT_FOUND
+    except (ValueError, OSError) as e:
+        print(f"Sync failed: {e}", file=sys.stderr)
+        return EXIT_USAGE if isinstance(e, ValueError) else EXIT_ERROR
+    if summary is None:
+        return EXIT_NOT_FOUND
+    print(json.dumps(summary), file=args.out)
+    return EXIT_OK
+
+
+def cmd_stats(args):
+    path = args.file or config.STATS_FILE
+    if not path:
+        print("stats: give --file or set STATS_FILE", file=sys.stderr)
+        return EXIT_USAGE
+    try:
+        snapshots = stats.read_snapshots(path)
+    except FileNotFoundError:
+        print(f"No statistics file at {path}", file=sys.stderr)
+        return EXIT_NOT_FOUND
+    if not snapshots:
+        return EXIT_NOT_FOUND
+    if not args.all:
+        snapshots = snapshots[-1:]
+    for data in snapshots:
+        if args.format == "json":
+            print(json.dumps(data), file=args.out)
+        else:
+            since = datetime.fromtimestamp(data["since"]).isoformat(sep=" ", timespec="seconds")
+            until = datetime.fromtimestamp(data["time"]).isoformat(sep=" ", timespec="seconds")
+            print(f"Recorded from {since} to {until}\n{stats.format_snapshot(data)}\n", file=args.out)
+    return EXIT_OK
+
+
+#### PARSER ####
+
+def _date(value):
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date '{value}', use YYYY-MM-DD")
+    return value
+
+
+def _list(value):
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def _columns(value):
+    columns = _list(value)
+    unknown = [c for c in columns if c not in database.REVENUE_COLUMNS]
+    if unknown:
+        raise argparse.ArgumentTypeError(
+            f"unknown column(s) {', '.join(unknown)}, use: {', '.join(database.REVENUE_COLUMNS)}")
+    return columns
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="main.py", description="Revenue tracker with weather data.",
+                                     epilog="Run without arguments for the interactive menu.")
+    parser.add_argument("--stats", action="store_true", help="print timings and counters to stderr at the end")
+    parser.add_argument("--stats-file", help="append timings and counters to this JSON lines file "
+                                             "(every STATS_INTERVAL seconds and at the end)")
+    parser.add_argument("--profile", metavar="PATH", help="run the command under cProfile and save the statistics")
+    parser.add_argument("--tracemalloc", action="store_true", help="report peak memory and top allocations")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("add", help="add one revenue, or many from stdin")
+    p.add_argument("date", nargs="?", type=_date)
+    p.add_argument("city", nargs="?")
+    p.add_argument("declared_revenue", nargs="?", type=float)
+    p.add_argument("--revenue", type=float)
+    p.add_argument("--kind", default="ordinary")
+    p.add_argument("--who")
+    p.add_argument("--notes")
+    p.add_argument("--stdin", action="store_true", help="read rows from stdin instead of the arguments")
+    p.add_argument("--input-format", choices=["csv", "ndjson"], default="ndjson")
+    p.add_argument("--no-enrich", action="store_true", help="leave the weather of new rows queued")
+    p.set_defaults(func=cmd_add)
+
+    p = sub.add_parser("import", help="bulk import a CSV or Parquet file")
+    p.add_argument("path")
+    p.add_argument("--chunksize", type=int, default=10000)
+    p.add_argument("--quiet", action="store_true", help="do not report progress")
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser("query", help="print revenues, filtered or aggregated")
+    p.add_argument("--city", type=_list)
+    p.add_argument("--start", type=_date)
+    p.add_argument("--end", type=_date)
+    p.add_argument("--weekday", type=_list)
+    p.add_argument("--kind", type=_list)
+    p.add_argument("--who")
+    p.add_argument("--weather", type=_list)
+    p.add_argument("--group-by", type=_list, help="comma separated: city, month, weekday, weather")
+    p.add_argument("--aggregate", action="store_true", help="totals over all matching rows")
+    p.add_argument("--columns", type=_columns, help="columns of the entries to print")
+    p.add_argument("--batch-size", type=int, default=5000)
+    p.add_argument("--format", choices=FORMATS, default="csv")
+    p.set_defaults(func=cmd_query)
+
+    p = sub.add_parser("delete", help="delete revenues")
+    p.add_argument("--id", type=int)
+    p.add_argument("--date", type=_date)
+    p.add_argument("--city")
+    p.add_argument("--all", action="store_true", help="delete the whole table")
+    p.add_argument("--archives", action="store_true", help="with --all, also delete the archived years")
+    p.add_argument("--yes", action="store_true")
+    p.set_defaults(func=cmd_delete)
+
+    p = sub.add_parser("backfill", help="fetch weather for rows where it is missing or stale")
+    p.add_argument("--max-age-days", type=float, help="also refresh weather fetched more than this many days ago")
+    p.add_argument("--batch-size", type=int, default=200, help="pairs written per transaction and checkpoint")
+    p.add_argument("--workers", type=int, help="concurrent weather requests")
+    p.add_argument("--restart", action="store_true", help="ignore the checkpoint of an interrupted run")
+    p.add_argument("--quiet", action="store_true", help="do not report progress")
+    p.set_defaults(func=cmd_backfill)
+
+    p = sub.add_parser("enrich", help="fetch weather for queued rows")
+    p.add_argument("--limit", type=int, help="process at most this many rows")
+    p.add_argument("--workers", type=int, help="concurrent weather requests")
+    p.set_defaults(func=cmd_enrich)
+
+    p = sub.add_parser("prefetch", help="fetch the weather of the market days in who_defaults.json ahead of entry")
+    p.add_argument("--start", type=_date, help="first day (default: yesterday)")
+    p.add_argument("--end", type=_date, help="last day (default: today)")
+    p.add_argument("--workers", type=int, help="concurrent weather requests")
+    p.add_argument("--watch", type=float, metavar="SECONDS", help="run again every SECONDS until interrupted")
+    p.set_defaults(func=cmd_prefetch)
+
+    p = sub.add_parser("clear-geocache", help="forget cached city coordinates")
+    p.add_argument("--city", help="only this city")
+    p.set_defaults(func=cmd_clear_geocache)
+
+    p = sub.add_parser("analyze", help="correlate revenues with weather and fit a regression model")
+    p.add_argument("--target", choices=["revenue", "declared_revenue"], default="revenue")
+    p.add_argument("--city", type=_list, help="only these cities")
+    p.add_argument("--folds", type=int, default=5, help="cross-validation folds")
+    p.add_argument("--alphas", type=lambda v: [float(a) for a in _list(v)], default=[0.01, 0.1, 1.0, 10.0, 100.0],
+                   help="comma separated ridge penalties to compare")
+    p.add_argument("--hourly", action="store_true",
+                   help="add the market hour weather aggregates as features (rows without them are left out)")
+    p.set_defaults(func=cmd_analyze)
+
+    p = sub.add_parser("rollups", help="print revenue statistics per city and weekday, month or weather")
+    p.add_argument("--by", choices=["weekday", "month", "weather"], help="default: weekday")
+    p.add_argument("--city", type=_list)
+    p.add_argument("--rebuild", action="store_true", help="recompute the rollups from all revenues first")
+    p.add_argument("--format", choices=FORMATS, default="csv")
+    p.set_defaults(func=cmd_rollups)
+
+    p = sub.add_parser("snapshot", help="write the revenues added since the last snapshot as Parquet or Arrow files")
+    p.add_argument("path", help="snapshot directory")
+    p.add_argument("--format", choices=["parquet", "arrow"], default="parquet")
+    p.add_argument("--partition-by", type=_list, help="comma separated: year (default) or city,year")
+    p.add_argument("--full", action="store_true", help="rewrite the whole snapshot instead of appending")
+    p.set_defaults(func=cmd_snapshot)
+
+    p = sub.add_parser("serve", help="serve the revenues as a read-only JSON/NDJSON HTTP API for dashboards")
+    p.add_argument("--host", help="address to listen on (default: API_HOST or 127.0.0.1)")
+    p.add_argument("--port", type=int, help="port to listen on (default: API_PORT or 8080)")
+    p.set_defaults(func=cmd_serve)
+
+    p = sub.add_parser("archive", help="move closed years into read-only archive files, one per year")
+    p.add_argument("--before", type=int, help="archive the years before this one (default: the current year)")
+    p.add_argument("--vacuum", action="store_true", help="compact the database file afterwards")
+    p.set_defaults(func=cmd_archive)
+
+    p = sub.add_parser("sync", help="exchange changes with other copies of the database through delta files")
+    actions = p.add_subparsers(dest="action", required=True)
+    a = actions.add_parser("export", help="write the changes not yet sent to a peer")
+    a.add_argument("path", help="delta file to write (gzipped NDJSON)")
+    a.add_argument("--peer", help="name of the receiving copy; later exports to it only hold newer changes")
+    a.add_argument("--full", action="store_true", help="write every change, even those already sent")
+    a = actions.add_parser("apply", help="apply a delta file from another copy")
+    a.add_argument("path")
+    actions.add_parser("status", help="print the node id, the changes known and those not yet sent to each peer")
+    p.set_defaults(func=cmd_sync)
+
+    p = sub.add_parser("stats", help="show timings and counters saved with --stats-file or STATS_FILE")
+    p.add_argument("--file", help="JSON lines file to read (default: STATS_FILE)")
+    p.add_argument("--all", action="store_true", help="every saved snapshot, not only the last")
+    p.add_argument("--format", choices=["text", "json"], default="text")
+    p.set_defaults(func=cmd_stats)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.out = sys.stdout
+    stats_file = None
+    if args.command != "stats":
+        stats_file = args.stats_file or config.STATS_FILE
+        if args.stats or stats_file:
+            stats.enable()
+        if stats_file:
+            stats.start_writer(stats_file, config.STATS_INTERVAL)
+    try:
+        # The database functions report problems with print(); keep stdout for data
+        with contextlib.redirect_stdout(sys.stderr), contextlib.ExitStack() as stack:
+            if args.profile:
+                stack.enter_context(stats.profiled(args.profile, sys.stderr))
+            if args.tracemalloc:
+                stack.enter_context(stats.traced_memory(sys.stderr))
+            return args.func(args)
+    except BrokenPipeError:
+        # The reader (e.g. head) stopped early
+        return EXIT_OK
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return EXIT_ERROR
+    finally:
+        if stats_file:
+            stats.stop_writer()
+        if args.stats:
+            print(stats.format_snapshot(stats.snapshot()), file=sys.stderr)
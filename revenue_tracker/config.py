@@ -0,0 +1,86 @@
+import os
+from pathlib import Path
+
+# Shared configuration for the database, the caches and the weather client.
+#
+# Settings are read from the environment and the .env file the first time one
+# of them is used, not when the module is imported, so that starting the
+# program does not pay for python-dotenv and works without an API key.
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+DEFAULT_DB_PATH = PROJECT_ROOT / "data" / "revenues.db"
+DEFAULT_WHO_DEFAULTS_PATH = PROJECT_ROOT / "revenue_tracker" / "who_defaults.json"
+
+_loaded = False
+
+
+def _path(name, default):
+    env_path = os.environ.get(name)
+    if env_path:
+        p = Path(env_path)
+        path = p if p.is_absolute() else PROJECT_ROOT / p
+    else:
+        path = default
+    return path.resolve()
+
+
+def load():
+    """Read the .env file and the environment. Settings assigned by the program are kept."""
+    global _loaded
+    if _loaded:
+        return
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    settings = {
+        "DATABASE_PATH": _path("DATABASE_PATH", DEFAULT_DB_PATH),
+        # Default personnel rules, reloaded whenever the file changes
+        "WHO_DEFAULTS_PATH": _path("WHO_DEFAULTS_PATH", DEFAULT_WHO_DEFAULTS_PATH),
+        "OPENWEATHER_API_KEY": os.environ.get("OPENWEATHER_API_KEY"),
+        # Point the weather client at another server, e.g. the benchmark stand-in
+        "OPENWEATHER_BASE_URL": os.environ.get("OPENWEATHER_BASE_URL", "https://api.openweathermap.org").rstrip("/"),
+        # Geocoding cache lifetimes, in days. Unknown cities are retried sooner.
+        "GEOCODE_TTL_DAYS": float(os.environ.get("GEOCODE_TTL_DAYS", 90)),
+        "GEOCODE_NEGATIVE_TTL_DAYS": float(os.environ.get("GEOCODE_NEGATIVE_TTL_DAYS", 1)),
+        # OpenWeather client: request budget, retries and concurrency
+        "OPENWEATHER_REQUESTS_PER_MINUTE": float(os.environ.get("OPENWEATHER_REQUESTS_PER_MINUTE", 60)),
+        "OPENWEATHER_MAX_RETRIES": int(os.environ.get("OPENWEATHER_MAX_RETRIES", 4)),
+        "OPENWEATHER_WORKERS": int(os.environ.get("OPENWEATHER_WORKERS", 8)),
+        "OPENWEATHER_TIMEOUT": float(os.environ.get("OPENWEATHER_TIMEOUT", 10)),
+        # Hourly weather over the market hours, from the opening to the closing hour (local time)
+        "WEATHER_HOURLY": os.environ.get("WEATHER_HOURLY", "0").lower() in ("1", "true", "yes"),
+        "MARKET_OPEN_HOUR": int(os.environ.get("MARKET_OPEN_HOUR", 8)),
+        "MARKET_CLOSE_HOUR": int(os.environ.get("MARKET_CLOSE_HOUR", 14)),
+        # Warm the weather caches for the market days of the personnel rules in the interactive menu
+        "WEATHER_PREFETCH": os.environ.get("WEATHER_PREFETCH", "0").lower() in ("1", "true", "yes"),
+        # Read-only HTTP API (serve command); use API_HOST=0.0.0.0 to reach it from other devices
+        "API_HOST": os.environ.get("API_HOST", "127.0.0.1"),
+        "API_PORT": int(os.environ.get("API_PORT", 8080)),
+        # Instrumentation: JSON lines file receiving a snapshot every STATS_INTERVAL seconds
+        "STATS_FILE": os.environ.get("STATS_FILE") or None,
+        "STATS_INTERVAL": float(os.environ.get("STATS_INTERVAL", 60)),
+    }
+    for name, value in settings.items():
+        globals().setdefault(name, value)
+    _loaded = True
+
+
+def __getattr__(name):
+    # Called only for settings that are not loaded yet
+    if not _loaded and not name.startswith("__"):
+        load()
+        if name in globals():
+            return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_api_key():
+    """Return the OpenWeather API key, failing only when weather data is actually needed."""
+    load()
+    api_key = globals()["OPENWEATHER_API_KEY"]
+    if not api_key:
+        raise RuntimeError(
+            "Missing OPENWEATHER_API_KEY. "
+            "Create a .env file in the project root."
+        )
+    return api_key
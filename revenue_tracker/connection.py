@@ -0,0 +1,77 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from revenue_tracker import config, stats
+
+# Connections are opened once per thread and reused for the life of the process.
+# SQLite connections cannot be shared between threads, so each worker thread
+# (weather enrichment, background jobs) gets its own.
+
+MMAP_SIZE = 256 * 1024 * 1024  # bytes of the database file mapped in memory
+CACHED_STATEMENTS = 256  # prepared statements kept per connection
+BUSY_TIMEOUT = 30  # seconds to wait for a lock held by another connection
+
+_local = threading.local()
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+@stats.timed("db.connect")
+def _open(path):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, cached_statements=CACHED_STATEMENTS)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def get_connection():
+    """Return the connection of the current thread, opening it on first use."""
+    path = str(config.DATABASE_PATH)
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.path == path:
+        return conn
+    if conn is not None:
+        # The database path changed since the connection was opened
+        conn.close()
+    _local.conn = _open(path)
+    _local.path = path
+    return _local.conn
+
+
+@contextmanager
+def transaction():
+    """Yield the thread's connection; commit on success and roll back on error."""
+    conn = get_connection()
+    with conn:
+        yield conn
+
+
+def close_connection():
+    """Close the connection of the current thread, if any."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+#### TABLE EXISTENCE CACHE ####
+
+def table_exists(name):
+    """Check if a table or view exists, asking SQLite only the first time for each database and name."""
+    key = (str(config.DATABASE_PATH), name)
+    exists = _tables.get(key)
+    if exists is None:
+        exists = get_connection().execute(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'view') AND name=?", (name,)
+        ).fetchone() is not None
+        with _tables_lock:
+            _tables[key] = exists
+    return exists
+
+
+def forget_table(name):
+    """Invalidate the cached existence of a table after creating or dropping it."""
+    with _tables_lock:
+        _tables.pop((str(config.DATABASE_PATH), name), None)
@@ -1,116 +1,107 @@
 import sqlite3
-import os
-from pathlib import Path
-from dotenv import load_dotenv
-from datetime import datetime
-import pandas as pd
-from revenue_tracker.weather import get_day_weather
+import time
+from revenue_tracker import archive, config, connection, journal, migrations, rollups, stats, storage
 from revenue_tracker.utils import default_who
 
-# Path to your database file
-load_dotenv()
+# pandas is imported by the read functions that build DataFrames, so that
+# starting the program and inserting or deleting rows do not load it.
 
-PROJECT_ROOT = Path(__file__).resolve().parents[1]
-DEFAULT_DB_PATH = PROJECT_ROOT / "data" / "revenues.db"
+REVENUE_COLUMNS = [
+    "id", "date", "city", "revenue", "declared_revenue", "kind", "who",
+    "temperature", "temperature_felt", "wind_speed", "main_weather", "weather_description", "notes",
+    "weather_updated_at", "weather_status",
+    "market_temperature_mean", "market_temperature_max", "market_rain_hours",
+]
 
-env_db = os.environ.get("DATABASE_PATH")
-
-if env_db:
-    p = Path(env_db)
-    DATABASE_PATH = p if p.is_absolute() else PROJECT_ROOT / p
-else:
-    DATABASE_PATH = DEFAULT_DB_PATH
-
-DATABASE_PATH = DATABASE_PATH.resolve()
+WEATHER_COLUMNS = migrations.WEATHER_COLUMNS
 
 ####### DATABASE CONNECTION #######
 def create_connection():
-    """Establish a connection to the SQLite database only if the database exists."""
+    """Open a new, caller-owned connection to the SQLite database with the tuned pragmas."""
+    try:
+        conn = connection._open(str(config.DATABASE_PATH))
+        return conn
+    except sqlite3.Error as e:
+        print(f"Error connecting to database: {e}")
+        return None
+
+_upgraded = set()
+
+def get_connection():
+    """Return the shared connection of the current thread, or None if the database cannot be opened."""
     try:
-        conn = sqlite3.connect(str(DATABASE_PATH))
+        conn = connection.get_connection()
+        path = str(config.DATABASE_PATH)
+        if path not in _upgraded:
+            # Bring an existing revenues table up to the current schema
+            if connection.table_exists("revenues"):
+                migrations.migrate(conn)
+            _upgraded.add(path)
         return conn
     except sqlite3.Error as e:
         print(f"Error connecting to database: {e}")
         return None
-    
+
 def table_exists():
     """Check if the revenues table exists in the database."""
-    conn = create_connection()
-    if conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT name FROM sqlite_master WHERE type='table' AND name='revenues'"
-        )
-        exists = cursor.fetchone() is not None
-        conn.close()
-        return exists
-    return False
+    try:
+        return connection.table_exists("revenues")
+    except sqlite3.Error as e:
+        print(f"Error connecting to database: {e}")
+        return False
 
 #### CREATE FUNCTIONS ####
 
+@stats.timed("db.create_table")
 def create_table():
     """Create the table if it does not exist."""
-    conn = create_connection()
+    conn = get_connection()
     if conn:
-        cursor = conn.cursor()
-        exists = cursor.execute(
-            "SELECT name FROM sqlite_master WHERE type='table' AND name='revenues'"
-        ).fetchone()
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS revenues (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            date TEXT,
-            city TEXT,
-            revenue REAL DEFAULT NULL,
-            declared_revenue REAL,
-            kind TEXT,
-            who TEXT,
-            temperature REAL,
-            temperature_felt REAL,
-            wind_speed REAL,
-            main_weather TEXT,
-            weather_description TEXT,
-            notes TEXT DEFAULT NULL
-        )
-        ''')
-        conn.commit()
-        conn.close()
+        exists = table_exists()
+        migrations.migrate(conn)
+        connection.forget_table("revenues")
         if not exists:
             print("Table 'revenues' created.")
     else:
         print("Failed to create table due to connection issues.")
 
+def enqueue_weather(conn, ids):
+    """Queue revenue rows for weather enrichment. Runs in the caller's transaction."""
+    now = time.time()
+    conn.executemany(
+        "INSERT OR IGNORE INTO weather_queue (revenue_id, next_attempt_at, enqueued_at) VALUES (?, ?, ?)",
+        [(i, now, now) for i in ids]
+    )
+
+@stats.timed("db.add_revenue")
 def add_revenue(date, city, declared_revenue, revenue=None, kind='ordinary', who=None, notes=None):
-    """Insert an income entry into the database."""
-    conn = create_connection()
+    """
+    Insert an income entry into the database.
+
+    The entry is saved right away with weather_status 'pending' and queued
+    for weather enrichment (see revenue_tracker.enrichment), so inserting
+    never waits for or depends on the weather service.
+    """
+    if archive.is_archived(date):
+        print(f"\nThe year of {date} is archived; its entries cannot be changed.\n")
+        return
+    conn = get_connection()
     if conn:
-        cursor = conn.cursor()
-        
-        # Assuming get_today_weather() returns these values:
-        # (day_temp, day_felt_temp, wind_speed, main_weather, weather_description)
-        try:
-            day_temp, day_felt_temp, wind_speed, main_weather, weather_description = get_day_weather(city, date)
-        except Exception as e:
-            print(f"Failed to retrieve weather data: {e}")
-            conn.close()
-            return
-        
         # Assign default values for 'chi' if not provided
-        day_of_week = (datetime.strptime(date, "%Y-%m-%d")).strftime("%A")  # Get the day of the week
         if who is None:
             who = default_who(city, date)
-        
-        if cursor.execute("SELECT * FROM revenues WHERE date = ? AND city = ?", (date, city)).fetchone():
+
+        with conn:
+            [revenue_id] = storage.insert_entries(conn, [{
+                "date": date, "city": city, "revenue": revenue, "declared_revenue": declared_revenue,
+                "kind": kind, "who": who, "notes": notes, "weather_status": "pending",
+            }])
+            if revenue_id:
+                enqueue_weather(conn, [revenue_id])
+                journal.record_inserts(conn, [revenue_id])
+        if not revenue_id:
             print(f"\nRecord for date {date} and city '{city}' already exists.\n")
             return
-
-        cursor.execute('''
-        INSERT INTO revenues (date, city, revenue, declared_revenue, temperature, temperature_felt, wind_speed, main_weather, weather_description, kind, who, notes)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (date, city, revenue, declared_revenue, day_temp, day_felt_temp, wind_speed, main_weather, weather_description, kind, who, notes))
-        
-        conn.commit()
-        conn.close()
         return True
     else:
         print("Failed to insert record due to connection issues.")
@@ -119,91 +110,473 @@ def add_revenue(date, city, declared_revenue, revenue=None, kind='ordinary', who
 #### GET FUNCTIONS ####
 
 
+@stats.timed("db.get_last_revenues")
 def get_last_revenues(n=1):
     """Retrieve the last revenue entry from the database."""
+    import pandas as pd
     if not table_exists():
         print("Revenues table does not exist.")
         return
-    conn = create_connection()
+    conn = get_connection()
     if conn:
-        df = pd.read_sql_query(f"SELECT * FROM revenues ORDER BY id DESC LIMIT {n} ", conn)
-        conn.close()
-        return df
+        years = archive.years()
+        archive.attach(conn, years)
+        sql, params = _last_sql(int(n), years)
+        return pd.read_sql_query(sql, conn, params=params)
     else:
         print("Failed to retrieve record due to connection issues.")
         return None
 
+@stats.timed("db.get_revenue_by_date")
 def get_revenue_by_date(date):
     """Retrieve revenue for a specific date."""
+    import pandas as pd
     if not table_exists():
         print("Revenues table does not exist.")
         return
-    conn = create_connection()
+    conn = get_connection()
     if conn:
-        df = pd.read_sql_query("SELECT * FROM revenues WHERE date = ?", conn, params=(date,))
-        conn.close()
-        return df
+        years = archive.years(date, date)
+        archive.attach(conn, years)
+        sql, params = _union(REVENUE_COLUMNS, years, condition="date = ?", condition_params=[date])
+        return pd.read_sql_query(sql, conn, params=params)
     else:
         print("Failed to retrieve record due to connection issues.")
         return None
 
+@stats.timed("db.get_table")
 def get_table():
     """Retrieve the entire table from the database."""
+    import pandas as pd
+    if not table_exists():
+        print("Revenues table does not exist.")
+        return
+    conn = get_connection()
+    years = archive.years()
+    archive.attach(conn, years)
+    sql, params = _union(REVENUE_COLUMNS, years)
+    return pd.read_sql_query(f"{sql} ORDER BY date DESC", conn, params=params)
+
+def iter_revenues(batch_size=1000, columns=None, dtypes=None, filters=None):
+    """
+    Iterate over the revenues table in DataFrame chunks, newest date first.
+
+    Rows are paged with a keyset on (date, id) instead of OFFSET, so every
+    chunk is an index range scan and memory use does not grow with the
+    table. `columns` selects a subset of columns and `dtypes` is passed to
+    DataFrame.astype for each chunk. `filters` holds query_revenues filters
+    (city, start, end, ...), applied in SQL.
+    """
+    import pandas as pd
+    if not table_exists():
+        print("Revenues table does not exist.")
+        return
+    conn = get_connection()
+    if not conn:
+        print("Failed to retrieve record due to connection issues.")
+        return
+
+    columns = list(columns) if columns else list(REVENUE_COLUMNS)
+    unknown = [c for c in columns if c not in REVENUE_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown column(s): {', '.join(unknown)}")
+    # The keyset columns are always read, even when not requested
+    selected = list(dict.fromkeys(columns + ["date", "id"]))
+    date_pos, id_pos = selected.index("date"), selected.index("id")
+    filters = filters or {}
+    years = archive.years(filters.get("start"), filters.get("end"))
+    archive.attach(conn, years)
+    sql, params = _union(selected, years, filters)
+
+    with stats.timer("db.iter_revenues.fetch"):
+        rows = conn.execute(f"{sql} ORDER BY date DESC, id DESC LIMIT ?", (*params, batch_size)).fetchall()
+    while rows:
+        with stats.timer("pandas.dataframe"):
+            df = pd.DataFrame.from_records(rows, columns=selected)[columns]
+            if dtypes:
+                df = df.astype(dtypes)
+        yield df
+        last_date, last_id = rows[-1][date_pos], rows[-1][id_pos]
+        sql, params = _union(selected, years, filters, condition="date <= ? AND (date < ? OR id < ?)",
+                             condition_params=[last_date, last_date, last_id])
+        with stats.timer("db.iter_revenues.fetch"):
+            rows = conn.execute(f"{sql} ORDER BY date DESC, id DESC LIMIT ?", (*params, batch_size)).fetchall()
+
+
+#### QUERY FUNCTIONS ####
+
+WEEKDAYS = ["Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]  # strftime('%w') order
+
+GROUP_BY = {
+    "city": "city",
+    "month": "strftime('%Y-%m', date)",
+    "weekday": "strftime('%w', date)",
+    "weather": "main_weather",
+}
+
+MEASURES = ["revenue", "declared_revenue"]
+
+def _weekday_names(numbers):
+    """Names of strftime('%w') weekday numbers; None for the rows whose date is missing or malformed."""
+    import pandas as pd
+    return [WEEKDAYS[int(w)] if pd.notna(w) else None for w in numbers]
+
+def _as_list(value):
+    if value is None:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+def _weekday_numbers(weekday):
+    """Convert day names to strftime('%w') values."""
+    weekdays = _as_list(weekday)
+    try:
+        return [str(WEEKDAYS.index(w.strip().capitalize())) for w in weekdays]
+    except ValueError:
+        raise ValueError(f"Weekdays must be English day names, got {weekdays}")
+
+def _where(city=None, start=None, end=None, weekday=None, kind=None, who=None, weather=None, schema=None):
+    """
+    Compile the filters of query_revenues into a parameterized WHERE clause,
+    on the revenues of the database or of the attached archive `schema`.
+    """
+    clauses, params = [], []
+    cities = _as_list(city)
+    if cities:
+        clauses.append(f"city IN ({', '.join('?' * len(cities))})")
+        params += cities
+    if start:
+        clauses.append("date >= ?")
+        params.append(start)
+    if end:
+        clauses.append("date <= ?")
+        params.append(end)
+    numbers = _weekday_numbers(weekday)
+    if numbers:
+        clauses.append(f"strftime('%w', date) IN ({', '.join('?' * len(numbers))})")
+        params += numbers
+    kinds = _as_list(kind)
+    if kinds:
+        clauses.append(f"kind IN ({', '.join('?' * len(kinds))})")
+        params += kinds
+    if who and schema:
+        clauses.append(f"id IN (SELECT revenue_id FROM {schema}.revenue_staff WHERE name = ?)")
+        params.append(who.strip())
+    elif who:
+        # Staff are stored one per row, so a name is an index lookup
+        clauses.append("id IN (SELECT rs.revenue_id FROM revenue_staff rs JOIN staff s ON s.id = rs.staff_id "
+                       "WHERE s.name = ?)")
+        params.append(who.strip())
+    conditions = _as_list(weather)
+    if conditions:
+        clauses.append(f"main_weather COLLATE NOCASE IN ({', '.join('?' * len(conditions))})")
+        params += conditions
+    sql = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    return sql, params
+
+def _union(columns, years, filters=None, condition=None, condition_params=()):
+    """
+    Compile a SELECT of `columns` from the revenues and the archives of
+    `years`, one per database joined with UNION ALL, each with the WHERE
+    clause of the query_revenues `filters` and the extra `condition`.
+    SQLite merges the parts of an ORDER BY on the whole, using each index.
+    """
+    parts, params = [], []
+    for schema in [None] + [archive.schema(y) for y in years]:
+        where, part_params = _where(**(filters or {}), schema=schema)
+        if condition:
+            where += f"{' AND' if where else ' WHERE'} {condition}"
+            part_params += list(condition_params)
+        parts.append(f"SELECT {', '.join(columns)} FROM {f'{schema}.' if schema else ''}revenues{where}")
+        params += part_params
+    return " UNION ALL ".join(parts), params
+
+def _last_sql(n, years):
+    """Compile the query of the last n entries over the revenues and the archives of `years`."""
+    if not years:
+        return "SELECT * FROM revenues ORDER BY id DESC LIMIT ?", [n]
+    # The last n of each database, then the last n of those
+    columns = ", ".join(REVENUE_COLUMNS)
+    parts = [f"SELECT * FROM (SELECT {columns} FROM {table} ORDER BY id DESC LIMIT ?)"
+             for table in ["revenues"] + [f"{archive.schema(y)}.revenues" for y in years]]
+    return f"{' UNION ALL '.join(parts)} ORDER BY id DESC LIMIT ?", [n] * (len(parts) + 1)
+
+def _rollup_query(groups, city=None, start=None, end=None, weekday=None, kind=None, who=None, weather=None,
+                  years=()):
+    """
+    Compile a grouped query_revenues into a query on one rollup table, summed
+    with those of the archives of `years`, or return None when the grouping
+    or the filters need the revenues rows.
+    """
+    if start or end or kind or who:
+        return None
+    dimensions = {g for g in groups if g != "city"}
+    dimensions |= {name for name, value in (("weekday", weekday), ("weather", weather)) if value}
+    if len(dimensions) > 1:
+        return None
+    dimension = dimensions.pop() if dimensions else "weekday"
+
+    # Compile the filters on the rollup columns instead of the rows
+    where, params = _where(city=city)
+    keys = _weekday_numbers(weekday) or _as_list(weather)
+    if keys:
+        collate = " COLLATE NOCASE" if dimension == "weather" else ""
+        where += f"{' AND' if where else ' WHERE'} key{collate} IN ({', '.join('?' * len(keys))})"
+        params += keys
+
+    columns = [f"NULLIF({'city' if g == 'city' else 'key'}, '') AS {g}" for g in groups]
+    columns.append("COALESCE(SUM(entries), 0) AS entries")
+    for m in MEASURES:
+        known = f"SUM({m}_count) > 0"
+        columns += [
+            f"CASE WHEN {known} THEN SUM({m}_sum) END AS {m}_sum",
+            f"CASE WHEN {known} THEN SUM({m}_sum) / SUM({m}_count) END AS {m}_avg",
+            f"COALESCE(SUM({m}_count), 0) AS {m}_count",
+        ]
+    source = rollups.merged(dimension, [archive.schema(y) for y in years])
+    sql = f"SELECT {', '.join(columns)} FROM {source}{where}"
+    if groups:
+        sql += f" GROUP BY {', '.join(groups)} ORDER BY {', '.join(groups)}"
+    return sql, params
+
+def _query_sql(city=None, start=None, end=None, weekday=None, kind=None, who=None, weather=None,
+               group_by=None, aggregate=False):
+    """
+    Compile query_revenues into SQL and parameters. Also returns the list of
+    groups and the archived years the query reads, to attach before running it.
+    """
+    filters = dict(city=city, start=start, end=end, weekday=weekday, kind=kind, who=who, weather=weather)
+    groups = _as_list(group_by)
+    unknown = [g for g in groups if g not in GROUP_BY]
+    if unknown:
+        raise ValueError(f"Cannot group by {', '.join(unknown)}. Use one of: {', '.join(GROUP_BY)}")
+    years = archive.years(start, end)
+
+    if not groups and not aggregate:
+        if not years:
+            where, params = _where(**filters)
+            return f"SELECT * FROM revenues{where} ORDER BY date DESC, id DESC", params, groups, years
+        sql, params = _union(REVENUE_COLUMNS, years, filters)
+        return f"{sql} ORDER BY date DESC, id DESC", params, groups, years
+
+    rollup = _rollup_query(groups, **filters, years=years)
+    if rollup:
+        return (*rollup, groups, years)
+    keys = [f"{GROUP_BY[g]} AS {g}" for g in groups]
+    values = ["COUNT(*) AS entries"] + [
+        f"{fn}({m}) AS {m}_{fn.lower()}" for m in MEASURES for fn in ("SUM", "AVG", "COUNT")
+    ]
+    if years:
+        union, params = _union(rollups.ROW_COLUMNS, years, filters)
+        sql = f"SELECT {', '.join(keys + values)} FROM ({union})"
+    else:
+        where, params = _where(**filters)
+        sql = f"SELECT {', '.join(keys + values)} FROM revenues{where}"
+    if groups:
+        sql += f" GROUP BY {', '.join(groups)} ORDER BY {', '.join(groups)}"
+    return sql, params, groups, years
+
+@stats.timed("db.query_revenues")
+def query_revenues(city=None, start=None, end=None, weekday=None, kind=None, who=None, weather=None,
+                   group_by=None, aggregate=False):
+    """
+    Retrieve revenues matching the given filters, optionally aggregated by SQLite.
+
+    city, weekday, kind and weather accept a single value or a list. start and
+    end are inclusive YYYY-MM-DD dates, who matches one member of the who list.
+    With group_by (any of "city", "month", "weekday", "weather") or
+    aggregate=True, only the number of entries and the sum, average and count
+    of revenue and declared_revenue per group are returned.
+    """
+    import pandas as pd
     if not table_exists():
         print("Revenues table does not exist.")
-        return 
-    conn = create_connection()
-    df = pd.read_sql_query("SELECT * FROM revenues ORDER BY date DESC", conn)
-    conn.close()
+        return
+    conn = get_connection()
+    if not conn:
+        print("Failed to retrieve record due to connection issues.")
+        return None
+
+    sql, params, groups, years = _query_sql(city, start, end, weekday, kind, who, weather, group_by, aggregate)
+    archive.attach(conn, years)
+    df = pd.read_sql_query(sql, conn, params=params)
+    if "weekday" in groups:
+        df["weekday"] = _weekday_names(df["weekday"])
     return df
 
 
+#### ROLLUP FUNCTIONS ####
+
+@stats.timed("db.get_rollups")
+def get_rollups(by, city=None):
+    """
+    Read the statistics of revenue and declared_revenue per city and `by`
+    ("weekday", "month" or "weather") from the rollup tables.
+
+    Returns the number of entries and, per measure, the count of known
+    values, sum, mean, sample standard deviation, minimum and maximum.
+    """
+    import numpy as np
+    import pandas as pd
+    if by not in rollups.DIMENSIONS:
+        raise ValueError(f"Cannot roll up by {by}. Use one of: {', '.join(rollups.DIMENSIONS)}")
+    if not table_exists():
+        print("Revenues table does not exist.")
+        return
+    conn = get_connection()
+    if not conn:
+        print("Failed to retrieve record due to connection issues.")
+        return None
+
+    # The statistics of archived years are kept with their archives
+    years = archive.years()
+    archive.attach(conn, years)
+    where, params = _where(city=city)
+    df = pd.read_sql_query(
+        f"SELECT NULLIF(city, '') AS city, NULLIF(key, '') AS {by}, {', '.join(rollups.columns())} "
+        f"FROM {rollups.merged(by, [archive.schema(y) for y in years])}{where} ORDER BY city, key",
+        conn, params=params
+    )
+    if by == "weekday":
+        df["weekday"] = _weekday_names(df["weekday"])
+    for m in rollups.MEASURES:
+        n, total, squares = df[f"{m}_count"], df[f"{m}_sum"], df.pop(f"{m}_sumsq")
+        df.insert(df.columns.get_loc(f"{m}_sum") + 1, f"{m}_mean", (total / n).where(n > 0))
+        variance = ((squares - total ** 2 / n) / (n - 1)).where(n > 1)
+        df.insert(df.columns.get_loc(f"{m}_mean") + 1, f"{m}_std", np.sqrt(variance.clip(lower=0)))
+        df[f"{m}_sum"] = total.where(n > 0)
+    return df
+
+@stats.timed("db.rebuild_rollups")
+def rebuild_rollups():
+    """Recompute the rollup tables from all revenues, e.g. after editing the table outside the program."""
+    if not table_exists():
+        print("Revenues table does not exist.")
+        return
+    conn = get_connection()
+    if conn:
+        with conn:
+            rollups.rebuild(conn)
+        return True
+    else:
+        print("Failed to rebuild rollups due to connection issues.")
+
+
+#### ARCHIVE FUNCTIONS ####
+
+@stats.timed("db.archive_years")
+def archive_years(before=None, vacuum=False):
+    """
+    Move the entries of every closed year before `before` (default: the
+    current year) into a read-only archive file per year (see
+    revenue_tracker.archive). Years with entries still waiting for weather
+    are left for later. With vacuum=True the database file is compacted
+    afterwards.
+
+    Returns the number of entries archived per year and the years skipped.
+    """
+    if not table_exists():
+        print("Revenues table does not exist.")
+        return
+    conn = get_connection()
+    if not conn:
+        print("Failed to archive records due to connection issues.")
+        return None
+    summary = {"archived": {}, "skipped": {}}
+    for year in archive.closed_years(conn, before):
+        waiting = archive.pending(conn, year)
+        if waiting:
+            summary["skipped"][year] = f"{waiting} entries waiting for weather"
+            print(f"{year} has {waiting} entries waiting for weather; run enrich first.")
+            continue
+        summary["archived"][year] = archive.archive_year(conn, year)
+    if vacuum and summary["archived"]:
+        conn.execute("VACUUM")
+    return summary
+
+
 #### DELETE FUNCTIONS ####
 
+@stats.timed("db.del_revenue_by_id")
 def del_revenue_by_id(id):
     """Delete revenue by ID."""
     if not table_exists():
         print("Revenues table does not exist.")
         return
-    conn = create_connection()
+    conn = get_connection()
     if conn:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM revenues WHERE id = ?", (id,))
-        count = cursor.rowcount
-        conn.commit()
-        conn.close()
+        with conn:
+            key = conn.execute("SELECT date, city FROM revenues WHERE id = ?", (id,)).fetchone()
+            count = conn.execute("DELETE FROM revenue_entries WHERE id = ?", (id,)).rowcount
+            if count:
+                journal.record(conn, [("delete", *key)])
+        if not count:
+            year = archive.year_of_id(id)
+            if year is not None:
+                print(f"Revenue {id} belongs to the archived year {year}; its entries cannot be changed.")
         return count
     else:
         print("Failed to delete record due to connection issues.")
 
+@stats.timed("db.del_revenue_by_date")
 def del_revenue_by_date(date, city):
     """Delete revenue for a specific date."""
     if not table_exists():
         print("Revenues table does not exist.")
         return
-    conn = create_connection()
+    if archive.is_archived(date):
+        print(f"The year of {date} is archived; its entries cannot be changed.")
+        return 0
+    conn = get_connection()
     if conn:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM revenues WHERE date = ? AND city = ?", (date, city))
-        row_count = cursor.rowcount
-        conn.commit()
-        conn.close()
+        with conn:
+            row_count = conn.execute(
+                "DELETE FROM revenue_entries WHERE date = ? AND city_id = (SELECT id FROM cities WHERE name = ?)",
+                (date, city)
+            ).rowcount
+            if row_count:
+                journal.record(conn, [("delete", date, city)])
         return row_count
     else:
         print("Failed to delete record due to connection issues.")
 
-def del_table():
-    """Delete the entire table from the database."""
+@stats.timed("db.del_table")
+def del_table(archives=False):
+    """
+    Delete the entire table from the database. While archived years exist,
+    the table is only deleted with archives=True, which deletes them too.
+
+    Returns True if the table was deleted.
+    """
     if not table_exists():
         print("Revenues table does not exist.")
         return
-    conn = create_connection()
+    archived = archive.years()
+    if archived and not archives:
+        print(f"The years {', '.join(map(str, archived))} are archived in {archive.directory()}. "
+              f"Delete the archives too to delete all revenues.")
+        return False
+    conn = get_connection()
     if conn:
-        cursor = conn.cursor()
-        cursor.execute("DROP TABLE IF EXISTS revenues")
-        conn.commit()
-        conn.close()
+        # The archives are only renamed until the table is gone, so that a
+        # failure leaves both in place
+        aside = archive.set_aside(conn) if archived else []
+        try:
+            with conn:
+                # Explicitly, since sqlite3 only begins a transaction before DML
+                conn.execute("BEGIN")
+                storage.drop(conn)
+                conn.execute("DROP TABLE IF EXISTS backfill_checkpoints")
+                conn.execute("DROP TABLE IF EXISTS weather_queue")
+                rollups.drop(conn)
+                storage.bump_version(conn)
+                journal.record(conn, [("clear", None, None)])
+                migrations.reset(conn)
+        except Exception:
+            archive.restore(aside)
+            raise
+        archive.discard(aside)
+        connection.forget_table("revenues")
+        return True
     else:
         print("Failed to delete table due to connection issues.")
 
-
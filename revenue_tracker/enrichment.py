@@ -0,0 +1,146 @@
+import threading
+import time
+from revenue_tracker import config, database, weather
+from revenue_tracker.backfill import write_series, write_weather
+
+# Weather enrichment queue: add_revenue and the importer save rows with
+# weather_status 'pending' and a weather_queue entry. drain_queue fetches
+# their weather and marks them 'ok'. Failed fetches are retried with a
+# growing delay, and after MAX_ATTEMPTS the row is marked 'failed'. With
+# config.WEATHER_HOURLY the market weather series of the enriched rows are
+# fetched too; a series that fails is left to the backfill and does not hold
+# the row back.
+# The queue is drained by a background thread in the interactive menu, or by
+# the `enrich` command.
+
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 8
+RETRY_BASE = 60  # seconds before the first retry, doubled on every attempt
+RETRY_CAP = 6 * 3600
+
+
+def _retry_delay(attempts):
+    return min(RETRY_CAP, RETRY_BASE * 2 ** (attempts - 1))
+
+
+def pending_count():
+    """Number of rows waiting in the queue."""
+    if not database.table_exists():
+        return 0
+    conn = database.get_connection()
+    return conn.execute("SELECT COUNT(*) FROM weather_queue").fetchone()[0] if conn else 0
+
+
+def drain_queue(max_items=None, batch_size=BATCH_SIZE, max_workers=None):
+    """
+    Fetch weather for queued rows that are due, in batches.
+
+    Returns a summary with the number of rows processed, enriched, scheduled
+    for a retry and given up on.
+    """
+    summary = {"processed": 0, "enriched": 0, "retry": 0, "failed": 0}
+    if not database.table_exists():
+        return summary
+    conn = database.get_connection()
+    if not conn:
+        return summary
+
+    with conn:
+        # Entries of deleted rows or rows filled in by other means
+        conn.execute('''
+        DELETE FROM weather_queue
+        WHERE revenue_id NOT IN (SELECT id FROM revenue_entries WHERE weather_status = 'pending')
+        ''')
+
+    while max_items is None or summary["processed"] < max_items:
+        limit = batch_size if max_items is None else min(batch_size, max_items - summary["processed"])
+        items = conn.execute('''
+        SELECT q.revenue_id, q.attempts, r.date, r.city
+        FROM weather_queue q JOIN revenues r ON r.id = q.revenue_id
+        WHERE q.next_attempt_at <= ?
+        ORDER BY q.next_attempt_at
+        LIMIT ?
+        ''', (time.time(), limit)).fetchall()
+        if not items:
+            break
+
+        results = weather.get_many_day_weather([(city, date) for _, _, date, city in items], max_workers=max_workers)
+        now = time.time()
+        done, retry, failed = [], [], []
+        for revenue_id, attempts, date, city in items:
+            result = results[(city, date)]
+            if not isinstance(result, Exception):
+                done.append((revenue_id,))
+            elif attempts + 1 >= MAX_ATTEMPTS:
+                failed.append((str(result), revenue_id))
+            else:
+                retry.append((now + _retry_delay(attempts + 1), str(result), revenue_id))
+
+        series = {}
+        if config.WEATHER_HOURLY:
+            series = weather.get_many_day_series([pair for pair, values in results.items()
+                                                  if not isinstance(values, Exception)], max_workers=max_workers)
+        with conn:
+            write_weather(conn, {pair: values for pair, values in results.items()
+                                 if not isinstance(values, Exception)}, now)
+            write_series(conn, series, now)
+            conn.executemany("DELETE FROM weather_queue WHERE revenue_id = ?", done)
+            conn.executemany('''
+            UPDATE weather_queue SET attempts = attempts + 1, next_attempt_at = ?, last_error = ?
+            WHERE revenue_id = ?
+            ''', retry)
+            conn.executemany("UPDATE revenue_entries SET weather_status = 'failed' WHERE id = ?",
+                             [(i,) for _, i in failed])
+            conn.executemany("DELETE FROM weather_queue WHERE revenue_id = ?", [(i,) for _, i in failed])
+
+        summary["processed"] += len(items)
+        summary["enriched"] += len(done)
+        summary["retry"] += len(retry)
+        summary["failed"] += len(failed)
+    return summary
+
+
+#### BACKGROUND WORKER ####
+
+_worker = None
+_wakeup = threading.Event()
+_stop = threading.Event()
+last_error = None
+
+
+def _run_worker(interval):
+    global last_error
+    while not _stop.is_set():
+        _wakeup.clear()
+        try:
+            drain_queue()
+            last_error = None
+        except Exception as e:
+            # Keep the worker alive; failed rows stay in the queue for the next pass.
+            # Warn once, not on every pass failing the same way.
+            if str(e) != last_error:
+                print(f"\nWARNING: the weather enrichment failed: {e}\n")
+            last_error = str(e)
+        _wakeup.wait(interval)
+
+
+def start_worker(interval=60):
+    """Start the background thread draining the queue, if it is not running yet."""
+    global _worker
+    if _worker is None or not _worker.is_alive():
+        _stop.clear()
+        _worker = threading.Thread(target=_run_worker, args=(interval,), name="weather-enrichment", daemon=True)
+        _worker.start()
+
+
+def notify():
+    """Wake the background worker after rows have been queued."""
+    _wakeup.set()
+
+
+def stop_worker(timeout=None):
+    """Ask the background worker to stop and wait for the current batch to finish."""
+    _stop.set()
+    _wakeup.set()
+    if _worker is not None:
+        _worker.join(timeout)
@@ -0,0 +1,132 @@
+import time
+from pathlib import Path
+import pandas as pd
+from revenue_tracker import archive, database, journal, rollups, storage
+from revenue_tracker.utils import default_who_many
+
+# Columns accepted from an import file. Only date and city are required.
+REVENUE_COLUMNS = ["date", "city", "declared_revenue", "revenue", "kind", "who", "notes"]
+WEATHER_COLUMNS = database.WEATHER_COLUMNS
+IMPORT_COLUMNS = REVENUE_COLUMNS + WEATHER_COLUMNS
+
+CHUNK_SIZE = 10000
+
+
+#### READERS ####
+
+def read_chunks(path, chunksize=CHUNK_SIZE):
+    """Yield the rows of a CSV or Parquet file as DataFrames of at most chunksize rows."""
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix == ".csv":
+        yield from pd.read_csv(path, chunksize=chunksize, dtype={"date": str, "city": str, "who": str})
+    elif suffix in (".parquet", ".pq"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Reading Parquet files requires pyarrow. Install it with: pip install pyarrow")
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        raise ValueError(f"Unsupported file type '{suffix}'. Use a .csv or .parquet file.")
+
+
+#### IMPORT ####
+
+def _prepare_chunk(chunk):
+    """Validate and normalize one chunk. Returns (valid rows DataFrame, number of invalid rows)."""
+    if "date" not in chunk.columns or "city" not in chunk.columns:
+        raise ValueError("The import file must have at least a 'date' and a 'city' column.")
+
+    chunk = chunk.reindex(columns=IMPORT_COLUMNS)
+
+    # Validate all dates of the chunk at once; unparsable dates become NaT
+    dates = pd.to_datetime(chunk["date"].astype(str).str.strip(), format="%Y-%m-%d", errors="coerce")
+    chunk["city"] = chunk["city"].astype("string").str.strip()
+    valid = dates.notna() & chunk["city"].notna() & (chunk["city"] != "")
+    chunk = chunk[valid].copy()
+    chunk["date"] = dates[valid].dt.strftime("%Y-%m-%d")
+    chunk["kind"] = chunk["kind"].fillna("ordinary")
+
+    chunk = chunk.astype(object).where(chunk.notna(), None)
+    return chunk, int((~valid).sum())
+
+
+def import_revenues(path, chunksize=CHUNK_SIZE, progress=True):
+    """
+    Import revenue entries from a CSV or Parquet file.
+
+    Rows are read in chunks, validated, completed with the default personnel,
+    deduplicated against the existing (date, city) pairs and inserted with
+    one executemany per chunk. Weather columns are taken from the file when
+    present; rows without them are queued for weather enrichment.
+
+    Rows of archived years are skipped, since those years are closed.
+
+    Returns a dictionary with the counts of read, inserted, duplicate,
+    invalid and archived rows and the elapsed seconds.
+    """
+    database.create_table()
+    conn = database.get_connection()
+    if not conn:
+        print("Failed to import records due to connection issues.")
+        return None
+
+    summary = {"read": 0, "inserted": 0, "duplicates": 0, "invalid": 0, "archived": 0, "seconds": 0.0}
+    start = time.perf_counter()
+    # One query for every existing key; new keys are added as they are inserted
+    seen = set(conn.execute("SELECT date, city FROM revenues").fetchall())
+    archived = {str(year) for year in archive.years()}
+
+    for chunk in read_chunks(path, chunksize):
+        summary["read"] += len(chunk)
+        chunk, invalid = _prepare_chunk(chunk)
+        summary["invalid"] += invalid
+
+        rows = []
+        for row in chunk.itertuples(index=False):
+            key = (row.date, row.city)
+            if row.date[:4] in archived:
+                summary["archived"] += 1
+                continue
+            if key in seen:
+                summary["duplicates"] += 1
+                continue
+            seen.add(key)
+            row = row._asdict()
+            # 'ok' when the file has every weather column of the row, otherwise 'pending'
+            complete = all(row[c] is not None for c in WEATHER_COLUMNS)
+            row["weather_status"] = "ok" if complete else "pending"
+            rows.append(row)
+        # Default personnel for the rows without any, resolved for the whole chunk
+        missing = [row for row in rows if row["who"] is None]
+        for row, who in zip(missing, default_who_many((row["city"], row["date"]) for row in missing)):
+            row["who"] = who
+
+        with conn:
+            # The rollups are updated once per chunk rather than once per row
+            with rollups.bulk_insert(conn):
+                ids = storage.insert_entries(conn, rows)
+            # Rows imported without weather wait in the enrichment queue
+            database.enqueue_weather(conn, [i for i, row in zip(ids, rows)
+                                            if i is not None and row["weather_status"] == "pending"])
+            journal.record_inserts(conn, ids)
+        inserted = sum(i is not None for i in ids)
+        summary["inserted"] += inserted
+        summary["duplicates"] += len(rows) - inserted
+
+        if progress:
+            elapsed = time.perf_counter() - start
+            print(f"{summary['read']} rows read, {summary['inserted']} inserted "
+                  f"({summary['read'] / elapsed:.0f} rows/s)")
+
+    summary["seconds"] = time.perf_counter() - start
+    if progress:
+        rate = summary["read"] / summary["seconds"] if summary["seconds"] else 0
+        skipped = f"{summary['duplicates']} duplicates and {summary['invalid']} invalid rows"
+        if summary["archived"]:
+            skipped = (f"{summary['duplicates']} duplicates, {summary['invalid']} invalid rows "
+                       f"and {summary['archived']} rows of archived years")
+        print(f"\nImported {summary['inserted']} rows in {summary['seconds']:.2f} s ({rate:.0f} rows/s). "
+              f"Skipped {skipped}.\n")
+    return summary
@@ -1,6 +1,6 @@
 import os
 import sys
-from revenue_tracker import database
+from revenue_tracker import archive, database, cache, stats
 from revenue_tracker.utils import validate_date
 
 def menu():
@@ -8,7 +8,10 @@ def menu():
     print("1. Add revenue")
     print("2. Visualize revenues")
     print("3. Manage revenues")
-    print("4. Exit")
+    print("4. Import revenues from file")
+    print("5. Query revenues")
+    print("6. Statistics")
+    print("7. Exit")
 
     choice = input("\nPlease select an option: ")
 
@@ -39,8 +42,7 @@ def menu():
                     print(database.get_revenue_by_date(date))
                     print()
                 case '3':
-                    print(database.get_table())
-                    print()
+                    visualize_revenues()
                 case '4':
                     return
                 case _:
@@ -53,7 +55,9 @@ def menu():
             print("1. Delete revenue by date")
             print("2. Delete revenue by ID")
             print("3. Delete all table")
-            print("4. Back")
+            print("4. Clear geocoding cache")
+            print("5. Rebuild revenue rollups")
+            print("6. Back")
             choice = input("\nPlease select an option: ")
             match choice:
                 case '1':
@@ -81,16 +85,42 @@ def menu():
                 case '3':
                     confirm = input("Are you sure you want to delete the entire table? (yes/no): ")
                     if confirm.lower() == 'yes':
-                        database.del_table()
-                        print("\nAll revenues have been deleted.\n")
+                        archived = archive.years()
+                        archives = False
+                        if archived:
+                            answer = input(f"The years {', '.join(map(str, archived))} are archived. "
+                                           f"Delete their archives too? (yes/no): ")
+                            archives = answer.lower() == 'yes'
+                        if database.del_table(archives=archives):
+                            print("\nAll revenues have been deleted.\n")
                     else:
                         print("\nOperation cancelled.\n")
                 case '4':
+                    city = input("Enter the city to forget (leave empty for all): ")
+                    count = cache.invalidate_coordinates(city.strip() or None)
+                    print(f"\n{count} cached location(s) removed.\n")
+                case '5':
+                    if database.rebuild_rollups():
+                        print("\nRollups rebuilt.\n")
+                case '6':
                     return
                 case _:
                     print("\nInvalid choice.\n")
 
         case '4':
+            # Call the function to import revenues from a CSV or Parquet file
+            import_revenues()
+        case '5':
+            # Call the function to filter and aggregate revenues
+            if not database.table_exists():
+                print("Revenues table does not exist.")
+                return
+            query_revenues()
+        case '6':
+            # Timings and counters of the database and weather calls
+            statistics_menu()
+        case '7':
+            stats.stop_writer()
             print("\nExiting the application.\n")
             print("-"*40)
             choice = -1
@@ -127,23 +157,119 @@ def add_revenue():
     notes = notes.strip() or None
 
     # Call the function to add the income to the database
-    try:
-        database.get_table()
-    except Exception as e:
+    if not database.table_exists():
         print(f"No database found, creating a new one")
         database.create_table()
     if database.add_revenue(date, city, declared_revenue, revenue, kind, who, notes):
-        print(f"\nSaved data: {date}, {city}, {declared_revenue} EUR\n")
+        print(f"\nSaved data: {date}, {city}, {declared_revenue} EUR")
+        print("Weather data will be added in the background.\n")
+        # Fetch the weather of the new entry without making the user wait
+        from revenue_tracker import enrichment
+        enrichment.start_worker()
+        enrichment.notify()
     else:
         return
 
 
-def visualize_revenues():
-    # Call the function to visualize revenues
+def import_revenues():
+
+    print()
+    path = input("Enter the path of the CSV or Parquet file: ").strip()
+    if not os.path.isfile(path):
+        print("\nFile not found.\n")
+        return
+    from revenue_tracker import importer  # loads pandas
     try:
-        df = database.get_table()
-        print()
-        print(df)
+        importer.import_revenues(path)
+    except (ValueError, RuntimeError) as e:
+        print(f"\nImport failed: {e}\n")
+
+
+def query_revenues():
+
+    print("\nLeave a filter empty to skip it. Separate several values with commas.\n")
+    filters = {}
+    for name, prompt in [("city", "City"), ("weekday", "Weekday (e.g. Saturday)"), ("kind", "Kind of day"),
+                         ("weather", "Main weather (e.g. Rain)")]:
+        value = input(f"{prompt}: ").strip()
+        if value:
+            filters[name] = [v.strip() for v in value.split(",") if v.strip()]
+    for name, prompt in [("start", "From date (YYYY-MM-DD)"), ("end", "To date (YYYY-MM-DD)")]:
+        value = input(f"{prompt}: ").strip()
+        if value:
+            if not validate_date(value):
+                print("\nInvalid date format. Please enter in YYYY-MM-DD format.\n")
+                return
+            filters[name] = value
+    who = input("Who was at the market (one name): ").strip()
+    if who:
+        filters["who"] = who
+    group_by = input("Group totals by (city, month, weekday, weather; empty to list entries): ").strip()
+    if group_by:
+        filters["group_by"] = [g.strip() for g in group_by.split(",") if g.strip()]
+
+    try:
+        df = database.query_revenues(**filters)
+    except ValueError as e:
+        print(f"\n{e}\n")
+        return
+    print()
+    print(df.to_string(index=False) if df is not None and len(df) else "No revenues found.")
+    print()
+
+
+def statistics_menu():
+
+    state = "on" if stats.enabled else "off"
+    print(f"\nRecording is {state}.")
+    print("1. Show statistics")
+    print("2. Stop recording" if stats.enabled else "2. Start recording")
+    print("3. Reset statistics")
+    print("4. Back")
+    choice = input("\nPlease select an option: ")
+    match choice:
+        case '1':
+            from revenue_tracker import prefetch
+            print()
+            print(stats.format_snapshot(stats.snapshot()))
+            status = prefetch.format_status()
+            if status:
+                print(status)
+            print()
+        case '2':
+            if stats.enabled:
+                stats.disable()
+                stats.stop_writer()
+                print("\nRecording stopped.\n")
+            else:
+                from revenue_tracker import config
+                stats.enable()
+                if config.STATS_FILE:
+                    stats.start_writer(config.STATS_FILE, config.STATS_INTERVAL)
+                    print(f"\nRecording started, saved to {config.STATS_FILE} every {config.STATS_INTERVAL:g} s.\n")
+                else:
+                    print("\nRecording started.\n")
+        case '3':
+            stats.reset()
+            print("\nStatistics reset.\n")
+        case '4':
+            return
+        case _:
+            print("\nInvalid choice.\n")
+
+
+def visualize_revenues(page_size=20):
+    # Show the revenues one page at a time, reading only the rows being shown
+    try:
+        for df in database.iter_revenues(batch_size=page_size):
+            print()
+            print(df.to_string(index=False))
+            print()
+            if len(df) < page_size:
+                break
+            more = input("Press Enter for more revenues or 'q' to go back: ")
+            if more.strip().lower() == 'q':
+                break
         print()
     except Exception as e:
         print(f"\nNo database found.\n")
\ No newline at end of file
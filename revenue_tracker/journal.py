@@ -0,0 +1,185 @@
+import json
+import time
+import uuid
+
+# Change journal, for synchronizing copies of the database (see sync.py).
+#
+# Every database is a node with a random id. Inserts and deletes made through
+# the program are recorded in change_journal with the node id and the next
+# sequence number of the node, in the transaction of the change. Changes
+# applied from other nodes are recorded too, under their own node and
+# sequence number, so they are passed on to further copies. The highest
+# sequence number known of every node (sync_vector for the other nodes) tells
+# exactly which changes a copy has, since each node's changes are always
+# recorded in order.
+#
+# Entries are identified across copies by their date and city, not by id.
+# Deleting the whole table is recorded as a 'clear' without a key. When two
+# copies change the same entry, the later change wins. Change times never go
+# back behind a change seen from another node, so a change made after
+# receiving another is always the later one, even between unsynchronized clocks.
+#
+# The changes of the entries of an archived year move to its archive file
+# (see archive.py), from where exports still read them.
+
+OPS = ["insert", "delete", "clear"]
+ENTRY_FIELDS = ["date", "city", "revenue", "declared_revenue", "kind", "who", "notes"]
+WEATHER_FIELDS = ["temperature", "temperature_felt", "wind_speed", "main_weather", "weather_description"]
+# The synchronized fields of an entry besides its date and city, stored as a JSON object
+DATA_FIELDS = ENTRY_FIELDS[2:] + WEATHER_FIELDS
+_DATA_SQL = "json_object(" + ", ".join(f"'{f}', {f}" for f in DATA_FIELDS) + ")"
+CLOCK_STEP = 1e-6  # seconds
+
+
+def create_journal(conn, schema):
+    """Create the change_journal table in the database `schema`, main or an archive."""
+    conn.execute(f'''
+    CREATE TABLE IF NOT EXISTS {schema}.change_journal (
+        node TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        op TEXT NOT NULL,
+        date TEXT,
+        city TEXT,
+        changed_at REAL NOT NULL,
+        data TEXT,
+        PRIMARY KEY (node, seq)
+    ) WITHOUT ROWID
+    ''')
+
+
+def create_tables(conn):
+    # clock is the latest change time seen from other nodes
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS sync_node (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        node TEXT NOT NULL,
+        clock REAL NOT NULL DEFAULT 0
+    )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO sync_node (id, node) VALUES (1, ?)", (uuid.uuid4().hex,))
+    create_journal(conn, "main")
+    # The latest change of an entry, and the latest clear, are index lookups
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_journal_key ON change_journal (date, city, changed_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_journal_clear ON change_journal (changed_at) WHERE op = 'clear'")
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS sync_vector (
+        node TEXT PRIMARY KEY,
+        seq INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''')
+    # What was last exported to each peer, per node
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS sync_sent (
+        peer TEXT NOT NULL,
+        node TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        PRIMARY KEY (peer, node)
+    ) WITHOUT ROWID
+    ''')
+
+
+def node_id(conn):
+    return conn.execute("SELECT node FROM sync_node WHERE id = 1").fetchone()[0]
+
+
+def _last_seq(conn, node):
+    # The changes of archived years leave with them; sync_vector then keeps
+    # the last number of this node, in case they were its latest
+    return conn.execute(
+        "SELECT MAX(COALESCE((SELECT MAX(seq) FROM change_journal WHERE node = ?), 0), "
+        "COALESCE((SELECT seq FROM sync_vector WHERE node = ?), 0))", (node, node)
+    ).fetchone()[0]
+
+
+def vector(conn):
+    """The highest sequence number recorded of every node, this one included."""
+    node = node_id(conn)
+    known = dict(conn.execute("SELECT node, seq FROM sync_vector"))
+    known[node] = _last_seq(conn, node)
+    return known
+
+
+def _allocate(conn):
+    """
+    Return this node, its last sequence number, after which new changes are
+    numbered, and the time of the new changes. The caller's transaction
+    already holds the write lock, so no other connection takes the same numbers.
+    """
+    node, clock = conn.execute("SELECT node, clock FROM sync_node WHERE id = 1").fetchone()
+    return node, _last_seq(conn, node), max(time.time(), clock + CLOCK_STEP)
+
+
+def _record_entries(conn, where, params):
+    node, before, now = _allocate(conn)
+    conn.execute(f'''
+    INSERT INTO change_journal (node, seq, op, date, city, changed_at, data)
+    SELECT ?, ? + row_number() OVER (ORDER BY id), 'insert', date, city, ?, {_DATA_SQL}
+    FROM revenues WHERE {where}
+    ''', (node, before, now, *params))
+
+
+def record_inserts(conn, ids):
+    """Record the entries with these ids as inserted on this node. Runs in the caller's transaction."""
+    ids = [i for i in ids if i is not None]
+    if ids:
+        _record_entries(conn, "id IN (SELECT value FROM json_each(?))", [json.dumps(ids)])
+
+
+def seed(conn):
+    """Record the existing entries as inserts of this node, so that a first sync carries them."""
+    _record_entries(conn, "1", [])
+
+
+def record(conn, changes):
+    """
+    Record (op, date, city) deletes and clears made on this node, in order.
+    Runs in the caller's transaction.
+    """
+    if not changes:
+        return
+    node, before, now = _allocate(conn)
+    conn.executemany(
+        "INSERT INTO change_journal (node, seq, op, date, city, changed_at) VALUES (?, ?, ?, ?, ?, ?)",
+        [(node, before + i, op, date, city, now) for i, (op, date, city) in enumerate(changes, start=1)]
+    )
+
+
+def copy_changes(conn, schema, start, end):
+    """Copy the changes of the entries dated from `start` to before `end` into the journal of `schema`."""
+    create_journal(conn, schema)
+    conn.execute(f"INSERT INTO {schema}.change_journal SELECT * FROM change_journal WHERE date >= ? AND date < ?",
+                 (start, end))
+
+
+def remove_changes(conn, start, end):
+    """
+    Remove the changes of the entries dated from `start` to before `end`,
+    once they are archived. Runs in the caller's transaction.
+    """
+    node = node_id(conn)
+    conn.execute('''
+    INSERT INTO sync_vector (node, seq) VALUES (?, ?)
+    ON CONFLICT (node) DO UPDATE SET seq = MAX(seq, excluded.seq)
+    ''', (node, _last_seq(conn, node)))
+    conn.execute("DELETE FROM change_journal WHERE date >= ? AND date < ?", (start, end))
+
+
+def advance_clock(conn, changed_at):
+    """Keep the time of later changes of this node after a change received from another."""
+    conn.execute("UPDATE sync_node SET clock = MAX(clock, ?) WHERE id = 1", (changed_at,))
+
+
+def latest_change(conn, date, city):
+    """(changed_at, node, seq) of the latest recorded change of an entry, or None."""
+    return conn.execute(
+        "SELECT changed_at, node, seq FROM change_journal WHERE date = ? AND city = ? AND op <> 'clear' "
+        "ORDER BY changed_at DESC, node DESC, seq DESC LIMIT 1", (date, city)
+    ).fetchone()
+
+
+def latest_clear(conn):
+    """(changed_at, node, seq) of the latest recorded clear, or None."""
+    return conn.execute(
+        "SELECT changed_at, node, seq FROM change_journal WHERE op = 'clear' "
+        "ORDER BY changed_at DESC, node DESC, seq DESC LIMIT 1"
+    ).fetchone()
@@ -0,0 +1,175 @@
+# Schema migrations for the revenues table.
+#
+# The schema version is stored in PRAGMA user_version. Each migration below
+# upgrades the schema by one version and runs in its own transaction, so an
+# existing database is brought up to date in place without losing rows.
+# Append new migrations at the end; never edit or reorder applied ones.
+from revenue_tracker import journal, rollups, storage
+
+WEATHER_COLUMNS = ["temperature", "temperature_felt", "wind_speed", "main_weather", "weather_description"]
+
+
+def _create_revenues(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS revenues (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        date TEXT,
+        city TEXT,
+        revenue REAL DEFAULT NULL,
+        declared_revenue REAL,
+        kind TEXT,
+        who TEXT,
+        temperature REAL,
+        temperature_felt REAL,
+        wind_speed REAL,
+        main_weather TEXT,
+        weather_description TEXT,
+        notes TEXT DEFAULT NULL
+    )
+    ''')
+
+
+def _unique_date_city(conn):
+    # Databases created before this migration may hold several rows for the
+    # same date and city. The oldest one is kept and the others are moved to
+    # revenues_duplicates, so that the unique index can be built.
+    keep = "SELECT MIN(id) FROM revenues GROUP BY date, city"
+    duplicates = conn.execute(f"SELECT COUNT(*) FROM revenues WHERE id NOT IN ({keep})").fetchone()[0]
+    if duplicates:
+        conn.execute("CREATE TABLE IF NOT EXISTS revenues_duplicates AS SELECT * FROM revenues WHERE 0")
+        conn.execute(f"INSERT INTO revenues_duplicates SELECT * FROM revenues WHERE id NOT IN ({keep})")
+        conn.execute(f"DELETE FROM revenues WHERE id NOT IN ({keep})")
+        print(f"Moved {duplicates} duplicate record(s) to table 'revenues_duplicates'.")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_revenues_date_city ON revenues (date, city)")
+
+
+def _query_indexes(conn):
+    # The date index also orders rows by id (the rowid), which serves paging on (date, id)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_revenues_date ON revenues (date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_revenues_city_date ON revenues (city, date)")
+
+
+def _weather_updated_at(conn):
+    # When the weather columns were last fetched, to find stale observations
+    conn.execute("ALTER TABLE revenues ADD COLUMN weather_updated_at REAL")
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+        job TEXT PRIMARY KEY,
+        params TEXT NOT NULL,
+        last_date TEXT,
+        last_city TEXT,
+        updated_at REAL NOT NULL
+    )
+    ''')
+
+
+def _weather_queue(conn):
+    # Rows are saved before their weather is known: weather_status is 'pending'
+    # while the row waits in weather_queue, then 'ok' or 'failed'. Rows from
+    # before this migration keep a NULL status; the backfill job covers them.
+    conn.execute("ALTER TABLE revenues ADD COLUMN weather_status TEXT")
+    conn.execute(f"UPDATE revenues SET weather_status = 'ok' WHERE {' AND '.join(f'{c} IS NOT NULL' for c in WEATHER_COLUMNS)}")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_revenues_pending ON revenues (id) WHERE weather_status = 'pending'")
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS weather_queue (
+        revenue_id INTEGER PRIMARY KEY,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL,
+        last_error TEXT,
+        enqueued_at REAL NOT NULL
+    )
+    ''')
+
+
+def _rollups(conn):
+    # Totals per city and weekday, month and weather, kept up to date by triggers
+    rollups.create(conn)
+    rollups.rebuild(conn)
+
+
+def _normalized_storage(conn):
+    # The revenues table is split into entries, cities, weather observations
+    # and staff, and replaced by a view with the same columns. The rollup
+    # triggers move from the table to the new ones.
+    for trigger in rollups.LEGACY_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    storage.convert(conn)
+    rollups.create_triggers(conn)
+    # Rows without a date or city lose their weather, which moves their group
+    rollups.rebuild(conn)
+
+
+def _weather_series(conn):
+    # Hourly weather over the market hours, with day aggregates shown by the view
+    storage.create_series(conn)
+
+
+def _data_version(conn):
+    # Counter of changes, for readers caching responses
+    storage.create_version(conn)
+
+
+def _change_journal(conn):
+    # Journal of inserts and deletes for synchronizing copies; existing
+    # entries become inserts of this database, so the first sync carries them
+    journal.create_tables(conn)
+    journal.seed(conn)
+
+
+def _pausable_triggers(conn):
+    # Batches used to drop and recreate the rollup and version triggers; they
+    # now check trigger_pauses instead, so the schema no longer changes
+    for trigger in rollups.TRIGGERS + storage.version_triggers():
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    rollups.create_triggers(conn)
+    storage.create_version(conn)
+
+
+def _rollup_group_lookups(conn):
+    # The rollup triggers looked up the minimum and maximum of a group in the
+    # revenues view; they now read the entries of its city by index
+    for trigger in rollups.TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    rollups.create_triggers(conn)
+
+
+MIGRATIONS = [
+    _create_revenues,
+    _unique_date_city,
+    _query_indexes,
+    _weather_updated_at,
+    _weather_queue,
+    _rollups,
+    _normalized_storage,
+    _weather_series,
+    _data_version,
+    _change_journal,
+    _pausable_triggers,
+    _rollup_group_lookups,
+]
+
+LATEST_VERSION = len(MIGRATIONS)
+
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Apply all pending migrations. Returns the number of migrations applied."""
+    version = get_version(conn)
+    for index in range(version, LATEST_VERSION):
+        conn.execute("BEGIN")
+        try:
+            MIGRATIONS[index](conn)
+            conn.execute(f"PRAGMA user_version = {index + 1}")
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+    return max(0, LATEST_VERSION - version)
+
+
+def reset(conn):
+    """Mark the schema as empty, after the revenues have been dropped."""
+    conn.execute("PRAGMA user_version = 0")
@@ -0,0 +1,191 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from revenue_tracker import cache, config, database, stats, utils, weather
+
+# Weather prefetch for the market days of the default personnel rules.
+#
+# who_defaults.json tells in which cities the stalls trade on which weekdays.
+# prefetch() works out those (city, date) market days and warms the caches
+# the enrichment of their entries reads: the coordinates of the cities and
+# their timezones right away, and the weather of a day (with the hourly
+# series, with config.WEATHER_HOURLY) once its market closed. Enriching the
+# entry added afterwards then needs no request at all.
+#
+# Days that already have an entry are left to the enrichment queue. The
+# weather of the last day is normally only cached for cache.RECENT_TTL,
+# since the provider may still correct it. Rather than fetching it again on
+# every pass of the scheduler, a day is fetched once after its market closed
+# and kept until its midnight, then once more and kept for good, so each
+# observation costs at most two requests however late it is entered.
+
+LOOKBACK_DAYS = 2  # today and yesterday, for entries made the next morning
+INTERVAL = 900  # seconds between two passes of the scheduler
+
+
+def _entered(start, end):
+    """(city, date) pairs with an entry from start to end, cities in lower case."""
+    if not database.table_exists():
+        return set()
+    conn = database.get_connection()
+    rows = conn.execute("SELECT city, date FROM revenues WHERE date >= ? AND date <= ?", (start, end))
+    return {(utils._norm_city(city), date) for city, date in rows if city}
+
+
+def _sample_hours():
+    """Local hours fetched for a day: the single observation, and the market hours with WEATHER_HOURLY."""
+    hours = {weather.SAMPLE_HOUR}
+    if config.WEATHER_HOURLY:
+        hours.update(weather.market_hours())
+    return sorted(hours)
+
+
+def _missing(date, lat, lon, now):
+    """
+    UTC timestamps of the observations of a day still to fetch, and the
+    timestamp of the day's local midnight: the observations not cached at
+    all, and once the day is over, those not cached for good.
+    """
+    next_day = (datetime.strptime(date, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+    day_end = weather.local_to_utc_timestamp(next_day, lat, lon, hour=0)
+    missing = []
+    for hour in _sample_hours():
+        dt = weather.local_to_utc_timestamp(date, lat, lon, hour=hour)
+        state = cache.observation_state(lat, lon, dt)
+        if state is None or (day_end <= now and state != "final"):
+            missing.append(dt)
+    return missing, day_end
+
+
+def _fetch(lat, lon, dt, day_end, now):
+    """
+    Fetch one observation into the cache, kept until the day's midnight or,
+    once the day is over, for good. True if it was cached.
+    """
+    try:
+        data = weather.get_timemachine(lat, lon, dt, use_cache=False)
+    except Exception:
+        return False
+    if not data.get("data"):
+        return False
+    if day_end <= now:
+        cache.finalize_observation(lat, lon, dt)
+    else:
+        cache.keep_observation(lat, lon, dt, day_end)
+    return True
+
+
+def _locate(city):
+    """Coordinates of a city, from the cache or the geocoder, or None if they cannot be found."""
+    try:
+        lat, lon = weather.get_city_coordinates(city)
+    except Exception:
+        return None
+    return None if lat is None or lon is None else (lat, lon)
+
+
+@stats.timed("prefetch.run")
+def prefetch(start=None, end=None, now=None, max_workers=None):
+    """
+    Warm the caches for the market days from `start` to `end` (YYYY-MM-DD,
+    by default the last LOOKBACK_DAYS days) that have no entry yet and
+    whose market closed by `now` (a timestamp, default: the current time).
+
+    Returns a summary with the number of market days scheduled, already
+    entered, still open, found warm, warmed and failed, and the hit ratio:
+    the share of the closed days whose weather was already cached.
+    """
+    now = now or time.time()
+    today = datetime.fromtimestamp(now).date()
+    end = end or today.isoformat()
+    start = start or (today - timedelta(days=LOOKBACK_DAYS - 1)).isoformat()
+    days = utils.scheduled_days(start, end)
+    summary = {"scheduled": len(days), "entered": 0, "open": 0, "warm": 0, "warmed": 0, "failed": 0}
+
+    entered = _entered(start, end)
+    coordinates = {city: _locate(city) for city in dict.fromkeys(city for city, _ in days)}
+    due = {}
+    for city, date in days:
+        if (city, date) in entered:
+            summary["entered"] += 1
+            continue
+        if coordinates[city] is None:
+            summary["failed"] += 1
+            continue
+        lat, lon = coordinates[city]
+        # The market is over once its last hour can be observed
+        if weather.local_to_utc_timestamp(date, lat, lon, hour=config.MARKET_CLOSE_HOUR) + 3600 > now:
+            summary["open"] += 1
+            continue
+        missing, day_end = _missing(date, lat, lon, now)
+        if missing:
+            due[(city, date)] = [(lat, lon, dt, day_end, now) for dt in missing]
+            stats.hit("prefetch", False)
+        else:
+            summary["warm"] += 1
+            stats.hit("prefetch", True)
+
+    if due:
+        requests = [request for pair in due for request in due[pair]]
+        with ThreadPoolExecutor(max_workers=max_workers or config.OPENWEATHER_WORKERS) as executor:
+            fetched = dict(zip(requests, executor.map(lambda request: _fetch(*request), requests)))
+        ok = [pair for pair in due if all(fetched[request] for request in due[pair])]
+        summary["warmed"] = len(ok)
+        summary["failed"] += len(due) - len(ok)
+    closed = summary["warm"] + len(due)
+    summary["hit_ratio"] = round(summary["warm"] / closed, 4) if closed else None
+    return summary
+
+
+#### BACKGROUND SCHEDULER ####
+
+_scheduler = None
+_stop = threading.Event()
+last_summary = None
+last_error = None
+last_run = None
+
+
+def _run_scheduler(interval):
+    global last_summary, last_error, last_run
+    while not _stop.is_set():
+        try:
+            last_summary = prefetch()
+            last_error = None
+        except Exception as e:
+            # Keep the scheduler alive; the days are tried again on the next pass.
+            # Warn once, not on every pass failing the same way.
+            if str(e) != last_error:
+                print(f"\nWARNING: the weather prefetch failed: {e}\n")
+            last_error = str(e)
+        last_run = time.time()
+        _stop.wait(interval)
+
+
+def format_status():
+    """One line on the last pass of the scheduler, or None if it has not run yet."""
+    if last_run is None:
+        return None
+    at = datetime.fromtimestamp(last_run).strftime("%H:%M")
+    if last_error is not None:
+        return f"Weather prefetch at {at}: failed ({last_error})"
+    ratio = "n/a" if last_summary["hit_ratio"] is None else f"{last_summary['hit_ratio']:.0%}"
+    return (f"Weather prefetch at {at}: {last_summary['warm']} days cached, {last_summary['warmed']} warmed, "
+            f"{last_summary['failed']} failed, hit ratio {ratio}")
+
+
+def start_scheduler(interval=INTERVAL):
+    """Start the background thread prefetching the market days, if it is not running yet."""
+    global _scheduler
+    if _scheduler is None or not _scheduler.is_alive():
+        _stop.clear()
+        _scheduler = threading.Thread(target=_run_scheduler, args=(interval,), name="weather-prefetch", daemon=True)
+        _scheduler.start()
+
+
+def stop_scheduler(timeout=None):
+    """Ask the background thread to stop and wait for the current pass to finish."""
+    _stop.set()
+    if _scheduler is not None:
+        _scheduler.join(timeout)
@@ -0,0 +1,422 @@
+# Materialized rollups of the revenues.
+#
+# For every city and weekday, month and main weather, a rollup table holds the
+# number of entries and, for revenue and declared_revenue, the count of known
+# values, their sum, sum of squares, minimum and maximum. Triggers on
+# revenue_entries, and on weather_observations for the weather, keep them up
+# to date on every insert, delete and update, so totals, means and standard
+# deviations per group are read from a few small rows instead of scanning the
+# whole history. rebuild() recomputes them from scratch.
+from contextlib import contextmanager
+from revenue_tracker import storage
+
+MEASURES = ["revenue", "declared_revenue"]
+
+# Group key of each rollup, as an SQL expression over the date and main
+# weather of a row. NULL keys (pending weather, invalid dates) and cities are
+# stored as '' because they are part of the primary key.
+DIMENSIONS = {
+    "weekday": "COALESCE(strftime('%w', {date}), '')",
+    "month": "COALESCE(strftime('%Y-%m', {date}), '')",
+    "weather": "COALESCE({main_weather}, '')",
+}
+
+ROW_COLUMNS = ["city", "date", "main_weather", *MEASURES]
+
+
+def table(dimension):
+    return f"revenue_rollup_{dimension}"
+
+
+def columns():
+    """Statistics columns of every rollup table, after city and key."""
+    columns = ["entries"]
+    for m in MEASURES:
+        columns += [f"{m}_count", f"{m}_sum", f"{m}_sumsq", f"{m}_min", f"{m}_max"]
+    return columns
+
+
+def _create_table(conn, dimension):
+    measures = ",\n".join(
+        f"        {m}_count INTEGER NOT NULL, {m}_sum REAL NOT NULL, {m}_sumsq REAL NOT NULL, "
+        f"{m}_min REAL, {m}_max REAL"
+        for m in MEASURES
+    )
+    conn.execute(f'''
+    CREATE TABLE IF NOT EXISTS {table(dimension)} (
+        city TEXT NOT NULL,
+        key TEXT NOT NULL,
+        entries INTEGER NOT NULL,
+{measures},
+        PRIMARY KEY (city, key)
+    ) WITHOUT ROWID
+    ''')
+
+
+# The triggers describe a revenues row as SQL expressions for ROW_COLUMNS and,
+# when the rows are selected from other tables, the query selecting them as r.
+
+def _columns(prefix):
+    return {c: f"{prefix}.{c}" for c in ROW_COLUMNS}
+
+
+def _entry(e):
+    """The revenue_entries row `e` (NEW or OLD) as a revenues row."""
+    main_weather = f'''(SELECT NULLIF(wc.main, '') FROM weather_observations w
+            JOIN weather_conditions wc ON wc.id = w.condition_id
+            WHERE w.city_id = {e}.city_id AND w.date = {e}.date)'''
+    row = {"city": f"(SELECT name FROM cities WHERE id = {e}.city_id)", "date": f"{e}.date",
+           "main_weather": main_weather, **{m: f"{e}.{m}" for m in MEASURES}}
+    return row, None
+
+
+def _observed(o, weather=True):
+    """The entry of the city and day of weather observation `o`, with its weather or none."""
+    main_weather = f"(SELECT NULLIF(main, '') FROM weather_conditions WHERE id = {o}.condition_id)" if weather \
+        else "NULL"
+    rows = f'''SELECT c.name AS city, e.date AS date, {main_weather} AS main_weather,
+            {', '.join(f"e.{m} AS {m}" for m in MEASURES)}
+            FROM revenue_entries e LEFT JOIN cities c ON c.id = e.city_id
+            WHERE e.city_id = {o}.city_id AND e.date = {o}.date'''
+    return _columns("r"), rows
+
+
+def _add_sql(dimension, entry):
+    """Statement adding a row, or the rows selected, to their groups."""
+    row, rows = entry
+    values = ["1"]
+    for m in MEASURES:
+        m = row[m]
+        values += [f"{m} IS NOT NULL", f"COALESCE({m}, 0)", f"COALESCE({m} * {m}, 0)", m, m]
+    values = f"COALESCE({row['city']}, ''), {DIMENSIONS[dimension].format(**row)}, {', '.join(values)}"
+    # WHERE true tells the parser that ON CONFLICT belongs to the INSERT
+    source = f"SELECT {values} FROM ({rows}) r WHERE true" if rows else f"VALUES ({values})"
+    return f'''
+        INSERT INTO {table(dimension)} (city, key, {', '.join(columns())})
+        {source}
+        ON CONFLICT (city, key) DO UPDATE SET {_merge()};'''
+
+
+def _merge():
+    """SET clause of an upsert adding the `excluded` group statistics to the stored ones."""
+    updates = ["entries = entries + excluded.entries"]
+    for m in MEASURES:
+        updates += [f"{m}_{s} = {m}_{s} + excluded.{m}_{s}" for s in ("count", "sum", "sumsq")]
+        updates += [f"{m}_{s} = {s}(COALESCE({m}_{s}, excluded.{m}_{s}), COALESCE(excluded.{m}_{s}, {m}_{s}))"
+                    for s in ("min", "max")]
+    return ", ".join(updates)
+
+
+def _group_entries(dimension, row):
+    """
+    FROM and WHERE clauses of the entries e in the group of `row`. They read
+    the entries of its city by index instead of the revenues view, which
+    would scan every entry with the staff of each.
+    """
+    main_weather = "NULLIF(wc.main, '')"
+    joins = ""
+    if dimension == "weather":
+        joins = (" LEFT JOIN weather_observations w ON w.city_id = e.city_id AND w.date = e.date"
+                 " LEFT JOIN weather_conditions wc ON wc.id = w.condition_id")
+    key = DIMENSIONS[dimension]
+    return (f"FROM revenue_entries e{joins} "
+            f"WHERE e.city_id IS (SELECT id FROM cities WHERE name = {row['city']}) "
+            f"AND {key.format(date='e.date', main_weather=main_weather)} = {key.format(**row)}")
+
+
+def _remove_sql(dimension, entry):
+    """
+    Statements removing a row, or the rows selected (one per group at most),
+    from their groups, run after they left them in the revenues view.
+    """
+    row, rows = entry
+    key = DIMENSIONS[dimension]
+    same_group = _group_entries(dimension, row)
+    updates = ["entries = entries - 1"]
+    for m in MEASURES:
+        value = row[m]
+        updates += [
+            f"{m}_count = {m}_count - ({value} IS NOT NULL)",
+            f"{m}_sum = {m}_sum - COALESCE({value}, 0)",
+            f"{m}_sumsq = {m}_sumsq - COALESCE({value} * {value}, 0)",
+            # A minimum or maximum cannot be undone: look it up again only when it left
+            f"{m}_min = CASE WHEN {value} <= {m}_min THEN (SELECT MIN(e.{m}) {same_group}) ELSE {m}_min END",
+            f"{m}_max = CASE WHEN {value} >= {m}_max THEN (SELECT MAX(e.{m}) {same_group}) ELSE {m}_max END",
+        ]
+    group = (f"{table(dimension)}.city = COALESCE({row['city']}, '') "
+             f"AND {table(dimension)}.key = {key.format(**row)}")
+    if rows:
+        return f'''
+        UPDATE {table(dimension)} SET {', '.join(updates)} FROM ({rows}) r WHERE {group};
+        DELETE FROM {table(dimension)} WHERE entries <= 0 AND (city, key) IN (
+            SELECT COALESCE(r.city, ''), {key.format(**row)} FROM ({rows}) r
+        );'''
+    return f'''
+        UPDATE {table(dimension)} SET {', '.join(updates)} WHERE {group};
+        DELETE FROM {table(dimension)} WHERE {group} AND entries <= 0;'''
+
+
+def _create_insert_triggers(conn):
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS revenue_entries_rollup_insert AFTER INSERT ON revenue_entries
+    WHEN {storage.unless_paused("rollups_insert")} BEGIN
+        {''.join(_add_sql(d, _entry("NEW")) for d in DIMENSIONS)}
+    END
+    ''')
+    # Weather observed for a day moves its entry out of the '' (unknown) group
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS weather_observations_rollup_insert AFTER INSERT ON weather_observations
+    WHEN NEW.condition_id IS NOT NULL AND {storage.unless_paused("rollups_insert")} BEGIN
+        {_remove_sql("weather", _observed("NEW", weather=False))}
+        {_add_sql("weather", _observed("NEW"))}
+    END
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS weather_observations_rollup_update AFTER UPDATE OF condition_id ON weather_observations
+    WHEN OLD.condition_id IS NOT NEW.condition_id AND {storage.unless_paused("rollups_insert")} BEGIN
+        {_remove_sql("weather", _observed("OLD"))}
+        {_add_sql("weather", _observed("NEW"))}
+    END
+    ''')
+
+
+def create_tables(conn):
+    """Create the rollup tables."""
+    for dimension in DIMENSIONS:
+        _create_table(conn, dimension)
+
+
+def create_triggers(conn):
+    """Create the triggers maintaining the rollups."""
+    storage.create_pauses(conn)
+    _create_insert_triggers(conn)
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS revenue_entries_rollup_delete AFTER DELETE ON revenue_entries
+    WHEN {storage.unless_paused("rollups_delete")} BEGIN
+        {''.join(_remove_sql(d, _entry("OLD")) for d in DIMENSIONS)}
+    END
+    ''')
+    watched = ["city_id", "date", *MEASURES]
+    changed = " OR ".join(f"OLD.{c} IS NOT NEW.{c}" for c in watched)
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS revenue_entries_rollup_update
+    AFTER UPDATE OF {', '.join(watched)} ON revenue_entries WHEN {changed} BEGIN
+        {''.join(_remove_sql(d, _entry("OLD")) + _add_sql(d, _entry("NEW")) for d in DIMENSIONS)}
+    END
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS weather_observations_rollup_delete AFTER DELETE ON weather_observations
+    WHEN OLD.condition_id IS NOT NULL AND {storage.unless_paused("rollups_delete")} BEGIN
+        {_remove_sql("weather", _observed("OLD"))}
+        {_add_sql("weather", _observed("OLD", weather=False))}
+    END
+    ''')
+
+
+def _aggregates():
+    aggregates = ["COUNT(*)"]
+    for m in MEASURES:
+        aggregates += [f"COUNT({m})", f"TOTAL({m})", f"TOTAL({m} * {m})", f"MIN({m})", f"MAX({m})"]
+    return ", ".join(f"{a} AS {c}" for a, c in zip(aggregates, columns()))
+
+
+# Names of the triggers, for dropping them in a migration
+TRIGGERS = ["revenue_entries_rollup_insert", "weather_observations_rollup_insert",
+            "weather_observations_rollup_update", "revenue_entries_rollup_delete",
+            "revenue_entries_rollup_update", "weather_observations_rollup_delete"]
+
+
+@contextmanager
+def bulk_insert(conn):
+    """
+    Insert many rows without the per-row insert triggers, in the caller's
+    transaction: the entries inserted inside the block, and their weather,
+    are added to the rollups with one grouped statement per table at the end.
+    Weather written inside the block must belong to the new entries. Inside
+    another bulk_insert, the entries are left to that one.
+    """
+    if not conn.in_transaction:
+        conn.execute("BEGIN")
+    last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM revenue_entries").fetchone()[0]
+    with storage.paused(conn, "rollups_insert") as outermost:
+        yield
+    if not outermost:
+        return
+    for dimension, key in DIMENSIONS.items():
+        conn.execute(f'''
+        INSERT INTO {table(dimension)} (city, key, {', '.join(columns())})
+        SELECT COALESCE(city, ''), {key.format(**_columns('revenues'))}, {_aggregates()}
+        FROM revenues WHERE id > ? GROUP BY 1, 2
+        ON CONFLICT (city, key) DO UPDATE SET {_merge()}
+        ''', (last_id,))
+
+
+def _removed(dimension):
+    return f"temp.{table(dimension)}_removed"
+
+
+@contextmanager
+def bulk_delete(conn, where, params=()):
+    """
+    Delete the revenues rows matching `where` without the per-row delete
+    triggers, in the caller's transaction: the groups of those rows are
+    summed up before the block and subtracted after it, with one statement
+    per table. The minimums and maximums of the groups that lost theirs are
+    looked up again in one pass per table.
+    The block must delete exactly those rows, so it cannot be nested.
+    """
+    if not conn.in_transaction:
+        conn.execute("BEGIN")
+    if storage.is_paused(conn, "rollups_delete"):
+        raise RuntimeError("rollups.bulk_delete cannot be nested: the outer block already counts the rows "
+                           "it deletes")
+    try:
+        for dimension, key in DIMENSIONS.items():
+            conn.execute(f'''
+            CREATE TABLE {_removed(dimension)} AS
+            SELECT COALESCE(city, '') AS city, {key.format(**_columns('revenues'))} AS key, {_aggregates()}
+            FROM revenues WHERE {where} GROUP BY 1, 2
+            ''', params)
+        with storage.paused(conn, "rollups_delete"):
+            yield
+        for dimension, key in DIMENSIONS.items():
+            _subtract(conn, dimension, key)
+    finally:
+        for dimension in DIMENSIONS:
+            conn.execute(f"DROP TABLE IF EXISTS {_removed(dimension)}")
+
+
+def _subtract(conn, dimension, key):
+    """Subtract the groups removed by bulk_delete from a rollup table."""
+    t, r = table(dimension), _removed(dimension)
+    # Groups that keep entries but lost their minimum or maximum of a measure
+    stale = " OR ".join(f"r.{m}_min <= t.{m}_min OR r.{m}_max >= t.{m}_max" for m in MEASURES)
+    stale = f"SELECT t.city, t.key FROM {t} t JOIN {r} r USING (city, key) WHERE t.entries > r.entries AND ({stale})"
+    if conn.execute(f"{stale} LIMIT 1").fetchone():
+        # Looked up again in one pass over the remaining rows
+        extremes = ", ".join(f"MIN({m}) AS {m}_min, MAX({m}) AS {m}_max" for m in MEASURES)
+        conn.execute(f'''
+        CREATE TABLE {r}_extremes AS
+        SELECT city, key, {extremes} FROM (
+            SELECT COALESCE(city, '') AS city, {key.format(**_columns('revenues'))} AS key, {", ".join(MEASURES)}
+            FROM revenues
+        ) WHERE (city, key) IN ({stale}) GROUP BY 1, 2
+        ''')
+        conn.execute(f'''
+        UPDATE {t} SET {", ".join(f"{m}_{s} = x.{m}_{s}" for m in MEASURES for s in ("min", "max"))}
+        FROM {r}_extremes x WHERE {t}.city = x.city AND {t}.key = x.key
+        ''')
+        conn.execute(f"DROP TABLE {r}_extremes")
+    updates = [f"entries = {t}.entries - r.entries"] + [
+        f"{m}_{s} = {t}.{m}_{s} - r.{m}_{s}" for m in MEASURES for s in ("count", "sum", "sumsq")
+    ]
+    conn.execute(f"UPDATE {t} SET {', '.join(updates)} FROM {r} r WHERE {t}.city = r.city AND {t}.key = r.key")
+    conn.execute(f"DELETE FROM {t} WHERE entries <= 0")
+
+
+def merged(dimension, schemas):
+    """
+    The rollup table of `dimension`, or, with the attached databases
+    `schemas`, its groups summed over main and them, as a subquery.
+    """
+    if not schemas:
+        return table(dimension)
+    union = " UNION ALL ".join(f"SELECT * FROM {schema}.{table(dimension)}" for schema in ["main", *schemas])
+    totals = ["SUM(entries) AS entries"]
+    for m in MEASURES:
+        totals += [f"SUM({m}_{s}) AS {m}_{s}" for s in ("count", "sum", "sumsq")]
+        totals += [f"MIN({m}_min) AS {m}_min", f"MAX({m}_max) AS {m}_max"]
+    return f"(SELECT city, key, {', '.join(totals)} FROM ({union}) GROUP BY city, key)"
+
+
+def rebuild(conn):
+    """Recompute every rollup from the revenues. Runs in the caller's transaction."""
+    for dimension, key in DIMENSIONS.items():
+        conn.execute(f"DELETE FROM {table(dimension)}")
+        conn.execute(f'''
+        INSERT INTO {table(dimension)} (city, key, {', '.join(columns())})
+        SELECT COALESCE(city, ''), {key.format(**_columns('revenues'))}, {_aggregates()}
+        FROM revenues GROUP BY 1, 2
+        ''')
+
+
+def drop(conn):
+    """
+    Drop the rollup tables and the triggers of weather_observations; those of
+    revenue_entries go with that table.
+    """
+    for trigger in ["weather_observations_rollup_insert", "weather_observations_rollup_update",
+                    "weather_observations_rollup_delete"]:
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    for dimension in DIMENSIONS:
+        conn.execute(f"DROP TABLE IF EXISTS {table(dimension)}")
+
+
+# Migration 6 created the rollups with triggers on the revenues table of the
+# time; migration 7 replaced that table by the view and dropped them. They are
+# kept here as they were, so that the applied migration stays unchanged.
+
+_LEGACY_KEYS = {
+    "weekday": "COALESCE(strftime('%w', {row}.date), '')",
+    "month": "COALESCE(strftime('%Y-%m', {row}.date), '')",
+    "weather": "COALESCE({row}.main_weather, '')",
+}
+_LEGACY_KEY_COLUMNS = {"weekday": ["date"], "month": ["date"], "weather": ["main_weather"]}
+LEGACY_TRIGGERS = ["revenues_rollup_insert", "revenues_rollup_delete",
+                   *(f"revenues_rollup_update_{dimension}" for dimension in DIMENSIONS)]
+
+
+def _legacy_add_sql(dimension):
+    values = ["1"]
+    for m in MEASURES:
+        values += [f"NEW.{m} IS NOT NULL", f"COALESCE(NEW.{m}, 0)", f"COALESCE(NEW.{m} * NEW.{m}, 0)",
+                   f"NEW.{m}", f"NEW.{m}"]
+    return f'''
+        INSERT INTO {table(dimension)} (city, key, {', '.join(columns())})
+        VALUES (COALESCE(NEW.city, ''), {_LEGACY_KEYS[dimension].format(row="NEW")}, {', '.join(values)})
+        ON CONFLICT (city, key) DO UPDATE SET {_merge()};'''
+
+
+def _legacy_remove_sql(dimension):
+    key = _LEGACY_KEYS[dimension]
+    same_group = f"city IS OLD.city AND {key.format(row='revenues')} = {key.format(row='OLD')}"
+    updates = ["entries = entries - 1"]
+    for m in MEASURES:
+        updates += [
+            f"{m}_count = {m}_count - (OLD.{m} IS NOT NULL)",
+            f"{m}_sum = {m}_sum - COALESCE(OLD.{m}, 0)",
+            f"{m}_sumsq = {m}_sumsq - COALESCE(OLD.{m} * OLD.{m}, 0)",
+            f"{m}_min = CASE WHEN OLD.{m} <= {m}_min THEN (SELECT MIN({m}) FROM revenues WHERE {same_group}) "
+            f"ELSE {m}_min END",
+            f"{m}_max = CASE WHEN OLD.{m} >= {m}_max THEN (SELECT MAX({m}) FROM revenues WHERE {same_group}) "
+            f"ELSE {m}_max END",
+        ]
+    where = f"city = COALESCE(OLD.city, '') AND key = {key.format(row='OLD')}"
+    return f'''
+        UPDATE {table(dimension)} SET {', '.join(updates)} WHERE {where};
+        DELETE FROM {table(dimension)} WHERE {where} AND entries <= 0;'''
+
+
+def create(conn):
+    """Create the rollup tables and the triggers maintaining them on a revenues table (migration 6)."""
+    create_tables(conn)
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS revenues_rollup_insert AFTER INSERT ON revenues BEGIN
+        {''.join(_legacy_add_sql(d) for d in DIMENSIONS)}
+    END
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS revenues_rollup_delete AFTER DELETE ON revenues BEGIN
+        {''.join(_legacy_remove_sql(d) for d in DIMENSIONS)}
+    END
+    ''')
+    for dimension in DIMENSIONS:
+        watched = ["city", *_LEGACY_KEY_COLUMNS[dimension], *MEASURES]
+        changed = " OR ".join(f"OLD.{c} IS NOT NEW.{c}" for c in watched)
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS revenues_rollup_update_{dimension}
+        AFTER UPDATE OF {', '.join(watched)} ON revenues WHEN {changed} BEGIN
+            {_legacy_remove_sql(dimension)}
+            {_legacy_add_sql(dimension)}
+        END
+        ''')
@@ -0,0 +1,447 @@
+import asyncio
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+from revenue_tracker import archive, config, connection, database, stats, storage
+
+# Read-only HTTP API for dashboards, such as revenue charts on a tablet.
+#
+# An asyncio server answers GET requests with JSON documents, or NDJSON with
+# ?format=ndjson. Queries run on read-only connections, in a thread of their
+# own so the event loop never waits for SQLite, and large results are
+# streamed in batches with chunked encoding instead of being built in memory.
+#
+# Responses are cached in memory and tagged with the data version, which
+# triggers increase on every change to the revenues (storage.create_version).
+# A request first reads the version: while it is unchanged, the cached body
+# is sent again, and a client sending the ETag it got back in If-None-Match
+# gets 304 Not Modified without any query. A body is only cached if the
+# version was still the same after it was read.
+#
+#     GET /version                   {"version": n}
+#     GET /revenues/last?n=10        the last n entries
+#     GET /revenues/2025-03-01       the entries of a date
+#     GET /revenues?city=Zurich,Basel&start=2025-01-01&end=2025-03-31&weekday=&kind=&who=&weather=
+#     GET /summary?group_by=city,month&<the filters above>
+#
+# Archived years are read too, attached only when the dates asked for fall in them.
+#
+# Lists are comma separated. Errors are JSON objects with an "error" message.
+
+STREAM_BATCH = 1000  # rows read and sent at a time
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+CACHE_ENTRY_MAX_BYTES = 4 * 1024 * 1024  # larger responses are streamed every time
+MAX_HEADER_BYTES = 16 * 1024
+LAST_MAX = 1000
+IDLE_CONNECTIONS = 4  # query connections kept open between requests
+
+FILTERS = ["city", "start", "end", "weekday", "kind", "who", "weather"]
+LIST_FILTERS = ["city", "weekday", "kind", "weather"]
+CONTENT_TYPES = {"json": "application/json", "ndjson": "application/x-ndjson"}
+REASONS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           431: "Request Header Fields Too Large", 500: "Internal Server Error"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+#### RESPONSE CACHE ####
+
+class ResponseCache:
+    """
+    Response bodies by request, for one data version: a new version empties
+    the cache. Least recently used bodies are evicted beyond max_bytes.
+    """
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.version = None
+        self.size = 0
+        self._bodies = OrderedDict()
+
+    def get(self, key, version):
+        body = self._bodies.get(key) if version == self.version else None
+        if body is not None:
+            self._bodies.move_to_end(key)
+        stats.hit("api.response", body is not None)
+        return body
+
+    def put(self, key, version, body):
+        if version != self.version:
+            self._bodies.clear()
+            self.version, self.size = version, 0
+        if len(body) > self.max_bytes:
+            return
+        previous = self._bodies.pop(key, None)
+        self.size += len(body) - (len(previous) if previous is not None else 0)
+        self._bodies[key] = body
+        while self.size > self.max_bytes:
+            _, evicted = self._bodies.popitem(last=False)
+            self.size -= len(evicted)
+
+
+#### QUERIES ####
+
+def _list(value):
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def _filters(query):
+    filters = {name: query[name] for name in FILTERS if query.get(name)}
+    for name in LIST_FILTERS:
+        if name in filters:
+            filters[name] = _list(filters[name])
+    return filters
+
+
+def route(path, query):
+    """
+    Return the SQL, parameters, row transformation and archived years
+    answering a request, or raise HTTPError. The transformation, if any, is
+    applied to every row.
+    """
+    parts = [unquote(p) for p in path.strip("/").split("/")]
+    if parts == ["revenues", "last"]:
+        try:
+            n = int(query.get("n", 1))
+        except ValueError:
+            raise HTTPError(400, "n must be a number.")
+        if not 1 <= n <= LAST_MAX:
+            raise HTTPError(400, f"n must be between 1 and {LAST_MAX}.")
+        years = archive.years()
+        return (*database._last_sql(n, years), None, years)
+    if len(parts) == 2 and parts[0] == "revenues":
+        years = archive.years(parts[1], parts[1])
+        sql, params = database._union(database.REVENUE_COLUMNS, years, condition="date = ?",
+                                      condition_params=[parts[1]])
+        return sql, params, None, years
+    if parts in (["revenues"], ["summary"]):
+        group_by = _list(query.get("group_by", "")) if parts == ["summary"] else None
+        try:
+            sql, params, groups, years = database._query_sql(**_filters(query), group_by=group_by,
+                                                      aggregate=parts == ["summary"])
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        if "weekday" not in groups:
+            return sql, params, None, years
+        position = groups.index("weekday")
+
+        def weekday_name(row):
+            row = list(row)
+            row[position] = database.WEEKDAYS[int(row[position])] if row[position] is not None else None
+            return row
+        return sql, params, weekday_name, years
+    raise HTTPError(404, f"Unknown path {path}")
+
+
+class _Reader:
+    """
+    The read-only connections, used only from the single database thread.
+    The data version is read on a connection of its own. Each query gets a
+    connection from a small pool until its cursor is released, so a stream
+    sent slowly to a client keeps its read snapshot to itself and the other
+    requests see the latest changes.
+    """
+
+    def __init__(self):
+        self.conn = None
+        self.path = None
+        self._idle = []
+        self._queries = set()  # connections of the current database, idle or in use
+
+    def _open(self):
+        conn = connection._open(self.path)
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def connect(self):
+        path = str(config.DATABASE_PATH)
+        if self.conn is None or self.path != path:
+            self.close()
+            self.path = path
+            self.conn = self._open()
+        return self.conn
+
+    def version(self):
+        try:
+            return storage.get_version(self.connect())
+        except sqlite3.OperationalError:
+            # No revenues have been stored in this database yet
+            return None
+
+    def execute(self, sql, params, years=()):
+        """Run a query on a connection of its own; give the cursor back with release()."""
+        self.connect()
+        if self._idle:
+            conn = self._idle.pop()
+        else:
+            conn = self._open()
+            self._queries.add(conn)
+        try:
+            archive.attach(conn, years)
+            with stats.timer("api.query"):
+                return conn.execute(sql, params)
+        except BaseException:
+            self._idle.append(conn)
+            raise
+
+    def release(self, cursor):
+        conn = cursor.connection
+        cursor.close()
+        if conn in self._queries and len(self._idle) < IDLE_CONNECTIONS:
+            self._idle.append(conn)
+        else:
+            # One too many, or opened on a database used before
+            self._queries.discard(conn)
+            conn.close()
+
+    def close(self):
+        # Connections still in use are closed when released
+        for conn in self._idle + [self.conn]:
+            if conn is not None:
+                conn.close()
+        self.conn = None
+        self._idle = []
+        self._queries = set()
+
+
+def _encoder(fmt, columns, transform):
+    """Encode rows as the items of a JSON array or as NDJSON lines."""
+    def encode(rows, first):
+        records = (dict(zip(columns, transform(row) if transform else row)) for row in rows)
+        lines = [json.dumps(record, ensure_ascii=False) for record in records]
+        if not lines:
+            return b""
+        if fmt == "ndjson":
+            return ("\n".join(lines) + "\n").encode()
+        return (("\n" if first else ",\n") + ",\n".join(lines)).encode()
+    return encode
+
+
+#### SERVER ####
+
+class ApiServer:
+    """
+    The HTTP API on `host` and `port` (0 picks a free port).
+
+    serve_forever() runs it in the calling thread until interrupted; as a
+    context manager it runs on a background thread, and `url` is its address.
+    """
+
+    def __init__(self, host=None, port=None, cache_bytes=CACHE_MAX_BYTES):
+        self.host = host or config.API_HOST
+        self.port = config.API_PORT if port is None else port
+        self.cache = ResponseCache(cache_bytes)
+        self._reader = _Reader()
+        self._database = ThreadPoolExecutor(max_workers=1, thread_name_prefix="api-database")
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def _db(self, function, *args):
+        return self._loop.run_in_executor(self._database, function, *args)
+
+    async def _start(self):
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, limit=MAX_HEADER_BYTES)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+
+    async def _run(self):
+        await self._start()
+        try:
+            await self._server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            # Connections still open are closed when asyncio.run cancels their tasks
+            self._server.close()
+            await self._db(self._reader.close)
+
+    def serve_forever(self):
+        # Bring the schema up to date before the connection goes read-only
+        database.get_connection()
+        try:
+            asyncio.run(self._run())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._database.shutdown()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="api-server", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None and self._server is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    #### HTTP ####
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.LimitOverrunError:
+                    await self._send_error(writer, HTTPError(431, "Request headers are too large."), False)
+                    break
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                request_line, *lines = head.decode("latin-1").rstrip("\r\n").split("\r\n")
+                headers = {}
+                for line in lines:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, target, version = request_line.split(" ")
+                except ValueError:
+                    await self._send_error(writer, HTTPError(400, "Malformed request line."), False)
+                    break
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                try:
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    # The body cannot be skipped, so the connection cannot be reused
+                    await self._send_error(writer, HTTPError(400, "Malformed Content-Length header."), False)
+                    break
+                if length:
+                    await reader.readexactly(length)
+                with stats.timer("api.request"):
+                    await self._respond(method, target, headers, writer, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _head(self, status, headers, keep_alive):
+        lines = [f"HTTP/1.1 {status} {REASONS[status]}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    async def _send(self, writer, status, body, headers, keep_alive):
+        writer.write(self._head(status, dict(headers, **{"Content-Length": str(len(body))}), keep_alive) + body)
+        await writer.drain()
+
+    async def _send_error(self, writer, error, keep_alive):
+        body = json.dumps({"error": str(error)}).encode()
+        await self._send(writer, error.status, body, {"Content-Type": "application/json"}, keep_alive)
+
+    async def _respond(self, method, target, headers, writer, keep_alive):
+        url = urlsplit(target)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            if method != "GET":
+                raise HTTPError(405, "Only GET requests are served.")
+            fmt = query.pop("format", "json")
+            if fmt not in CONTENT_TYPES:
+                raise HTTPError(400, f"Unknown format {fmt}. Use json or ndjson.")
+            version = await self._db(self._reader.version)
+            if url.path.rstrip("/") == "/version":
+                body = json.dumps({"version": version}).encode()
+                await self._send(writer, 200, body, {"Content-Type": "application/json",
+                                                     "Cache-Control": "no-cache"}, keep_alive)
+                return
+            if version is None:
+                raise HTTPError(404, "Revenues table does not exist.")
+            sql, params, transform, years = route(url.path, query)
+        except HTTPError as e:
+            await self._send_error(writer, e, keep_alive)
+            return
+
+        etag = f'"{version}-{fmt}"'
+        headers_out = {"Content-Type": CONTENT_TYPES[fmt], "ETag": etag, "Cache-Control": "no-cache"}
+        if etag in [tag.strip() for tag in headers.get("if-none-match", "").split(",")]:
+            stats.incr("api.not_modified")
+            writer.write(self._head(304, {"ETag": etag, "Cache-Control": "no-cache"}, keep_alive))
+            await writer.drain()
+            return
+        key = (url.path.rstrip("/"), tuple(sorted(query.items())), fmt)
+        body = self.cache.get(key, version)
+        if body is not None:
+            await self._send(writer, 200, body, headers_out, keep_alive)
+            return
+
+        try:
+            cursor = await self._db(self._reader.execute, sql, params, years)
+            rows = await self._db(cursor.fetchmany, STREAM_BATCH)
+        except RuntimeError as e:
+            # Too many archived years for one query
+            await self._send_error(writer, HTTPError(400, str(e)), keep_alive)
+            return
+        except sqlite3.OperationalError as e:
+            if "no such table" in str(e):
+                await self._send_error(writer, HTTPError(404, "Revenues table does not exist."), keep_alive)
+            else:
+                await self._send_error(writer, HTTPError(500, f"Database error: {e}"), keep_alive)
+            return
+        encode = _encoder(fmt, [d[0] for d in cursor.description], transform)
+        start, end = (b"", b"") if fmt == "ndjson" else (b"[", b"\n]\n")
+        if len(rows) < STREAM_BATCH:
+            await self._db(self._reader.release, cursor)
+            body = start + encode(rows, True) + (end if rows or fmt == "ndjson" else b"]\n")
+            await self._cache(key, version, body)
+            await self._send(writer, 200, body, headers_out, keep_alive)
+        else:
+            await self._stream(writer, cursor, encode, start + encode(rows, True), end, headers_out, keep_alive,
+                               key, version)
+
+    async def _cache(self, key, version, body):
+        # Only if nothing changed while the rows were read, and before the
+        # response is complete, so the client's next request finds it
+        if await self._db(self._reader.version) == version:
+            self.cache.put(key, version, body)
+
+    async def _stream(self, writer, cursor, encode, chunk, end, headers, keep_alive, key, version):
+        """Send the rows in chunks as they are read, caching the whole body if it is small enough."""
+        writer.write(self._head(200, dict(headers, **{"Transfer-Encoding": "chunked"}), keep_alive))
+        kept, size = [], 0
+        try:
+            while chunk:
+                writer.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                await writer.drain()
+                if kept is not None:
+                    kept.append(chunk)
+                    size += len(chunk)
+                    if size > CACHE_ENTRY_MAX_BYTES:
+                        kept = None
+                rows = await self._db(cursor.fetchmany, STREAM_BATCH)
+                chunk, end = (encode(rows, False), end) if rows else (end, b"")
+        finally:
+            await self._db(self._reader.release, cursor)
+        if kept is not None:
+            await self._cache(key, version, b"".join(kept))
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+
+def serve(host=None, port=None):
+    """Run the API until interrupted."""
+    server = ApiServer(host, port)
+    server.serve_forever()
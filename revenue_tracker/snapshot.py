@@ -0,0 +1,274 @@
+import json
+import os
+import time
+from pathlib import Path
+from revenue_tracker import archive, database, stats
+
+# Columnar snapshots of the revenues table, for analysis outside the program.
+#
+# export_snapshot() writes the table as Parquet or Arrow IPC files in hive
+# style directories (year=<year>/part-<first id>-<last id>-<n>.<ext>), with
+# the repetitive text columns dictionary encoded. A manifest in the directory
+# records the files and the last exported id, so later exports only append
+# the rows added since. load_snapshot() reads the files through memory maps,
+# so only the columns and partitions asked for are touched.
+#
+# Partitioning by city as well (city=<name>/year=<year>/...) lets a loader
+# skip the files of other cities, but with hundreds of cities the files hold a
+# few hundred rows each and reading them all is several times slower, so it
+# is an option for trackers of a few cities.
+#
+# pyarrow is optional and imported by the functions that need it.
+
+FORMATS = {"parquet": "parquet", "arrow": "arrow"}  # format: file extension
+PARTITION_COLUMNS = ["city", "year"]
+DEFAULT_PARTITION_BY = ["year"]
+MANIFEST = "_snapshot.json"
+BATCH_SIZE = 50000
+
+DICTIONARY_COLUMNS = ["city", "kind", "who", "main_weather", "weather_description", "weather_status"]
+FLOAT_COLUMNS = ["revenue", "declared_revenue", "temperature", "temperature_felt", "wind_speed",
+                 "weather_updated_at", "market_temperature_mean", "market_temperature_max"]
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.dataset as ds
+    except ImportError:
+        raise RuntimeError("Columnar snapshots require pyarrow. Install it with: pip install pyarrow")
+    return pa, pc, ds
+
+
+def _schema(pa):
+    """Schema of the exported rows, partition columns included."""
+    types = {"id": pa.int64(), "date": pa.date32(), "notes": pa.string(), "market_rain_hours": pa.int16()}
+    types.update({c: pa.float64() for c in FLOAT_COLUMNS})
+    types.update({c: pa.dictionary(pa.int32(), pa.string()) for c in DICTIONARY_COLUMNS})
+    fields = [pa.field(c, types[c]) for c in database.REVENUE_COLUMNS]
+    return pa.schema(fields + [pa.field("year", pa.int16())])
+
+
+def _partitioning(pa, ds, partition_by, read=False):
+    """Hive partitioning; reading collects the city dictionary from the directory names."""
+    schema = _schema(pa)
+    fields = pa.schema([schema.field(c) for c in partition_by])
+    if read and "city" in partition_by:
+        return ds.partitioning(fields, flavor="hive", dictionaries="infer")
+    return ds.partitioning(fields, flavor="hive")
+
+
+#### MANIFEST ####
+
+def read_manifest(path):
+    """Return the manifest of the snapshot in directory `path`, or None if there is none."""
+    try:
+        with open(Path(path) / MANIFEST, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_manifest(path, manifest):
+    # Replaced in one step, so an interrupted export leaves the previous manifest
+    tmp = Path(path) / f"{MANIFEST}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, Path(path) / MANIFEST)
+
+
+def _remove_unlisted(path, listed):
+    """Delete data files left by an interrupted export; they are not in the manifest."""
+    for extension in FORMATS.values():
+        for file in Path(path).rglob(f"part-*.{extension}"):
+            if file.relative_to(path).as_posix() not in listed:
+                file.unlink()
+
+
+#### EXPORT ####
+
+def _batches(pa, pc, schema, last_id, max_id, order, shared_dictionaries, summary):
+    """
+    Rows with last_id < id <= max_id as record batches, counted in summary.
+
+    With shared_dictionaries, every batch encodes a column with the same
+    dictionary, the sorted distinct values of the exported rows, as Arrow
+    IPC files allow only one; otherwise each batch has its own. pyarrow
+    consumes the batches in its own thread, so they are read through a
+    connection of their own.
+    """
+    columns = list(database.REVENUE_COLUMNS)
+    conn = database.create_connection()
+    if not conn:
+        raise RuntimeError("Failed to export snapshot due to connection issues.")
+    try:
+        # Archived years are part of the snapshot like the others
+        years = archive.years()
+        archive.attach(conn, years)
+        sql, params = database._union(columns, years, condition="id > ? AND id <= ?",
+                                      condition_params=[last_id, max_id])
+        dictionaries = {}
+        if shared_dictionaries:
+            for c in DICTIONARY_COLUMNS:
+                values = conn.execute(f"SELECT DISTINCT {c} FROM ({sql})", params).fetchall()
+                dictionaries[c] = pa.array(sorted(v for (v,) in values if v is not None), pa.string())
+        cursor = conn.execute(f"{sql} ORDER BY {order}", params)
+        while True:
+            with stats.timer("db.snapshot.fetch"):
+                rows = cursor.fetchmany(BATCH_SIZE)
+            if not rows:
+                return
+            values = dict(zip(columns, zip(*rows)))
+            arrays = {}
+            for c in columns:
+                if c == "date":
+                    # Dates that are not valid YYYY-MM-DD become null
+                    text = pa.array(values[c], pa.string())
+                    parsed = pc.strptime(text, format="%Y-%m-%d", unit="s", error_is_null=True)
+                    arrays[c] = parsed.cast(pa.date32())
+                elif c in dictionaries:
+                    indices = pc.index_in(pa.array(values[c], pa.string()), value_set=dictionaries[c])
+                    arrays[c] = pa.DictionaryArray.from_arrays(indices, dictionaries[c])
+                elif c in DICTIONARY_COLUMNS:
+                    arrays[c] = pa.array(values[c], pa.string()).dictionary_encode()
+                else:
+                    arrays[c] = pa.array(values[c], schema.field(c).type)
+            arrays["year"] = pc.year(arrays["date"]).cast(pa.int16())
+            summary["rows"] += len(rows)
+            yield pa.RecordBatch.from_arrays([arrays[f.name] for f in schema], schema=schema)
+    finally:
+        conn.close()
+
+
+@stats.timed("snapshot.export")
+def export_snapshot(path, fmt="parquet", partition_by=None, full=False):
+    """
+    Write the revenues added since the last snapshot in directory `path`.
+
+    The first export, or one with full=True, writes the whole table, as
+    `fmt` files partitioned by the `partition_by` columns (year by default,
+    or city and year). Appends keep the format and partitioning of the
+    snapshot. Rows changed or deleted after they were exported (for example
+    weather filled in later) are only picked up by a full export.
+
+    Returns a dictionary with the format, the number of rows and files
+    written and the last exported id, or None if the table does not exist.
+    """
+    pa, pc, ds = _pyarrow()
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported snapshot format '{fmt}'. Use one of: {', '.join(FORMATS)}")
+    if partition_by is not None:
+        partition_by = database._as_list(partition_by)
+        unknown = [c for c in partition_by if c not in PARTITION_COLUMNS]
+        if unknown:
+            raise ValueError(f"Cannot partition by {', '.join(unknown)}. Use: {', '.join(PARTITION_COLUMNS)}")
+    if not database.table_exists():
+        print("Revenues table does not exist.")
+        return None
+    conn = database.get_connection()
+    if not conn:
+        print("Failed to export snapshot due to connection issues.")
+        return None
+
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    previous = read_manifest(path)
+    manifest = None if full else previous
+    if manifest and (fmt != manifest["format"] or partition_by not in (None, manifest["partition_by"])):
+        raise ValueError(f"The snapshot in {path} is in {manifest['format']} format, partitioned by "
+                         f"{', '.join(manifest['partition_by'])}. Append with the same settings or export in full.")
+    if manifest is None:
+        if previous:
+            # Without its manifest an interrupted rewrite leaves no half-replaced snapshot
+            (path / MANIFEST).unlink()
+            for file in previous["files"]:
+                (path / file).unlink(missing_ok=True)
+        manifest = {"format": fmt, "partition_by": partition_by or DEFAULT_PARTITION_BY, "last_id": 0,
+                    "files": [], "created": time.time()}
+    _remove_unlisted(path, set(manifest["files"]))
+
+    last_id = manifest["last_id"]
+    years = archive.years()
+    archive.attach(conn, years)
+    max_id = max(conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+                 for table in ["revenues"] + [f"{archive.schema(y)}.revenues" for y in years])
+    summary = {"format": fmt, "rows": 0, "files": 0, "last_id": max(last_id, max_id)}
+    if max_id <= last_id:
+        return summary
+
+    schema = _schema(pa)
+    written = []
+    # Rows are read in id order, which SQLite scans sequentially. With a
+    # directory per city, they are read by city instead, so that each file is
+    # written at once rather than in many small row groups.
+    order = "city, date, id" if "city" in manifest["partition_by"] else "id"
+    batches = _batches(pa, pc, schema, last_id, max_id, order, fmt == "arrow", summary)
+    reader = pa.RecordBatchReader.from_batches(schema, batches)
+    ds.write_dataset(
+        reader, path, format="ipc" if fmt == "arrow" else fmt,
+        partitioning=_partitioning(pa, ds, manifest["partition_by"]),
+        basename_template=f"part-{last_id + 1}-{max_id}-{{i}}.{FORMATS[fmt]}",
+        existing_data_behavior="overwrite_or_ignore",
+        file_visitor=lambda file: written.append(file.path),
+        max_rows_per_group=BATCH_SIZE,
+    )
+    manifest["files"] += [Path(file).relative_to(path).as_posix() for file in written]
+    summary["files"] = len(written)
+
+    manifest.update(last_id=max_id, updated=time.time())
+    _write_manifest(path, manifest)
+    return summary
+
+
+#### LOAD ####
+
+def open_snapshot(path):
+    """
+    Return the snapshot in directory `path` as a pyarrow Dataset over memory
+    mapped files, or None if there is no snapshot. Only the files listed in
+    the manifest are read.
+    """
+    pa, _, ds = _pyarrow()
+    manifest = read_manifest(path)
+    if manifest is None:
+        return None
+    from pyarrow.fs import LocalFileSystem
+    path = Path(path).resolve()
+    return ds.dataset(
+        [(path / file).as_posix() for file in manifest["files"]],
+        format="ipc" if manifest["format"] == "arrow" else manifest["format"],
+        filesystem=LocalFileSystem(use_mmap=True),
+        partitioning=_partitioning(pa, ds, manifest["partition_by"], read=True),
+        partition_base_dir=path.as_posix(),
+    )
+
+
+@stats.timed("snapshot.load")
+def load_snapshot(path, columns=None, cities=None, years=None):
+    """
+    Load a snapshot as a DataFrame, or None if there is none.
+
+    `columns` selects a subset of columns; `cities` and `years` filter the
+    rows, skipping the files of other partitions. Dictionary encoded columns
+    become categoricals and dates datetime64.
+    """
+    _, _, ds = _pyarrow()
+    dataset = open_snapshot(path)
+    if dataset is None:
+        return None
+    if columns:
+        unknown = [c for c in columns if c not in dataset.schema.names]
+        if unknown:
+            raise ValueError(f"Unknown column(s): {', '.join(unknown)}")
+    filters = []
+    if cities:
+        filters.append(ds.field("city").isin(database._as_list(cities)))
+    if years:
+        years = [years] if isinstance(years, (int, str)) else years
+        filters.append(ds.field("year").isin([int(y) for y in years]))
+    condition = None
+    for keep in filters:
+        condition = keep if condition is None else condition & keep
+    table = dataset.to_table(columns=columns or None, filter=condition)
+    return table.to_pandas(date_as_object=False, split_blocks=True, self_destruct=True)
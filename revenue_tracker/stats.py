@@ -0,0 +1,275 @@
+import atexit
+import bisect
+import contextlib
+import functools
+import json
+import threading
+import time
+
+# Instrumentation of the database and weather hot paths: latency histograms
+# per operation, counters, cache hit ratios and bytes received.
+#
+# Recording is off by default. While it is off, timed functions and timer()
+# blocks only check one flag, so the instrumented code pays next to nothing.
+# Turn it on with enable(), from the Statistics menu or the --stats option of
+# the command line. snapshot() returns what was recorded; start_writer()
+# appends a snapshot to a JSON lines file at a fixed interval.
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf")]
+
+enabled = False
+_lock = threading.Lock()
+_timers = {}
+_counters = {}
+_started = time.time()
+
+
+class Histogram:
+    """Latency distribution of one operation, in fixed buckets."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.buckets = [0] * len(BUCKETS_MS)
+
+    def add(self, ms):
+        self.count += 1
+        self.total += ms
+        self.min = min(self.min, ms)
+        self.max = max(self.max, ms)
+        self.buckets[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th percentile, capped at the slowest call."""
+        rank = q / 100 * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS_MS, self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "total_ms": round(self.total, 3),
+            "mean_ms": round(self.total / self.count, 3),
+            "min_ms": round(self.min, 3),
+            "p50_ms": round(self.percentile(50), 3),
+            "p95_ms": round(self.percentile(95), 3),
+            "p99_ms": round(self.percentile(99), 3),
+            "max_ms": round(self.max, 3),
+        }
+
+
+#### RECORDING ####
+
+def record(name, ms):
+    """Add one call of `ms` milliseconds to the histogram of an operation."""
+    with _lock:
+        histogram = _timers.get(name)
+        if histogram is None:
+            histogram = _timers[name] = Histogram()
+        histogram.add(ms)
+
+
+def incr(name, n=1):
+    """Increase a counter."""
+    if enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + n
+
+
+def hit(cache_name, found):
+    """Count a lookup in a cache; hit ratios are derived in snapshot()."""
+    if enabled:
+        incr(f"cache.{cache_name}.{'hit' if found else 'miss'}")
+
+
+class _Timer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, (time.perf_counter() - self.start) * 1000)
+
+
+_NULL = contextlib.nullcontext()
+
+
+def timer(name):
+    """Context manager timing a block as operation `name`."""
+    return _Timer(name) if enabled else _NULL
+
+
+def timed(name):
+    """Decorator timing every call of a function as operation `name`."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(name, (time.perf_counter() - start) * 1000)
+        return wrapper
+    return decorator
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    """Forget everything recorded so far."""
+    global _started
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+        _started = time.time()
+
+
+def snapshot():
+    """Return the recorded timers, counters and cache hit ratios as a JSON-serializable dict."""
+    with _lock:
+        timers = {name: h.summary() for name, h in sorted(_timers.items())}
+        counters = dict(sorted(_counters.items()))
+    caches = {}
+    for name in counters:
+        if name.startswith("cache.") and name.endswith((".hit", ".miss")):
+            cache_name = name[len("cache."):name.rindex(".")]
+            hits = counters.get(f"cache.{cache_name}.hit", 0)
+            misses = counters.get(f"cache.{cache_name}.miss", 0)
+            caches[cache_name] = {"hits": hits, "misses": misses, "hit_ratio": round(hits / (hits + misses), 4)}
+    return {
+        "time": round(time.time(), 3),
+        "since": round(_started, 3),
+        "enabled": enabled,
+        "timers": timers,
+        "counters": counters,
+        "caches": caches,
+    }
+
+
+def format_snapshot(data):
+    """Render a snapshot as a text report."""
+    lines = []
+    if data["timers"]:
+        lines.append(f"{'operation':34} {'calls':>7} {'total ms':>10} {'mean':>8} {'p50':>8} {'p95':>8} {'max':>8}")
+        for name, t in data["timers"].items():
+            lines.append(f"{name:34} {t['count']:7} {t['total_ms']:10.1f} {t['mean_ms']:8.2f} "
+                         f"{t['p50_ms']:8.2f} {t['p95_ms']:8.2f} {t['max_ms']:8.2f}")
+    if data["caches"]:
+        lines.append("")
+        for name, c in data["caches"].items():
+            lines.append(f"cache {name}: {c['hits']} hits, {c['misses']} misses ({c['hit_ratio']:.0%} hit ratio)")
+    if data["counters"]:
+        lines.append("")
+        for name, value in data["counters"].items():
+            if not name.startswith("cache."):
+                lines.append(f"{name}: {value}")
+    return "\n".join(lines) if lines else "Nothing recorded yet."
+
+
+#### PERIODIC OUTPUT ####
+
+_writer = None
+_writer_path = None
+_writer_stop = threading.Event()
+_atexit_registered = False
+
+
+def write_snapshot(path):
+    """Append the current snapshot to a JSON lines file."""
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(snapshot()) + "\n")
+
+
+def _run_writer(path, interval):
+    while not _writer_stop.wait(interval):
+        write_snapshot(path)
+
+
+def start_writer(path, interval=60):
+    """Append a snapshot to `path` every `interval` seconds, and a last one when stopped or at exit."""
+    global _writer, _writer_path, _atexit_registered
+    stop_writer()
+    _writer_stop.clear()
+    _writer_path = path
+    _writer = threading.Thread(target=_run_writer, args=(path, interval), name="stats-writer", daemon=True)
+    _writer.start()
+    if not _atexit_registered:
+        atexit.register(stop_writer)
+        _atexit_registered = True
+
+
+def stop_writer():
+    """Stop the periodic writer, if running, after writing a last snapshot."""
+    global _writer, _writer_path
+    if _writer is not None:
+        _writer_stop.set()
+        _writer.join()
+        write_snapshot(_writer_path)
+        _writer = _writer_path = None
+
+
+def read_snapshots(path):
+    """Return the snapshots stored in a JSON lines file, oldest first."""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+#### PROFILING ####
+
+@contextlib.contextmanager
+def profiled(path=None, out=None, limit=25):
+    """
+    Run a block under cProfile. The statistics are saved to `path` (for
+    snakeviz or pstats) when given, and the `limit` functions with the most
+    cumulative time are printed to `out`.
+    """
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if path:
+            profiler.dump_stats(path)
+        if out is not None:
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(limit)
+
+
+@contextlib.contextmanager
+def traced_memory(out, limit=15):
+    """Run a block under tracemalloc and print its peak memory and largest allocation sites to `out`."""
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        yield
+    finally:
+        current, peak = tracemalloc.get_traced_memory()
+        top = tracemalloc.take_snapshot().statistics("lineno")[:limit]
+        tracemalloc.stop()
+        print(f"Memory: {current / 1024:.0f} KiB still allocated, peak {peak / 1024:.0f} KiB", file=out)
+        for stat in top:
+            print(f"  {stat}", file=out)
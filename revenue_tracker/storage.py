@@ -0,0 +1,550 @@
+import json
+from collections import defaultdict
+from contextlib import contextmanager
+from revenue_tracker.utils import _norm_city
+
+# Normalized storage of the revenues.
+#
+# Entries live in revenue_entries and refer to their city in cities, which
+# also holds its coordinates and timezone. The weather of a city and day is a
+# row of weather_observations, shared by whatever is recorded for that day,
+# with its condition texts stored once in weather_conditions. The personnel of
+# an entry are rows of revenue_staff pointing to staff instead of a comma
+# separated string, so per-person queries use an index.
+#
+# The revenues view joins them back into the rows the program always had:
+# SELECT * FROM revenues returns the same columns as the former table, with
+# who joined as "Marco, Liam". INSTEAD OF triggers keep the view writable for
+# other tools and older scripts; like the former ON CONFLICT DO NOTHING, an
+# insert for a date and city that already have an entry is ignored. The
+# program itself writes the tables with the functions below, which look up
+# the city, condition and staff ids of a whole batch at once.
+#
+# The hourly weather of a market day, when fetched, is a row of
+# weather_series: the hours packed in a BLOB and their day aggregates, which
+# the view returns as the market_* columns.
+
+WEATHER_COLUMNS = ["temperature", "temperature_felt", "wind_speed", "main_weather", "weather_description"]
+ENTRY_COLUMNS = ["date", "city", "revenue", "declared_revenue", "kind", "who", "notes", "weather_status"]
+
+VIEW = '''
+CREATE VIEW IF NOT EXISTS revenues AS
+SELECT
+    e.id,
+    e.date,
+    c.name AS city,
+    e.revenue,
+    e.declared_revenue,
+    e.kind,
+    (SELECT group_concat(name, ', ') FROM (
+        SELECT s.name FROM revenue_staff rs JOIN staff s ON s.id = rs.staff_id
+        WHERE rs.revenue_id = e.id ORDER BY rs.position
+    )) AS who,
+    w.temperature,
+    w.temperature_felt,
+    w.wind_speed,
+    NULLIF(wc.main, '') AS main_weather,
+    NULLIF(wc.description, '') AS weather_description,
+    e.notes,
+    w.updated_at AS weather_updated_at,
+    e.weather_status,
+    ws.temperature_mean AS market_temperature_mean,
+    ws.temperature_max AS market_temperature_max,
+    ws.rain_hours AS market_rain_hours
+FROM revenue_entries e
+LEFT JOIN cities c ON c.id = e.city_id
+LEFT JOIN weather_observations w ON w.city_id = e.city_id AND w.date = e.date
+LEFT JOIN weather_conditions wc ON wc.id = w.condition_id
+LEFT JOIN weather_series ws ON ws.city_id = e.city_id AND ws.date = e.date
+'''
+
+
+#### SCHEMA ####
+
+def _create_tables(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS cities (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        lat REAL,
+        lon REAL,
+        timezone TEXT
+    )
+    ''')
+    # A missing text is stored as '' so that every pair is unique
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS weather_conditions (
+        id INTEGER PRIMARY KEY,
+        main TEXT NOT NULL,
+        description TEXT NOT NULL,
+        UNIQUE (main, description)
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS weather_observations (
+        city_id INTEGER NOT NULL,
+        date TEXT NOT NULL,
+        temperature REAL,
+        temperature_felt REAL,
+        wind_speed REAL,
+        condition_id INTEGER,
+        updated_at REAL,
+        PRIMARY KEY (city_id, date)
+    ) WITHOUT ROWID
+    ''')
+    # Hourly weather over the market hours, from first_hour on, as packed
+    # float32 (temperature, wind speed, precipitation) triples
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS weather_series (
+        city_id INTEGER NOT NULL,
+        date TEXT NOT NULL,
+        first_hour INTEGER NOT NULL,
+        hours BLOB NOT NULL,
+        temperature_mean REAL,
+        temperature_max REAL,
+        rain_hours INTEGER NOT NULL,
+        updated_at REAL,
+        PRIMARY KEY (city_id, date)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS staff (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS revenue_entries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        date TEXT,
+        city_id INTEGER,
+        revenue REAL DEFAULT NULL,
+        declared_revenue REAL,
+        kind TEXT,
+        notes TEXT DEFAULT NULL,
+        weather_status TEXT
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS revenue_staff (
+        revenue_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        staff_id INTEGER NOT NULL,
+        PRIMARY KEY (revenue_id, position)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_entries_date_city ON revenue_entries (date, city_id)")
+    # The date index also orders rows by id (the rowid), which serves paging on (date, id)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_date ON revenue_entries (date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_city_date ON revenue_entries (city_id, date)")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_entries_pending ON revenue_entries (id) WHERE weather_status = 'pending'"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_revenue_staff_staff ON revenue_staff (staff_id, revenue_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_series_rain_hours ON weather_series (rain_hours)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_series_temperature_mean ON weather_series (temperature_mean)")
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS revenue_entries_staff_delete AFTER DELETE ON revenue_entries BEGIN
+        DELETE FROM revenue_staff WHERE revenue_id = OLD.id;
+    END
+    ''')
+
+
+# The who string of the NEW row as a JSON array, split on commas
+_WHO_JSON = """'["' || replace(replace(replace(NEW.who, '\\', '\\\\'), '"', '\\"'), ',', '","') || '"]'"""
+_CONDITION = "main = COALESCE(NEW.main_weather, '') AND description = COALESCE(NEW.weather_description, '')"
+
+
+def _view_write_sql(weather_when, staff_when, entry_id):
+    """Trigger statements storing the weather and staff of the NEW row of the view."""
+    return f'''
+        INSERT INTO weather_conditions (main, description)
+        SELECT COALESCE(NEW.main_weather, ''), COALESCE(NEW.weather_description, '')
+        WHERE ({weather_when}) AND (NEW.main_weather IS NOT NULL OR NEW.weather_description IS NOT NULL)
+            AND NOT EXISTS (SELECT 1 FROM weather_conditions WHERE {_CONDITION});
+        INSERT INTO weather_observations
+            (city_id, date, temperature, temperature_felt, wind_speed, condition_id, updated_at)
+        SELECT c.id, NEW.date, NEW.temperature, NEW.temperature_felt, NEW.wind_speed,
+            (SELECT id FROM weather_conditions WHERE {_CONDITION}), NEW.weather_updated_at
+        FROM cities c WHERE c.name = NEW.city AND NEW.date IS NOT NULL AND ({weather_when})
+        ON CONFLICT (city_id, date) DO UPDATE SET
+            temperature = excluded.temperature,
+            temperature_felt = excluded.temperature_felt,
+            wind_speed = excluded.wind_speed,
+            condition_id = excluded.condition_id,
+            updated_at = excluded.updated_at;
+        INSERT INTO staff (name)
+        SELECT DISTINCT trim(value) FROM json_each({_WHO_JSON})
+        WHERE ({staff_when}) AND trim(value) <> '' AND trim(value) NOT IN (SELECT name FROM staff);
+        INSERT INTO revenue_staff (revenue_id, position, staff_id)
+        SELECT {entry_id}, j.key, s.id FROM json_each({_WHO_JSON}) j JOIN staff s ON s.name = trim(j.value)
+        WHERE {staff_when};'''
+
+
+def _create_view(conn):
+    conn.execute(VIEW)
+    # Lookup rows are added with NOT EXISTS rather than OR IGNORE, which an
+    # INSERT OR REPLACE on the view would turn into a replace
+    add_city = '''
+        INSERT INTO cities (name) SELECT NEW.city
+        WHERE NEW.city IS NOT NULL AND NOT EXISTS (SELECT 1 FROM cities WHERE name = NEW.city);'''
+    entry = '''NEW.date, (SELECT id FROM cities WHERE name = NEW.city), NEW.revenue, NEW.declared_revenue,
+            NEW.kind, NEW.notes, NEW.weather_status'''
+    weather_given = " OR ".join(f"NEW.{c} IS NOT NULL" for c in WEATHER_COLUMNS + ["weather_updated_at"])
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS revenues_insert INSTEAD OF INSERT ON revenues BEGIN
+        SELECT RAISE(IGNORE) WHERE EXISTS (
+            SELECT 1 FROM revenue_entries e JOIN cities c ON c.id = e.city_id
+            WHERE e.date = NEW.date AND c.name = NEW.city
+        );
+        {add_city}
+        INSERT INTO revenue_entries (id, date, city_id, revenue, declared_revenue, kind, notes, weather_status)
+        VALUES (NEW.id, {entry});
+        {_view_write_sql(weather_given, "1", "COALESCE(NEW.id, (SELECT MAX(id) FROM revenue_entries))")}
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS revenues_delete INSTEAD OF DELETE ON revenues BEGIN
+        DELETE FROM revenue_entries WHERE id = OLD.id;
+    END
+    ''')
+    # The weather moves along when the date or city of an entry changes
+    weather_changed = " OR ".join(f"NEW.{c} IS NOT OLD.{c}"
+                                  for c in ["date", "city", *WEATHER_COLUMNS, "weather_updated_at"])
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS revenues_update INSTEAD OF UPDATE ON revenues BEGIN
+        {add_city}
+        UPDATE revenue_entries SET (id, date, city_id, revenue, declared_revenue, kind, notes, weather_status) =
+            (NEW.id, {entry})
+        WHERE id = OLD.id;
+        UPDATE revenue_staff SET revenue_id = NEW.id WHERE revenue_id = OLD.id AND NEW.id IS NOT OLD.id;
+        DELETE FROM revenue_staff WHERE revenue_id = NEW.id AND NEW.who IS NOT OLD.who;
+        {_view_write_sql(weather_changed, "NEW.who IS NOT OLD.who", "NEW.id")}
+    END
+    ''')
+
+
+def convert(conn):
+    """
+    Move the rows of a revenues table into the normalized tables and replace
+    it with the view, keeping the ids. Runs in the caller's transaction.
+    """
+    _create_tables(conn)
+    conn.execute("INSERT OR IGNORE INTO cities (name) SELECT DISTINCT city FROM revenues WHERE city IS NOT NULL")
+    conn.execute('''
+    INSERT OR IGNORE INTO weather_conditions (main, description)
+    SELECT DISTINCT COALESCE(main_weather, ''), COALESCE(weather_description, '') FROM revenues
+    WHERE main_weather IS NOT NULL OR weather_description IS NOT NULL
+    ''')
+    conn.execute('''
+    INSERT INTO revenue_entries (id, date, city_id, revenue, declared_revenue, kind, notes, weather_status)
+    SELECT r.id, r.date, c.id, r.revenue, r.declared_revenue, r.kind, r.notes, r.weather_status
+    FROM revenues r LEFT JOIN cities c ON c.name = r.city
+    ''')
+    # Weather needs a date and a city to be stored
+    any_weather = " OR ".join(f"r.{c} IS NOT NULL" for c in WEATHER_COLUMNS + ["weather_updated_at"])
+    conn.execute(f'''
+    INSERT INTO weather_observations
+        (city_id, date, temperature, temperature_felt, wind_speed, condition_id, updated_at)
+    SELECT c.id, r.date, r.temperature, r.temperature_felt, r.wind_speed, wc.id, r.weather_updated_at
+    FROM revenues r
+    JOIN cities c ON c.name = r.city
+    LEFT JOIN weather_conditions wc
+        ON wc.main = COALESCE(r.main_weather, '') AND wc.description = COALESCE(r.weather_description, '')
+    WHERE r.date IS NOT NULL AND ({any_weather})
+    ON CONFLICT (city_id, date) DO NOTHING
+    ''')
+    _store_staff(conn, conn.execute("SELECT id, who FROM revenues WHERE who IS NOT NULL").fetchall())
+    # Ids of deleted rows are not handed out again
+    conn.execute("DELETE FROM sqlite_sequence WHERE name = 'revenue_entries'")
+    conn.execute("INSERT INTO sqlite_sequence (name, seq) SELECT 'revenue_entries', seq FROM sqlite_sequence "
+                 "WHERE name = 'revenues'")
+    locate_cities(conn)
+
+    conn.execute("DROP TABLE revenues")
+    _create_view(conn)
+
+
+def create_series(conn):
+    """Add the weather_series table to a converted database, and its columns to the view."""
+    _create_tables(conn)
+    conn.execute("DROP VIEW revenues")
+    _create_view(conn)
+
+
+def drop(conn):
+    """Drop the entries and the view. Cities, staff and weather are kept, like the caches."""
+    conn.execute("DROP VIEW IF EXISTS revenues")
+    conn.execute("DROP TABLE IF EXISTS revenue_staff")
+    conn.execute("DROP TABLE IF EXISTS revenue_entries")
+
+
+#### LOOKUPS ####
+
+def split_who(who):
+    """Names of a personnel string such as "Marco, Liam", in order."""
+    if not who:
+        return []
+    return [name.strip() for name in who.split(",") if name.strip()]
+
+
+def _ids(conn, table, values):
+    """Ids of the names in a lookup table (cities or staff), adding the missing ones."""
+    names = {v for v in values if v is not None}
+    if not names:
+        return {}
+    select = f"SELECT id, name FROM {table} WHERE name IN (SELECT value FROM json_each(?))"
+    ids = {name: i for i, name in conn.execute(select, (json.dumps(list(names)),))}
+    missing = names - ids.keys()
+    if missing:
+        conn.executemany(f"INSERT INTO {table} (name) VALUES (?) ON CONFLICT (name) DO NOTHING",
+                         [(n,) for n in missing])
+        ids.update({name: i for i, name in conn.execute(select, (json.dumps(list(missing)),))})
+    return ids
+
+
+def _condition_ids(conn, pairs):
+    """Ids of (main, description) weather conditions, adding the missing ones."""
+    pairs = {(main or "", description or "") for main, description in pairs if main or description}
+    conn.executemany("INSERT INTO weather_conditions (main, description) VALUES (?, ?) ON CONFLICT DO NOTHING",
+                     list(pairs))
+    return {(main, description): i for i, main, description in
+            conn.execute("SELECT id, main, description FROM weather_conditions")}
+
+
+def _store_staff(conn, entries):
+    """Link (entry id, who string) pairs to their staff."""
+    names = {entry_id: split_who(who) for entry_id, who in entries}
+    ids = _ids(conn, "staff", (n for row in names.values() for n in row))
+    conn.executemany(
+        "INSERT INTO revenue_staff (revenue_id, position, staff_id) VALUES (?, ?, ?)",
+        [(entry_id, position, ids[name]) for entry_id, row in names.items() for position, name in enumerate(row)]
+    )
+
+
+def locate_cities(conn, names=None):
+    """Copy the coordinates and timezone of cities (all by default) from the geocoding cache."""
+    cached = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'geocode_cache'").fetchone()
+    if not cached:
+        return
+    if names is None:
+        names = [name for (name,) in conn.execute("SELECT name FROM cities")]
+    keys = {_norm_city(name): name for name in names}
+    rows = conn.execute(
+        "SELECT city_key, lat, lon, timezone FROM geocode_cache "
+        "WHERE city_key IN (SELECT value FROM json_each(?)) AND lat IS NOT NULL",
+        (json.dumps(list(keys)),)
+    ).fetchall()
+    conn.executemany("UPDATE cities SET lat = ?, lon = ?, timezone = ? WHERE name = ?",
+                     [(lat, lon, timezone, keys[key]) for key, lat, lon, timezone in rows])
+
+
+#### WRITES ####
+
+def _store_weather(conn, rows):
+    """Insert or replace the observations of (city id, date, *WEATHER_COLUMNS, updated_at) rows."""
+    conditions = _condition_ids(conn, [(row[5], row[6]) for row in rows])
+    conn.executemany('''
+    INSERT INTO weather_observations
+        (city_id, date, temperature, temperature_felt, wind_speed, condition_id, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (city_id, date) DO UPDATE SET
+        temperature = excluded.temperature,
+        temperature_felt = excluded.temperature_felt,
+        wind_speed = excluded.wind_speed,
+        condition_id = excluded.condition_id,
+        updated_at = excluded.updated_at
+    ''', [(city, date, temperature, felt, wind, conditions.get((main or "", description or "")), updated_at)
+          for city, date, temperature, felt, wind, main, description, updated_at in rows])
+
+
+def insert_entries(conn, rows):
+    """
+    Insert entries given as dicts with the ENTRY_COLUMNS and, optionally,
+    the WEATHER_COLUMNS. An entry for a date and city that already have one
+    is skipped. Runs in the caller's transaction.
+
+    Returns the new id of every row, or None for the skipped ones.
+    """
+    cities = _ids(conn, "cities", (row["city"] for row in rows))
+    insert = '''
+    INSERT INTO revenue_entries (date, city_id, revenue, declared_revenue, kind, notes, weather_status)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (date, city_id) DO NOTHING
+    '''
+    values = [(row["date"], cities.get(row["city"]), row["revenue"], row["declared_revenue"], row["kind"],
+               row["notes"], row["weather_status"]) for row in rows]
+    if len(rows) == 1:
+        cursor = conn.execute(insert, values[0])
+        ids = [cursor.lastrowid if cursor.rowcount else None]
+        _store_extras(conn, cities, ids, rows)
+        return ids
+
+    with versioned_once(conn):
+        last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM revenue_entries").fetchone()[0]
+        conn.executemany(insert, values)
+        # New ids are handed out in order, so the first row with a key gets the first id of that key
+        new = defaultdict(list)
+        for i, date, city in conn.execute(
+            "SELECT id, date, city_id FROM revenue_entries WHERE id > ? ORDER BY id", (last_id,)
+        ):
+            new[(date, city)].append(i)
+        ids = [new[key].pop(0) if new[key] else None for key in ((date, city) for date, city, *_ in values)]
+        _store_extras(conn, cities, ids, rows)
+    return ids
+
+
+def _store_extras(conn, cities, ids, rows):
+    """Store the weather and staff of the inserted entries."""
+    inserted = [(i, row) for i, row in zip(ids, rows) if i is not None]
+    weather = [(cities[row["city"]], row["date"], *(row.get(c) for c in WEATHER_COLUMNS),
+                row.get("weather_updated_at"))
+               for _, row in inserted
+               if row["city"] is not None and row["date"] is not None
+               and any(row.get(c) is not None for c in WEATHER_COLUMNS)]
+    if weather:
+        _store_weather(conn, weather)
+    _store_staff(conn, [(i, row["who"]) for i, row in inserted if row["who"]])
+
+
+def set_weather(conn, rows):
+    """
+    Store the weather of (city, date, *WEATHER_COLUMNS, fetched_at) rows and
+    mark the entries of those days 'ok'. Runs in the caller's transaction.
+
+    Returns the number of entries updated.
+    """
+    if not rows:
+        return 0
+    cities = _ids(conn, "cities", (row[0] for row in rows))
+    _store_weather(conn, [(cities[city], date, *values) for city, date, *values in rows])
+    locate_cities(conn, list(cities))
+    return conn.executemany(
+        "UPDATE revenue_entries SET weather_status = 'ok' WHERE date = ? AND city_id = ?",
+        [(date, cities[city]) for city, date, *_ in rows]
+    ).rowcount
+
+
+def set_weather_series(conn, rows):
+    """
+    Store the hourly weather of (city, date, first hour, packed hours, mean
+    temperature, maximum temperature, rain hours, fetched_at) rows. Runs in
+    the caller's transaction. Returns the number of rows stored.
+    """
+    if not rows:
+        return 0
+    cities = _ids(conn, "cities", (row[0] for row in rows))
+    conn.executemany('''
+    INSERT INTO weather_series
+        (city_id, date, first_hour, hours, temperature_mean, temperature_max, rain_hours, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (city_id, date) DO UPDATE SET
+        first_hour = excluded.first_hour,
+        hours = excluded.hours,
+        temperature_mean = excluded.temperature_mean,
+        temperature_max = excluded.temperature_max,
+        rain_hours = excluded.rain_hours,
+        updated_at = excluded.updated_at
+    ''', [(cities[city], date, *values) for city, date, *values in rows])
+    return len(rows)
+
+
+def get_weather_series(conn, city, date):
+    """Return (first hour, packed hours) of a city and day, or None if they were not fetched."""
+    return conn.execute(
+        "SELECT first_hour, hours FROM weather_series s JOIN cities c ON c.id = s.city_id "
+        "WHERE c.name = ? AND s.date = ?", (city, date)
+    ).fetchone()
+
+
+#### TRIGGER PAUSES ####
+# Batches skip per-row triggers and apply their effect once at the end. The
+# triggers are not dropped for that, which would change the schema and make
+# every other connection prepare its statements again: each one checks that
+# its name is not in trigger_pauses. Pauses are added and removed within the
+# writer's transaction, so other connections never see a trigger paused.
+
+def create_pauses(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS trigger_pauses (name TEXT PRIMARY KEY) WITHOUT ROWID")
+
+
+def unless_paused(name):
+    """WHEN condition of a trigger that paused(name) skips."""
+    return f"NOT EXISTS (SELECT 1 FROM trigger_pauses WHERE name = '{name}')"
+
+
+def is_paused(conn, name):
+    """Whether a paused(name) block is running in the connection's transaction."""
+    return conn.execute("SELECT 1 FROM trigger_pauses WHERE name = ?", (name,)).fetchone() is not None
+
+
+@contextmanager
+def paused(conn, name):
+    """
+    Skip the triggers checking `name` during the block. Runs in the caller's
+    transaction. A pause inside another of the same name is part of it: the
+    block gets whether it is the outermost one, which ends the pause.
+    """
+    if not conn.in_transaction:
+        conn.execute("BEGIN")
+    outermost = conn.execute("INSERT OR IGNORE INTO trigger_pauses (name) VALUES (?)", (name,)).rowcount == 1
+    try:
+        yield outermost
+    finally:
+        if outermost:
+            conn.execute("DELETE FROM trigger_pauses WHERE name = ?", (name,))
+
+
+#### DATA VERSION ####
+# A counter increased by every change to the entries or their weather, for
+# readers that cache what they read (the HTTP API). Triggers keep it, so
+# rows written by other tools through the view count too. It is kept when
+# the revenues are dropped, so a recreated table never repeats a version.
+
+VERSIONED_TABLES = ["revenue_entries", "weather_observations", "weather_series"]
+
+
+def create_version(conn):
+    create_pauses(conn)
+    conn.execute("CREATE TABLE IF NOT EXISTS data_version (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER)")
+    conn.execute("INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)")
+    for table in VERSIONED_TABLES:
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table}
+            WHEN {unless_paused("version")} BEGIN
+                UPDATE data_version SET version = version + 1 WHERE id = 1;
+            END
+            ''')
+
+
+def version_triggers():
+    return [f"{table}_version_{event}" for table in VERSIONED_TABLES for event in ("insert", "update", "delete")]
+
+
+@contextmanager
+def versioned_once(conn):
+    """
+    Count the writes of the block as one change rather than one per row, for
+    batches. Runs in the caller's transaction; nested blocks count as part of
+    the outermost one.
+    """
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'data_version'").fetchone():
+        # Not created yet by the migrations
+        yield
+        return
+    with paused(conn, "version") as outermost:
+        yield
+    if outermost:
+        bump_version(conn)
+
+
+def bump_version(conn):
+    """Increase the data version for changes the triggers do not see. Runs in the caller's transaction."""
+    conn.execute("UPDATE data_version SET version = version + 1 WHERE id = 1")
+
+
+def get_version(conn):
+    """Return the data version, or None if the database has none yet."""
+    row = conn.execute("SELECT version FROM data_version WHERE id = 1").fetchone()
+    return row[0] if row else None
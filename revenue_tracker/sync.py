@@ -0,0 +1,237 @@
+import gzip
+import json
+import os
+import time
+from pathlib import Path
+from revenue_tracker import archive, database, journal, stats, storage
+
+# Delta sync between copies of the database, through files.
+#
+# export_delta() writes the journal entries (see journal.py) that a peer has
+# not been sent yet, as gzipped NDJSON: a header line, then one JSON array
+# per change [node, seq, op, date, city, changed_at, data]. What was sent to
+# each peer is remembered, so the next export to it starts from there; only
+# the new part of the journal is read, by its (node, seq) key.
+# apply_delta() applies a file in one transaction, skipping the changes the
+# database already has, so files can be applied twice or in any order as long
+# as none is missing in between. When both copies changed an entry, the
+# change with the later time wins, the same way in every copy.
+#
+# An insert carries the weather its entry was saved with (all of it for the
+# entries recorded when the journal was created, see journal.seed()), and
+# applying it stores that weather. Weather fetched afterwards is not
+# journaled, so entries received without complete weather are queued for
+# enrichment like new ones. Changes of archived years are not applied, since
+# those years are closed.
+
+FORMAT = "revenue-tracker-delta"
+FORMAT_VERSION = 1
+
+
+def _journal_exists(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'change_journal'").fetchone()
+
+
+def _connection():
+    conn = database.get_connection()
+    if not conn:
+        raise RuntimeError("Failed to synchronize due to connection issues.")
+    return conn
+
+
+#### EXPORT ####
+
+def _changes(conn, node, after, last):
+    """
+    The query of the changes of `node` numbered after `after` up to `last`,
+    in order. The archives are read too when some of them were moved there.
+    """
+    bounds = (node, after, last)
+    columns = "node, seq, op, date, city, changed_at, data"
+    where = "WHERE node = ? AND seq > ? AND seq <= ?"
+    stored = conn.execute(f"SELECT COUNT(*) FROM change_journal {where}", bounds).fetchone()[0]
+    years = archive.years() if stored < last - after else []
+    archive.attach(conn, years)
+    tables = ["change_journal"] + [f"{archive.schema(y)}.change_journal" for y in years]
+    sql = " UNION ALL ".join(f"SELECT {columns} FROM {table} {where}" for table in tables)
+    return f"{sql} ORDER BY seq", bounds * len(tables)
+
+
+@stats.timed("sync.export")
+def export_delta(path, peer=None, full=False):
+    """
+    Write the changes `peer` has not been sent yet to the file `path`, and
+    remember them as sent. Without a peer, or with full=True, the whole
+    journal is written.
+
+    Returns a summary with the number of changes written per node, or None
+    if the database has no journal yet.
+    """
+    conn = _connection()
+    if not _journal_exists(conn):
+        print("Revenues table does not exist.")
+        return None
+    sent = {}
+    if peer and not full:
+        sent = dict(conn.execute("SELECT node, seq FROM sync_sent WHERE peer = ?", (peer,)))
+    known = journal.vector(conn)
+
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    header = {"format": FORMAT, "version": FORMAT_VERSION, "node": journal.node_id(conn),
+              "created": time.time(), "since": sent}
+    counts = {}
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        f.write(json.dumps(header) + "\n")
+        for node, last in sorted(known.items()):
+            cursor = conn.execute(*_changes(conn, node, sent.get(node, 0), last))
+            n = 0
+            for *change, data in cursor:
+                # data is JSON already
+                f.write(f"{json.dumps(change, ensure_ascii=False)[:-1]}, {data or 'null'}]\n")
+                n += 1
+            if n:
+                counts[node] = n
+    os.replace(tmp, path)
+
+    if peer:
+        with conn:
+            conn.executemany('''
+            INSERT INTO sync_sent (peer, node, seq) VALUES (?, ?, ?)
+            ON CONFLICT (peer, node) DO UPDATE SET seq = excluded.seq
+            ''', [(peer, node, seq) for node, seq in known.items()])
+    return {"changes": sum(counts.values()), "nodes": counts, "bytes": path.stat().st_size}
+
+
+#### APPLY ####
+
+def _delete(conn, date, city):
+    conn.execute("DELETE FROM revenue_entries WHERE date = ? AND city_id = (SELECT id FROM cities WHERE name = ?)",
+                 (date, city))
+
+
+def _insert(conn, date, city, data):
+    row = {"date": date, "city": city, **{field: data.get(field) for field in journal.DATA_FIELDS}}
+    complete = all(row[field] is not None for field in journal.WEATHER_FIELDS)
+    row["weather_status"] = "ok" if complete else "pending"
+    [revenue_id] = storage.insert_entries(conn, [row])
+    if revenue_id and not complete:
+        database.enqueue_weather(conn, [revenue_id])
+
+
+def _clear(conn, stamp):
+    """Delete the entries whose latest change is older than the clear at `stamp`."""
+    changed_at, node, seq = stamp
+    conn.execute('''
+    DELETE FROM revenue_entries WHERE id IN (
+        SELECT r.id FROM revenues r WHERE NOT EXISTS (
+            SELECT 1 FROM change_journal j
+            WHERE j.date = r.date AND j.city = r.city AND j.op <> 'clear'
+            AND (j.changed_at > ? OR (j.changed_at = ? AND (j.node > ? OR (j.node = ? AND j.seq > ?))))
+        )
+    )
+    ''', (changed_at, changed_at, node, node, seq))
+
+
+def _read(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            header = json.loads(f.readline())
+        except (ValueError, gzip.BadGzipFile, EOFError):
+            header = None
+        if not isinstance(header, dict) or header.get("format") != FORMAT:
+            raise ValueError(f"{path} is not a revenue tracker delta file.")
+        if header.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{path} has delta format version {header.get('version')}; "
+                             f"this program reads version {FORMAT_VERSION}.")
+        yield header
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+@stats.timed("sync.apply")
+def apply_delta(path):
+    """
+    Apply the changes of a delta file that this database does not have yet,
+    in one transaction.
+
+    Returns a summary with the number of changes read, already known,
+    applied, superseded by a later change of the same entry, and left out
+    because their year is archived. Raises
+    ValueError, applying nothing, if the file is not a delta or changes of a
+    node are missing before the ones it holds.
+    """
+    changes = _read(path)
+    header = next(changes)
+    database.create_table()
+    conn = _connection()
+    local = journal.node_id(conn)
+    known = journal.vector(conn)
+    summary = {"from": header["node"], "changes": 0, "known": 0, "applied": 0, "superseded": 0, "archived": 0}
+
+    with conn:
+        clear = journal.latest_clear(conn)
+        latest_time = 0.0
+        for node, seq, op, date, city, changed_at, data in changes:
+            summary["changes"] += 1
+            last = known.get(node, 0)
+            if seq <= last:
+                summary["known"] += 1
+                continue
+            if seq != last + 1:
+                raise ValueError(f"Changes {last + 1} to {seq - 1} of node {node} are missing. "
+                                 f"Apply the earlier delta files first, or export a full one.")
+            if op not in journal.OPS:
+                raise ValueError(f"Unknown change '{op}' in {path}.")
+
+            stamp = (changed_at, node, seq)
+            if op != "clear" and archive.is_archived(date):
+                summary["archived"] += 1
+            elif op == "clear":
+                _clear(conn, stamp)
+                clear = max(clear, stamp) if clear else stamp
+                summary["applied"] += 1
+            else:
+                previous = [s for s in (journal.latest_change(conn, date, city), clear) if s]
+                if previous and max(previous) > stamp:
+                    summary["superseded"] += 1
+                else:
+                    _delete(conn, date, city)
+                    if op == "insert":
+                        _insert(conn, date, city, data or {})
+                    summary["applied"] += 1
+            # Recorded even when superseded, so that it is passed on in order
+            conn.execute(
+                "INSERT INTO change_journal (node, seq, op, date, city, changed_at, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (node, seq, op, date, city, changed_at, json.dumps(data) if data is not None else None)
+            )
+            known[node] = seq
+            latest_time = max(latest_time, changed_at)
+
+        conn.executemany('''
+        INSERT INTO sync_vector (node, seq) VALUES (?, ?)
+        ON CONFLICT (node) DO UPDATE SET seq = excluded.seq
+        ''', [(node, seq) for node, seq in known.items() if node != local])
+        journal.advance_clock(conn, latest_time)
+    return summary
+
+
+#### STATUS ####
+
+def sync_status():
+    """This database's node id, the last change known of every node, and the changes not yet sent to each peer."""
+    conn = _connection()
+    if not _journal_exists(conn):
+        print("Revenues table does not exist.")
+        return None
+    known = journal.vector(conn)
+    peers = {}
+    for peer, node, seq in conn.execute("SELECT peer, node, seq FROM sync_sent ORDER BY peer"):
+        peers.setdefault(peer, dict.fromkeys(known, 0))[node] = seq
+    return {
+        "node": journal.node_id(conn),
+        "known": known,
+        "unsent": {peer: sum(max(0, last - sent.get(node, 0)) for node, last in known.items())
+                   for peer, sent in peers.items()},
+    }
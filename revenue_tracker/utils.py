@@ -1,9 +1,11 @@
 from __future__ import annotations
-from datetime import date as date_cls, datetime
+from datetime import date as date_cls, datetime, timedelta
 import json
+import threading
 from functools import lru_cache
 from pathlib import Path
 from typing import Optional
+from revenue_tracker import config
 
 ### Input validations
 def validate_date(input_date):
@@ -19,35 +21,132 @@ def validate_date(input_date):
 
 
 ### Importing default people for days and place
-def _weekday(date_str: str) -> str:
-    return datetime.strptime(date_str, "%Y-%m-%d").strftime("%A")
+#
+# who_defaults.json maps a city to the personnel of each weekday, with "*"
+# for the other days. It is compiled into one tuple of seven entries per
+# city, Monday first, so a lookup is two indexing operations. The file is
+# checked on every lookup and compiled again when its modification time or
+# size changes; an invalid file is reported and the previous rules are kept.
+# A missing file means no defaults.
+
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+_who_rules = {"key": None, "table": {}}
+_who_rules_lock = threading.Lock()
+
+
+@lru_cache(maxsize=4096)
+def _weekday(date_str: str) -> int:
+    """Weekday of a YYYY-MM-DD date, Monday is 0."""
+    return datetime.strptime(date_str, "%Y-%m-%d").weekday()
 
 
 def _norm_city(city: str) -> str:
     return city.strip().lower()
 
 
-@lru_cache(maxsize=1)
+def compile_who_defaults(data) -> dict:
+    """
+    Compile the content of who_defaults.json into {city: (who on Monday,
+    ..., who on Sunday)}. City names are matched case-insensitively and so
+    are weekdays. Raises ValueError listing every invalid key or value.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("who_defaults.json must hold an object mapping cities to weekdays.")
+    errors, table = [], {}
+    for city, rules in data.items():
+        key = _norm_city(city)
+        if not key:
+            errors.append(f"empty city name {city!r}")
+            continue
+        if key in table:
+            errors.append(f"city {city!r} is listed twice")
+            continue
+        if not isinstance(rules, dict):
+            errors.append(f"{city}: expected an object mapping weekdays to people")
+            continue
+        days, fallback = [None] * 7, None
+        for day, who in rules.items():
+            if who is not None and not isinstance(who, str):
+                errors.append(f"{city}.{day}: expected a string such as \"Marco, Liam\"")
+            elif day == "*":
+                fallback = who
+            elif day.strip().capitalize() in WEEKDAYS:
+                days[WEEKDAYS.index(day.strip().capitalize())] = who
+            else:
+                errors.append(f"{city}: unknown weekday {day!r}, use English day names or \"*\"")
+        table[key] = tuple(fallback if who is None else who for who in days)
+    if errors:
+        raise ValueError("Invalid who_defaults.json: " + "; ".join(errors))
+    return table
+
+
 def _load_who_defaults() -> dict:
-    path = Path(__file__).with_name("who_defaults.json")
-    with path.open("r", encoding="utf-8") as f:
-        return json.load(f)
+    """The compiled rules, compiled again if the file changed since the last call."""
+    path = Path(config.WHO_DEFAULTS_PATH)
+    try:
+        st = path.stat()
+        key = (str(path), st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        key = (str(path), None, None)
+    if key == _who_rules["key"]:
+        return _who_rules["table"]
+
+    with _who_rules_lock:
+        if key != _who_rules["key"]:
+            table = {}
+            if key[1] is not None:
+                try:
+                    with path.open("r", encoding="utf-8") as f:
+                        table = compile_who_defaults(json.load(f))
+                except (OSError, ValueError) as e:
+                    # json.JSONDecodeError is a ValueError too
+                    print(f"\nWARNING: {e}. Keeping the previous default personnel.\n")
+                    table = _who_rules["table"]
+            _who_rules.update(key=key, table=table)
+    return _who_rules["table"]
 
 
 def default_who(city: str, date_str: str) -> Optional[str]:
-    data = _load_who_defaults()
-    c = _norm_city(city)
-    city_rules = data.get(c)
-    if not isinstance(city_rules, dict):
+    rules = _load_who_defaults().get(_norm_city(city))
+    if rules is None:
         return None
+    return rules[_weekday(date_str)]
+
+
+def default_who_many(rows) -> list:
+    """Default personnel of many (city, date) pairs, with one check of the rules file."""
+    table = _load_who_defaults()
+    result = []
+    for city, date_str in rows:
+        rules = table.get(_norm_city(city)) if city is not None else None
+        result.append(rules[_weekday(date_str)] if rules else None)
+    return result
+
 
-    wd = _weekday(date_str)
-    who = city_rules.get(wd)
-    if isinstance(who, str):
-        return who
+def default_who_range(city: str, start: str, end: str) -> dict:
+    """Default personnel of every day from start to end (inclusive) in a city, as {date: who}."""
+    rules = _load_who_defaults().get(_norm_city(city))
+    first = datetime.strptime(start, "%Y-%m-%d").date()
+    days = (datetime.strptime(end, "%Y-%m-%d").date() - first).days + 1
+    result = {}
+    for n in range(max(days, 0)):
+        day = first + timedelta(days=n)
+        result[day.isoformat()] = rules[day.weekday()] if rules else None
+    return result
 
-    who = city_rules.get("*")
-    if isinstance(who, str):
-        return who
 
-    return None
\ No newline at end of file
+def scheduled_days(start: str, end: str) -> list:
+    """
+    The market days from start to end (inclusive) according to the rules, as
+    (city, date) pairs in date order: the days with personnel in a city.
+    Cities are given in lower case, as matched.
+    """
+    table = _load_who_defaults()
+    first = datetime.strptime(start, "%Y-%m-%d").date()
+    days = (datetime.strptime(end, "%Y-%m-%d").date() - first).days + 1
+    result = []
+    for n in range(max(days, 0)):
+        day = first + timedelta(days=n)
+        result += [(city, day.isoformat()) for city, rules in table.items() if (rules[day.weekday()] or "").strip()]
+    return result
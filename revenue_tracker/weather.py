@@ -1,47 +1,199 @@
-import requests
-from timezonefinder import TimezoneFinder
+from array import array
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
-from dotenv import load_dotenv
-import os
+from functools import lru_cache
+import math
+import random
+import sys
+import threading
+import time
+from revenue_tracker import cache, config, stats
+
+# requests and timezonefinder are imported by the functions that use them,
+# so that sessions which never fetch weather do not pay for loading them.
 
 # WEATHER API CONFIGURATION
-BASE_URL_TIMEMACHINE = "https://api.openweathermap.org/data/3.0/onecall/timemachine"
+# Paths below config.OPENWEATHER_BASE_URL
+GEO_PATH = "/geo/1.0/direct"
+TIMEMACHINE_PATH = "/data/3.0/onecall/timemachine"
+
+# Local hour of the single observation of a day
+SAMPLE_HOUR = 10
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+BACKOFF_BASE = 0.5  # seconds
+BACKOFF_CAP = 30.0  # seconds
+
+# HTTP client
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate_per_minute` requests with bursts up to `capacity`."""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+_session = None
+_session_lock = threading.Lock()
+rate_limiter = None
+
+def get_rate_limiter() -> TokenBucket:
+    """Return the process-wide request budget, created from the configuration on first use."""
+    global rate_limiter
+    with _session_lock:
+        if rate_limiter is None:
+            rate_limiter = TokenBucket(config.OPENWEATHER_REQUESTS_PER_MINUTE)
+    return rate_limiter
 
-load_dotenv()
+def get_session() -> "requests.Session":
+    """Return the process-wide HTTP session, whose keep-alive connections are shared by all threads."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=config.OPENWEATHER_WORKERS)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+    return _session
 
-API_KEY = os.environ.get("OPENWEATHER_API_KEY")
-if not API_KEY:
-    raise RuntimeError(
-        "Missing OPENWEATHER_API_KEY. "
-        "Create a .env file in the project root."
-    )
+def _backoff(attempt, retry_after=None):
+    # Full jitter exponential backoff, never shorter than the server asked for
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, float(retry_after))
+    return delay
+
+def api_get(url, params, operation="http.request"):
+    """
+    GET an OpenWeather endpoint within the request budget.
+
+    Connection errors, timeouts, 429 and 5xx responses are retried with
+    jittered exponential backoff. The last response is returned when retries
+    run out; the last connection error is raised. Each attempt is timed as
+    `operation` when statistics are recorded.
+    """
+    import requests
+
+    for attempt in range(config.OPENWEATHER_MAX_RETRIES + 1):
+        with stats.timer("http.rate_limit_wait"):
+            get_rate_limiter().acquire()
+        retry_after = None
+        try:
+            with stats.timer(operation):
+                response = get_session().get(url, params=params, timeout=config.OPENWEATHER_TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout):
+            stats.incr("http.connection_errors")
+            if attempt == config.OPENWEATHER_MAX_RETRIES:
+                raise
+        else:
+            if stats.enabled:
+                stats.incr(f"http.status.{response.status_code}")
+                stats.incr("http.bytes_received", len(response.content))
+            if response.status_code not in RETRY_STATUSES or attempt == config.OPENWEATHER_MAX_RETRIES:
+                return response
+            retry_after = response.headers.get("Retry-After")
+        stats.incr("http.retries")
+        time.sleep(_backoff(attempt, retry_after))
 
 # Functions
+@stats.timed("weather.get_city_coordinates")
 def get_city_coordinates(city):
-    geo_url = "http://api.openweathermap.org/geo/1.0/direct"
-    geo_params = {"q": city, "appid": API_KEY}
-    response = requests.get(geo_url, params=geo_params)
+    cached = cache.get_coordinates(city)
+    stats.hit("geocode", cached is not None)
+    if cached is not None:
+        return cached
+
+    geo_url = config.OPENWEATHER_BASE_URL + GEO_PATH
+    geo_params = {"q": city, "appid": config.get_api_key()}
+    response = api_get(geo_url, geo_params, "http.geocode")
     if response.status_code == 200:
         data = response.json()
         if data:
-            return data[0]["lat"], data[0]["lon"]
+            lat, lon = data[0]["lat"], data[0]["lon"]
+            cache.set_coordinates(city, lat, lon)
+            return lat, lon
         else:
             print(f"Error: No city found for '{city}'")
+            cache.set_coordinates(city, None, None)
     else:
         print(f"Error in geocoding request: {response.status_code}")
     return None, None
 
-def local_to_utc_timestamp(date_str: str, lat: float, lon: float, hour: int = 10, minute: int = 0) -> int:
-    tz_name = TimezoneFinder().timezone_at(lat=lat, lng=lon)
+_timezone_finder = None
+
+def get_timezone_finder() -> "TimezoneFinder":
+    """Return the process-wide TimezoneFinder, loading its data on first use."""
+    global _timezone_finder
+    if _timezone_finder is None:
+        from timezonefinder import TimezoneFinder
+        _timezone_finder = TimezoneFinder()
+    return _timezone_finder
+
+@lru_cache(maxsize=256)
+def timezone_at(lat: float, lon: float) -> str:
+    """Resolve the timezone name for a location, using the cache before the polygon data."""
+    tz_name = cache.get_timezone(lat, lon)
+    stats.hit("timezone", bool(tz_name))
+    if tz_name:
+        return tz_name
+
+    with stats.timer("weather.timezonefinder"):
+        tz_name = get_timezone_finder().timezone_at(lat=lat, lng=lon)
     if not tz_name:
         tz_name = "UTC"  # fallback (e.g., ocean / not found)
+    cache.set_timezone(lat, lon, tz_name)
+    return tz_name
 
-    local_tz = ZoneInfo(tz_name)
+@stats.timed("weather.timezone_lookup")
+def local_to_utc_timestamp(date_str: str, lat: float, lon: float, hour: int = 10, minute: int = 0) -> int:
+    local_tz = ZoneInfo(timezone_at(lat, lon))
     local_dt = datetime.strptime(date_str, "%Y-%m-%d").replace(hour=hour, minute=minute, tzinfo=local_tz)
     return int(local_dt.astimezone(ZoneInfo("UTC")).timestamp())
 
-def get_day_weather(city, date=None):
+def get_timemachine(lat: float, lon: float, dt: int, use_cache: bool = True) -> dict:
+    """Return the timemachine payload for a location and UTC timestamp, from cache when possible."""
+    data = cache.get_observation(lat, lon, dt) if use_cache else None
+    if use_cache:
+        stats.hit("observation", data is not None)
+    if data is not None:
+        return data
+
+    params = {
+        "lat": lat, 
+        "lon": lon,
+        "dt": dt,
+        "appid": config.get_api_key(),
+        "units": "metric"
+    }
+
+    response = api_get(config.OPENWEATHER_BASE_URL + TIMEMACHINE_PATH, params, "http.timemachine")
+    if response.status_code != 200:
+        raise ConnectionError(f"Error in weather request: {response.status_code}")
+
+    data = response.json()
+    if data.get('data'):
+        cache.set_observation(lat, lon, dt, data)
+    return data
+
+@stats.timed("weather.get_day_weather")
+def get_day_weather(city, date=None, use_cache=True):
     """
     Retrieves daily weather data for a given city and date using the OpenWeather API.
 
@@ -52,6 +204,9 @@ def get_day_weather(city, date=None):
     date : str or datetime, optional
         The date for which to retrieve weather data. Can be a string in the format "YYYY-MM-DD"
         or a `datetime` object. If not provided, defaults to the current day.
+    use_cache : bool, optional
+        If False, the observation is fetched again even if it is cached, e.g. to pick up
+        corrections from the provider. Defaults to True.
 
     Returns:
     --------
@@ -88,21 +243,9 @@ def get_day_weather(city, date=None):
         if date is None:
             date = datetime.now().strftime("%Y-%m-%d")
 
-        date = local_to_utc_timestamp(date_str=date, lat=lat, lon=lon, hour=10, minute=0)
-        
-        params = {
-            "lat": lat, 
-            "lon": lon,
-            "dt": date,
-            "appid": API_KEY,
-            "units": "metric"
-        }
-
-        response = requests.get(BASE_URL_TIMEMACHINE, params=params)
-        if response.status_code != 200:
-            raise ConnectionError(f"Error in weather request: {response.status_code}")
-
-        data= response.json()
+        date = local_to_utc_timestamp(date_str=date, lat=lat, lon=lon, hour=SAMPLE_HOUR, minute=0)
+
+        data = get_timemachine(lat, lon, date, use_cache=use_cache)
         # Check that the expected data exists; otherwise, raise an exception.
         if not data.get('data') or len(data['data']) == 0:
             raise ValueError("Weather data not available for the requested date.")
@@ -135,3 +278,146 @@ def get_day_weather(city, date=None):
         # Reraise any other exceptions as a generic error.
         raise Exception(f"Unexpected error in get_day_weather: {e}")
 
+
+
+@stats.timed("weather.get_many_day_weather")
+def get_many_day_weather(pairs, max_workers=None, use_cache=True):
+    """
+    Retrieve daily weather for many (city, date) pairs concurrently.
+
+    Cities are geocoded once each before the weather requests are spread
+    over a thread pool sharing the pooled HTTP session and request budget.
+
+    Returns a dictionary mapping each distinct (city, date) pair to the
+    tuple returned by `get_day_weather`, or to the exception it raised.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    pairs = list(dict.fromkeys(pairs))
+    max_workers = max_workers or config.OPENWEATHER_WORKERS
+
+    def fetch(pair):
+        try:
+            return pair, get_day_weather(*pair, use_cache=use_cache)
+        except Exception as e:
+            return pair, e
+
+    def geocode(city):
+        # Errors are reported by the weather requests of the city
+        try:
+            get_city_coordinates(city)
+        except Exception:
+            pass
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(geocode, {city for city, _ in pairs}))
+        return dict(executor.map(fetch, pairs))
+
+
+#### HOURLY SERIES ####
+# With config.WEATHER_HOURLY, a market day is also sampled every hour from
+# MARKET_OPEN_HOUR to MARKET_CLOSE_HOUR, local time. Each hour is one
+# timemachine request, cached like the single samples, and the hours of all
+# the days asked for are fetched concurrently. A day is stored as float32
+# (temperature, wind speed, precipitation) triples packed in one BLOB, along
+# with its mean and maximum temperature and rain hours, computed once.
+
+SERIES_FIELDS = ["temperature", "wind_speed", "precipitation"]
+RAIN_THRESHOLD = 0.1  # mm of rain or snow in an hour that make it a rain hour
+
+
+def market_hours():
+    """Local hours sampled for a market day, from the opening to the closing hour."""
+    start, end = config.MARKET_OPEN_HOUR, config.MARKET_CLOSE_HOUR
+    if not 0 <= start <= end <= 23:
+        raise ValueError(f"Invalid market hours {start}-{end}. Use hours from 0 to 23, opening first.")
+    return list(range(start, end + 1))
+
+
+def pack_series(values):
+    """Pack (temperature, wind speed, precipitation) triples as little-endian float32; None becomes NaN."""
+    packed = array("f", (math.nan if v is None else v for triple in values for v in triple))
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack_series(blob):
+    """Return the triples packed by pack_series, with NaN for unknown values."""
+    values = array("f")
+    values.frombytes(blob)
+    if sys.byteorder == "big":
+        values.byteswap()
+    n = len(SERIES_FIELDS)
+    return [tuple(values[i:i + n]) for i in range(0, len(values), n)]
+
+
+def summarize_series(values):
+    """Mean and maximum temperature (None if unknown) and number of rain hours of a series."""
+    temperatures = [t for t, _, _ in values if t is not None and not math.isnan(t)]
+    rain_hours = sum(1 for _, _, p in values if p is not None and p >= RAIN_THRESHOLD)
+    if not temperatures:
+        return None, None, rain_hours
+    return sum(temperatures) / len(temperatures), max(temperatures), rain_hours
+
+
+def _hour_values(data):
+    """The (temperature, wind speed, precipitation) of a timemachine payload."""
+    if not data.get("data"):
+        return None, None, None
+    hour = data["data"][0]
+    precipitation = sum((hour.get(kind) or {}).get("1h", 0.0) for kind in ("rain", "snow"))
+    return hour.get("temp"), hour.get("wind_speed"), precipitation
+
+
+@stats.timed("weather.get_many_day_series")
+def get_many_day_series(pairs, max_workers=None, use_cache=True):
+    """
+    Retrieve the hourly weather of many (city, date) pairs over the market
+    hours, with the requests of all pairs spread over one thread pool.
+
+    Returns a dictionary mapping each distinct (city, date) pair to a tuple
+    (first hour, packed series, mean temperature, maximum temperature, rain
+    hours), or to the exception raised by one of its requests.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    pairs = list(dict.fromkeys(pairs))
+    hours = market_hours()
+    max_workers = max_workers or config.OPENWEATHER_WORKERS
+
+    def locate(city):
+        try:
+            lat, lon = get_city_coordinates(city)
+            if lat is None or lon is None:
+                raise ValueError(f"Impossible to find coordinates for city '{city}'.")
+            return lat, lon
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        cities = list({city for city, _ in pairs})
+        coordinates = dict(zip(cities, executor.map(locate, cities)))
+
+        def fetch(request):
+            (city, date), hour = request
+            lat, lon = coordinates[city]
+            try:
+                dt = local_to_utc_timestamp(date_str=date, lat=lat, lon=lon, hour=hour)
+                return _hour_values(get_timemachine(lat, lon, dt, use_cache=use_cache))
+            except Exception as e:
+                return e
+
+        requests = [(pair, hour) for pair in pairs if not isinstance(coordinates[pair[0]], Exception)
+                    for hour in hours]
+        fetched = dict(zip(requests, executor.map(fetch, requests)))
+
+    results = {}
+    for pair in pairs:
+        if isinstance(coordinates[pair[0]], Exception):
+            results[pair] = coordinates[pair[0]]
+            continue
+        values = [fetched[(pair, hour)] for hour in hours]
+        error = next((v for v in values if isinstance(v, Exception)), None)
+        results[pair] = error or (hours[0], pack_series(values), *summarize_series(values))
+    return results
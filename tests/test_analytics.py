@@ -0,0 +1,80 @@
+import sys
+import os
+
+import numpy as np
+import pytest
+
+# Add the project root to the Python path (go back one folder)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from revenue_tracker import analytics, config, database
+
+
+@pytest.fixture
+def planted(tmp_path, monkeypatch):
+    """Revenues that rise by 20 per degree, drop by 200 with rain and are 500 higher in Zurich."""
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+    database.create_table()
+    rng = np.random.default_rng(0)
+    rows = []
+    for city, effect in (("Zurich", 500.0), ("Basel", 0.0), ("Bern", 100.0)):
+        for day in np.arange(np.datetime64("2023-01-01"), np.datetime64("2024-01-01")):
+            temp, felt, wind = rng.uniform(-5, 30), rng.uniform(-10, 30), rng.uniform(0, 10)
+            weather = rng.choice(["Clear", "Rain"])
+            revenue = 1000 + effect + 20 * temp - 200 * (weather == "Rain") + rng.normal(0, 10)
+            rows.append((str(day), city, revenue, temp, felt, wind, weather))
+    rows.append(("2024-01-01", "Zurich", None, 5.0, 5.0, 1.0, "Clear"))  # no revenue yet
+    conn = database.get_connection()
+    with conn:
+        conn.executemany('''
+        INSERT INTO revenues (date, city, revenue, temperature, temperature_felt, wind_speed, main_weather)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+    return analytics.load_dataset(batch_size=100)
+
+
+def test_load_dataset(planted):
+    assert len(planted) == 3 * 365 and planted.dropped == 1
+    assert planted.cities == ["Basel", "Bern", "Zurich"]
+    assert planted.X.shape == (len(planted), len(planted.features))
+    assert "main_weather=Rain" in planted.features and "weekday=Sunday" in planted.features
+
+
+def test_load_dataset_of_a_city_skips_malformed_dates(planted):
+    conn = database.get_connection()
+    with conn:
+        conn.execute("INSERT INTO revenues (date, city, revenue, temperature, temperature_felt, wind_speed, "
+                     "main_weather) VALUES ('2023-02-30', 'Zurich', 1000, 5, 5, 1, 'Clear')")
+    ds = analytics.load_dataset(city="Zurich", batch_size=100)
+    assert len(ds) == 365 and ds.dropped == 2
+    assert ds.cities == ["Zurich"]
+
+
+def test_fit_recovers_planted_effects(planted):
+    model = analytics.fit(planted, alpha=1e-6)
+    assert model["coefficients"]["temperature"] == pytest.approx(20, abs=0.2)
+    assert model["coefficients"]["main_weather=Rain"] - model["coefficients"]["main_weather=Clear"] == \
+        pytest.approx(-200, abs=3)
+    intercepts = model["intercepts"]
+    assert intercepts["Zurich"] - intercepts["Basel"] == pytest.approx(500, abs=3)
+
+    # Same slopes as least squares with one dummy column per city
+    dummies = np.eye(len(planted.cities))[planted.city]
+    X = np.hstack([planted.X, dummies])
+    expected = np.linalg.lstsq(X, planted.y, rcond=None)[0]
+    assert [model["coefficients"][f] for f in analytics.NUMERIC] == pytest.approx(expected[:3], abs=1e-4)
+
+
+def test_cross_validate_and_breakdowns(planted):
+    scores = analytics.cross_validate(planted, alphas=[0.01, 1000.0], folds=4)
+    assert list(scores["alpha"]) == [0.01, 1000.0]
+    assert scores["r2"][0] > 0.99 and scores["rmse"][0] < 15
+
+    assert analytics.correlations(planted)["temperature"] > 0.5
+
+    rain = analytics.grouped_stats(planted, "main_weather").set_index("main_weather")
+    assert rain.loc["Clear", "mean"] - rain.loc["Rain", "mean"] == pytest.approx(200, abs=40)
+
+    cities = analytics.city_breakdown(planted, alpha=1e-6).set_index("city")
+    assert cities.loc["Bern", "entries"] == 365
+    assert cities["slope_temperature"].tolist() == pytest.approx([20, 20, 20], abs=3)
@@ -0,0 +1,139 @@
+import sys
+import os
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+# Add the project root to the Python path (go back one folder)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from revenue_tracker import archive, config, connection, database, stats, sync
+
+
+@pytest.fixture
+def history(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+    database.create_table()
+    for date, city, amount, who in [("2023-06-03", "Zurich", 100.0, "Marco"), ("2023-06-04", "Basel", 40.0, "Liam"),
+                                    ("2024-05-04", "Zurich", 120.0, "Marco, Liam"),
+                                    ("2025-07-05", "Zurich", 90.0, "Liam")]:
+        database.add_revenue(date, city, amount, who=who)
+    conn = database.get_connection()
+    with conn:
+        # As if the weather had been fetched
+        conn.execute("DELETE FROM weather_queue")
+    yield conn
+
+
+def _dates(df):
+    return list(df["date"])
+
+
+def test_archives_closed_years_into_read_only_files(history):
+    before = database.get_table()
+    summary = database.archive_years(before=2025)
+    assert summary == {"archived": {2023: 2, 2024: 1}, "skipped": {}}
+    assert archive.years() == [2023, 2024]
+    assert history.execute("SELECT COUNT(*) FROM revenue_entries").fetchone()[0] == 1
+    # The rollups were reduced to the remaining entries
+    for by in ("weekday", "month", "weather"):
+        kept = history.execute(f"SELECT * FROM revenue_rollup_{by} ORDER BY city, key").fetchall()
+        database.rebuild_rollups()
+        assert history.execute(f"SELECT * FROM revenue_rollup_{by} ORDER BY city, key").fetchall() == kept
+
+    # The union keeps every year readable, with the same rows
+    after = database.get_table()
+    assert after.to_dict("records") == before.to_dict("records")
+    assert _dates(database.get_revenue_by_date("2023-06-04")) == ["2023-06-04"]
+    assert list(database.get_last_revenues(4)["id"]) == [4, 3, 2, 1]
+    assert [len(df) for df in database.iter_revenues(batch_size=3)] == [3, 1]
+
+    # The archives are read-only, and their years closed
+    with pytest.raises(sqlite3.OperationalError, match="readonly"):
+        history.execute("DELETE FROM archive_2023.revenues")
+    assert database.add_revenue("2023-06-10", "Bern", 10.0) is None
+    assert database.del_revenue_by_date("2023-06-03", "Zurich") == 0
+    assert database.archive_years(before=2025)["archived"] == {}
+    with pytest.raises(ValueError, match="not over yet"):
+        database.archive_years(before=9999)
+
+
+def test_queries_read_only_the_archives_of_their_dates(history):
+    database.archive_years(before=2025)
+    stats.enable()
+    stats.reset()
+    try:
+        # A fresh connection has nothing attached yet
+        connection.close_connection()
+        df = database.query_revenues(start="2025-01-01")
+        assert _dates(df) == ["2025-07-05"]
+        assert stats.snapshot()["counters"].get("archive.attach", 0) == 0
+
+        df = database.query_revenues(start="2024-01-01", who="Liam")
+        assert _dates(df) == ["2025-07-05", "2024-05-04"]
+        assert stats.snapshot()["counters"]["archive.attach"] == 1
+    finally:
+        stats.disable()
+
+    df = database.query_revenues(city="Zurich", group_by="weekday")
+    assert df["declared_revenue_sum"].sum() == 310.0
+    df = database.query_revenues(start="2023-01-01", end="2024-12-31", group_by="city")
+    assert dict(zip(df["city"], df["entries"])) == {"Basel": 1, "Zurich": 2}
+    df = database.get_rollups("month", city="Zurich")
+    assert list(df["month"]) == ["2023-06", "2024-05", "2025-07"]
+
+
+def test_skips_years_waiting_for_weather(history):
+    database.add_revenue("2024-05-05", "Bern", 30.0)
+    summary = database.archive_years(before=2025)
+    assert summary["archived"] == {2023: 2}
+    assert 2024 in summary["skipped"]
+
+
+def test_archived_changes_are_still_exported(history, tmp_path, monkeypatch):
+    database.archive_years(before=2026)
+    assert history.execute("SELECT COUNT(*) FROM change_journal").fetchone()[0] == 0
+    # New changes keep numbering after the archived ones
+    database.add_revenue("2026-01-03", "Bern", 20.0)
+    assert sync.export_delta(tmp_path / "full.gz", full=True)["changes"] == 5
+
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "peer.db")
+    database.create_table()
+    assert sync.apply_delta(tmp_path / "full.gz")["applied"] == 5
+    assert len(database.get_table()) == 5
+
+
+def test_deleting_the_table_asks_for_the_archives_too(history, capsys, monkeypatch):
+    database.archive_years(before=2025)
+    assert database.del_revenue_by_id(1) == 0
+    assert "archived year 2023" in capsys.readouterr().out
+
+    assert database.del_table() is False
+    assert "archived" in capsys.readouterr().out
+    assert len(database.get_table()) == 4
+
+    # A failure halfway leaves both the table and the archives in place
+    rename = Path.rename
+
+    def failing_rename(self, target):
+        if Path(target).name.endswith("2024.db.deleted"):
+            raise OSError("disk trouble")
+        return rename(self, target)
+
+    def failing_reset(conn):
+        raise sqlite3.OperationalError("database is locked")
+
+    for target, name, failure in [(Path, "rename", failing_rename), (database.migrations, "reset", failing_reset)]:
+        with monkeypatch.context() as patched:
+            patched.setattr(target, name, failure)
+            with pytest.raises((OSError, sqlite3.OperationalError)):
+                database.del_table(archives=True)
+        assert archive.years() == [2023, 2024] and len(database.get_table()) == 4
+
+    assert database.del_table(archives=True)
+    assert archive.years() == [] and not archive.directory().exists()
+    database.create_table()
+    assert database.get_table().empty
+    # The years are open again
+    assert database.add_revenue("2023-06-03", "Zurich", 100.0)
@@ -0,0 +1,90 @@
+import sys
+import os
+
+# Add the project root to the Python path (go back one folder)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from revenue_tracker import backfill, config, database, storage, weather
+
+
+def _insert(rows):
+    database.create_table()
+    conn = database.get_connection()
+    with conn:
+        conn.executemany("INSERT INTO revenues (date, city, declared_revenue) VALUES (?, ?, ?)", rows)
+
+
+def test_backfill_fills_missing_weather_and_reports_failures(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+    _insert([("2025-03-01", "Zurich", 100.0), ("2025-03-02", "Zurich", 90.0), ("2025-03-01", "Atlantis", 5.0)])
+
+    def fake_weather(city, date, use_cache=True):
+        if city == "Atlantis":
+            raise ValueError("Impossible to find coordinates for city 'Atlantis'.")
+        return 11.0, 9.5, 2.0, "Rain", "light rain"
+    monkeypatch.setattr(weather, "get_day_weather", fake_weather)
+    monkeypatch.setattr(weather, "get_city_coordinates", lambda city: (None, None))
+
+    summary = backfill.run_backfill(batch_size=2, progress=False)
+    assert (summary["pairs"], summary["updated"], summary["failed"]) == (3, 2, 1)
+    assert summary["cities"]["Atlantis"]["failed"] == 1
+
+    conn = database.get_connection()
+    assert conn.execute("SELECT COUNT(*) FROM revenues WHERE main_weather = 'Rain'").fetchone()[0] == 2
+    assert conn.execute("SELECT COUNT(*) FROM backfill_checkpoints").fetchone()[0] == 0
+    # Only the failed pair is left to do
+    assert backfill.find_pairs(conn) == [("2025-03-01", "Atlantis")]
+
+
+def test_interrupted_backfill_resumes_after_checkpoint(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+    _insert([(f"2025-03-0{day}", "Zurich", 100.0) for day in range(1, 6)])
+
+    fetched = []
+
+    def flaky_weather(city, date, use_cache=True):
+        if date == "2025-03-04" and not fetched.count("interrupted"):
+            fetched.append("interrupted")
+            raise KeyboardInterrupt
+        fetched.append(date)
+        return 11.0, 9.5, 2.0, "Clear", "clear sky"
+
+    def sequential(pairs, max_workers=None, use_cache=True):
+        return {pair: flaky_weather(*pair) for pair in pairs}
+    monkeypatch.setattr(weather, "get_many_day_weather", sequential)
+
+    try:
+        backfill.run_backfill(batch_size=2, progress=False)
+    except KeyboardInterrupt:
+        pass
+
+    summary = backfill.run_backfill(batch_size=2, progress=False)
+    assert summary["resumed"] and summary["pairs"] == 3
+    assert fetched == ["2025-03-01", "2025-03-02", "2025-03-03", "interrupted", "2025-03-03", "2025-03-04", "2025-03-05"]
+
+
+def test_hourly_backfill_stores_market_series(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+    monkeypatch.setattr(config, "WEATHER_HOURLY", True)
+    _insert([("2025-03-01", "Zurich", 100.0), ("2025-03-02", "Zurich", 90.0)])
+
+    def fake_weather(pairs, max_workers=None, use_cache=True):
+        return {pair: (11.0, 9.5, 2.0, "Rain", "light rain") for pair in pairs}
+
+    def fake_series(pairs, max_workers=None, use_cache=True):
+        values = [(10.0, 2.0, 0.0), (14.0, 3.0, 1.5)]
+        return {pair: (8, weather.pack_series(values), *weather.summarize_series(values)) if pair[1] == "2025-03-01"
+                else ValueError("Service unavailable") for pair in pairs}
+    monkeypatch.setattr(weather, "get_many_day_weather", fake_weather)
+    monkeypatch.setattr(weather, "get_many_day_series", fake_series)
+
+    summary = backfill.run_backfill(progress=False)
+    assert (summary["updated"], summary["failed"]) == (1, 1)
+    conn = database.get_connection()
+    assert conn.execute(
+        "SELECT date, market_temperature_mean, market_temperature_max, market_rain_hours FROM revenues ORDER BY date"
+    ).fetchall() == [("2025-03-01", 12.0, 14.0, 1), ("2025-03-02", None, None, None)]
+    first_hour, blob = storage.get_weather_series(conn, "Zurich", "2025-03-01")
+    assert first_hour == 8 and weather.unpack_series(blob) == [(10.0, 2.0, 0.0), (14.0, 3.0, 1.5)]
+    # The day whose series failed is left to do, although its weather is known
+    assert backfill.find_pairs(conn) == [("2025-03-02", "Zurich")]
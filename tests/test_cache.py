@@ -0,0 +1,68 @@
+import sys
+import os
+import time
+
+# Add the project root to the Python path (go back one folder)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from revenue_tracker import cache, config
+
+
+def test_coordinates_roundtrip(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+
+    assert cache.get_coordinates("Zurich") is None
+    cache.set_coordinates("Zurich", 47.37, 8.54)
+    # Lookups are normalized like utils._norm_city
+    assert cache.get_coordinates("  zurich ") == (47.37, 8.54)
+
+
+def test_negative_entry_expires(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+
+    cache.set_coordinates("Atlantis", None, None)
+    assert cache.get_coordinates("Atlantis") == (None, None)
+
+    later = time.time() + (config.GEOCODE_NEGATIVE_TTL_DAYS + 1) * cache.DAY
+    monkeypatch.setattr(cache.time, "time", lambda: later)
+    assert cache.get_coordinates("Atlantis") is None
+
+
+def test_invalidate_coordinates(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+
+    cache.set_coordinates("Zurich", 47.37, 8.54)
+    cache.set_coordinates("Basel", 47.56, 7.59)
+    assert cache.invalidate_coordinates("ZURICH") == 1
+    assert cache.get_coordinates("Zurich") is None
+    assert cache.invalidate_coordinates() == 1
+
+
+def test_timezone_is_kept_with_coordinates(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+
+    cache.set_coordinates("Zurich", 47.37, 8.54)
+    assert cache.get_timezone(47.37, 8.54) is None
+    cache.set_timezone(47.37, 8.54, "Europe/Zurich")
+    assert cache.get_timezone(47.37, 8.54) == "Europe/Zurich"
+
+    # Refreshing the same coordinates keeps the timezone, moving them drops it
+    cache.set_coordinates("Zurich", 47.37, 8.54)
+    assert cache.get_timezone(47.37, 8.54) == "Europe/Zurich"
+    cache.set_coordinates("Zurich", 47.38, 8.54)
+    assert cache.get_timezone(47.38, 8.54) is None
+
+
+def test_past_observations_never_expire(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+
+    now = time.time()
+    past_dt = int(now) - 30 * cache.DAY
+    recent_dt = int(now) - 600
+    cache.set_observation(47.37, 8.54, past_dt, {"data": [{"temp": 3.1}]})
+    cache.set_observation(47.37, 8.54, recent_dt, {"data": [{"temp": 7.4}]})
+    assert cache.get_observation(47.370001, 8.54, past_dt) == {"data": [{"temp": 3.1}]}
+
+    monkeypatch.setattr(cache.time, "time", lambda: now + 365 * cache.DAY)
+    assert cache.get_observation(47.37, 8.54, past_dt) == {"data": [{"temp": 3.1}]}
+    assert cache.get_observation(47.37, 8.54, recent_dt) is None
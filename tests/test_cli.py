@@ -0,0 +1,73 @@
+import sys
+import os
+import io
+import json
+
+import pytest
+
+# Add the project root to the Python path (go back one folder)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from revenue_tracker import cli, config, weather
+
+
+def fake_weather(city, date, use_cache=True):
+    return 12.0, 10.5, 3.2, "Clouds", "scattered clouds"
+
+
+def _patch_weather(monkeypatch):
+    monkeypatch.setattr(weather, "get_day_weather", fake_weather)
+    monkeypatch.setattr(weather, "get_city_coordinates", lambda city: (47.37, 8.54))
+
+
+def test_add_many_rows_then_query(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+    _patch_weather(monkeypatch)
+
+    rows = [
+        {"date": "2025-03-01", "city": "Zurich", "declared_revenue": 100, "who": "Marco"},
+        {"date": "2025-03-02", "city": "Basel", "declared_revenue": "80.5", "who": "Sofia"},
+        {"date": "2025-03-01", "city": "Zurich", "declared_revenue": 1, "who": "Marco"},  # duplicate
+        {"date": "not a date", "city": "Bern"},
+    ]
+    monkeypatch.setattr(sys, "stdin", io.StringIO("".join(json.dumps(r) + "\n" for r in rows)))
+    assert cli.main(["add", "--stdin"]) == cli.EXIT_PARTIAL
+    result = json.loads(capsys.readouterr().out)
+    assert (result["inserted"], result["failed"], result["weather"]["enriched"]) == (2, 2, 2)
+
+    assert cli.main(["query", "--format", "ndjson", "--batch-size", "1"]) == cli.EXIT_OK
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [(r["date"], r["city"], r["declared_revenue"], r["main_weather"]) for r in records] == [
+        ("2025-03-02", "Basel", 80.5, "Clouds"),
+        ("2025-03-01", "Zurich", 100.0, "Clouds"),
+    ]
+
+    assert cli.main(["query", "--group-by", "city", "--format", "json"]) == cli.EXIT_OK
+    totals = json.loads(capsys.readouterr().out)
+    assert [(t["city"], t["entries"]) for t in totals] == [("Basel", 1), ("Zurich", 1)]
+
+    assert cli.main(["query", "--city", "Bern", "--format", "csv"]) == cli.EXIT_NOT_FOUND
+    capsys.readouterr()
+
+    assert cli.main(["query", "--columns", "date,city", "--format", "ndjson"]) == cli.EXIT_OK
+    assert json.loads(capsys.readouterr().out.splitlines()[0]) == {"date": "2025-03-02", "city": "Basel"}
+    assert cli.main(["query", "--city", "Zurich", "--columns", "city,declared_revenue", "--format", "ndjson"]) \
+        == cli.EXIT_OK
+    assert json.loads(capsys.readouterr().out) == {"city": "Zurich", "declared_revenue": 100.0}
+    assert cli.main(["query", "--group-by", "city", "--columns", "city"]) == cli.EXIT_USAGE
+    assert "--columns" in capsys.readouterr().err
+    with pytest.raises(SystemExit) as exited:
+        cli.main(["query", "--columns", "date,citty"])
+    assert exited.value.code == cli.EXIT_USAGE
+    assert "unknown column(s) citty" in capsys.readouterr().err
+
+
+def test_delete_exit_codes(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+    _patch_weather(monkeypatch)
+
+    assert cli.main(["delete", "--id", "1"]) == cli.EXIT_NOT_FOUND
+    assert cli.main(["add", "2025-03-01", "Zurich", "100", "--who", "Marco"]) == cli.EXIT_OK
+    assert cli.main(["delete", "--id", "7"]) == cli.EXIT_NOT_FOUND
+    assert cli.main(["delete", "--date", "2025-03-01", "--city", "Zurich"]) == cli.EXIT_OK
+    assert cli.main(["delete", "--all"]) == cli.EXIT_USAGE
@@ -8,6 +8,7 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 db_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data', 'revenues.db'))
 
 from revenue_tracker.database import create_table, add_revenue
+from revenue_tracker import config, connection, database, migrations
 
 TEST_CITY = 'Romano di Lombardia'
 TEST_DATE = '2025-03-01'  # Example date for testing
@@ -17,8 +18,112 @@ TEST_REVENUE = 1000.0
 def test_create_table():
     # Test the weather data retrieval for a known city (e.g., "Rome")
     create_table()
+
+
+def test_connection_is_reused_and_tuned(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+
+    conn = connection.get_connection()
+    assert connection.get_connection() is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+
+    assert not database.table_exists()
+    create_table()
+    assert database.table_exists()
+    database.del_table()
+    assert not database.table_exists()
+
+
+def test_existing_database_is_upgraded(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+
+    # A database created before migrations existed, with a duplicate entry
+    conn = sqlite3.connect(tmp_path / "revenues.db")
+    migrations._create_revenues(conn)
+    conn.executemany(
+        "INSERT INTO revenues (date, city, declared_revenue) VALUES (?, ?, ?)",
+        [("2025-03-01", "Zurich", 100.0), ("2025-03-01", "Zurich", 120.0), ("2025-03-02", "Basel", 80.0)]
+    )
+    conn.commit()
+    conn.close()
+
+    conn = database.get_connection()
+    assert migrations.get_version(conn) == migrations.LATEST_VERSION
+    assert conn.execute("SELECT id, declared_revenue FROM revenues ORDER BY id").fetchall() == [(1, 100.0), (3, 80.0)]
+    assert conn.execute("SELECT id, declared_revenue FROM revenues_duplicates").fetchall() == [(2, 120.0)]
+
+    plan = " ".join(str(row) for row in conn.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM revenues WHERE city = ? AND date >= ?", ("Zurich", "2025-01-01")
+    ))
+    assert "USING INDEX" in plan
  
 
+def test_iter_revenues_pages_in_date_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+    create_table()
+    conn = database.get_connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO revenues (date, city, declared_revenue) VALUES (?, ?, ?)",
+            [(f"2025-03-{day:02d}", city, float(day)) for day in range(1, 11) for city in ("Zurich", "Basel", "Bern")]
+        )
+
+    chunks = list(database.iter_revenues(batch_size=7, columns=["date", "declared_revenue"], dtypes={"declared_revenue": "float32"}))
+    assert [len(df) for df in chunks] == [7, 7, 7, 7, 2]
+    assert list(chunks[0].columns) == ["date", "declared_revenue"]
+    assert str(chunks[0]["declared_revenue"].dtype) == "float32"
+
+    dates = [d for df in chunks for d in df["date"]]
+    assert dates == sorted(dates, reverse=True) and len(dates) == 30
+
+    full = database.get_table()
+    assert sorted(zip(full["date"], full["declared_revenue"])) == sorted(
+        (d, v) for df in chunks for d, v in zip(df["date"], df["declared_revenue"])
+    )
+
+    # Filters are applied in SQL, on every page
+    filtered = list(database.iter_revenues(batch_size=4, columns=["city"],
+                                           filters={"city": ["Zurich", "Bern"], "start": "2025-03-05"}))
+    assert [len(df) for df in filtered] == [4, 4, 4]
+    assert {c for df in filtered for c in df["city"]} == {"Zurich", "Bern"}
+
+
+def test_query_revenues_filters_and_aggregates(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+    create_table()
+    conn = database.get_connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO revenues (date, city, declared_revenue, revenue, kind, who, main_weather) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                ("2025-03-01", "Zurich", 100.0, 110.0, "ordinary", "Marco, Liam", "Rain"),    # Saturday
+                ("2025-03-08", "Zurich", 200.0, None, "ordinary", "Marco", "Clear"),          # Saturday
+                ("2025-03-15", "Zurich", 300.0, 330.0, "fair", "Liam, Mia", "Rain"),         # Saturday
+                ("2025-03-04", "Zurich", 50.0, None, "ordinary", "Marcos", "Rain"),          # Tuesday
+                ("2025-03-01", "Basel", 80.0, None, "ordinary", "Sofia", "Rain"),
+            ]
+        )
+
+    df = database.query_revenues(city="Zurich", weekday="saturday", weather="rain")
+    assert list(df["date"]) == ["2025-03-15", "2025-03-01"]
+
+    df = database.query_revenues(who="Marco")
+    assert sorted(df["date"]) == ["2025-03-01", "2025-03-08"]
+
+    df = database.query_revenues(start="2025-03-02", end="2025-03-31", group_by="city")
+    assert list(df["city"]) == ["Zurich"] and df["entries"][0] == 3
+
+    df = database.query_revenues(city="Zurich", group_by=["weekday", "weather"])
+    saturday_rain = df[(df["weekday"] == "Saturday") & (df["weather"] == "Rain")].iloc[0]
+    assert saturday_rain["declared_revenue_sum"] == 400.0
+    assert saturday_rain["revenue_avg"] == 220.0
+    assert saturday_rain["revenue_count"] == 2
+
+    totals = database.query_revenues(aggregate=True)
+    assert totals["entries"][0] == 5 and totals["declared_revenue_sum"][0] == 730.0
+
+
 # Call the test functions
 if __name__ == "__main__":
 
@@ -0,0 +1,78 @@
+import sys
+import os
+
+# Add the project root to the Python path (go back one folder)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from revenue_tracker import config, database, enrichment, weather
+
+
+def test_add_revenue_does_not_wait_for_weather(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+
+    def no_network(*args, **kwargs):
+        raise AssertionError("add_revenue must not call the weather service")
+    monkeypatch.setattr(weather, "get_day_weather", no_network)
+
+    database.create_table()
+    assert database.add_revenue("2025-03-01", "Zurich", 100.0, who="Marco")
+    assert database.add_revenue("2025-03-01", "Zurich", 100.0, who="Marco") is None  # duplicate
+
+    conn = database.get_connection()
+    assert conn.execute("SELECT weather_status, temperature FROM revenues").fetchall() == [("pending", None)]
+    assert enrichment.pending_count() == 1
+
+
+def test_drain_queue_enriches_and_retries(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+    database.create_table()
+    database.add_revenue("2025-03-01", "Zurich", 100.0, who="Marco")
+    database.add_revenue("2025-03-01", "Atlantis", 5.0, who="Marco")
+
+    def fake_many(pairs, max_workers=None, use_cache=True):
+        return {(city, date): ValueError("city not found") if city == "Atlantis"
+                else (11.0, 9.5, 2.0, "Rain", "light rain") for city, date in pairs}
+    monkeypatch.setattr(weather, "get_many_day_weather", fake_many)
+
+    assert enrichment.drain_queue() == {"processed": 2, "enriched": 1, "retry": 1, "failed": 0}
+    # The failed row is not due again yet
+    assert enrichment.drain_queue()["processed"] == 0
+    assert enrichment.pending_count() == 1
+
+    conn = database.get_connection()
+    assert conn.execute("SELECT city, weather_status, main_weather FROM revenues ORDER BY id").fetchall() == [
+        ("Zurich", "ok", "Rain"), ("Atlantis", "pending", None)
+    ]
+
+    # After the last attempt the row is given up on
+    conn.execute("UPDATE weather_queue SET attempts = ?, next_attempt_at = 0", (enrichment.MAX_ATTEMPTS - 1,))
+    conn.commit()
+    assert enrichment.drain_queue()["failed"] == 1
+    assert conn.execute("SELECT weather_status FROM revenues WHERE city = 'Atlantis'").fetchone() == ("failed",)
+    assert enrichment.pending_count() == 0
+
+
+def test_worker_warns_once_per_error(monkeypatch, capsys):
+    monkeypatch.setattr(enrichment, "last_error", None)
+    outcomes = [RuntimeError("no such table: weather_queue"), RuntimeError("no such table: weather_queue"),
+                RuntimeError("database is locked"), {}]
+
+    def fake_drain():
+        outcome = outcomes.pop(0)
+        if not outcomes:
+            enrichment._stop.set()
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(enrichment, "drain_queue", fake_drain)
+    seen = []
+    monkeypatch.setattr(enrichment._wakeup, "wait", lambda interval: seen.append(capsys.readouterr().out))
+    enrichment._stop.clear()
+    enrichment._run_worker(0)
+    enrichment._stop.clear()
+
+    assert "WARNING: the weather enrichment failed: no such table: weather_queue" in seen[0]
+    assert seen[1] == ""
+    assert "database is locked" in seen[2]
+    assert seen[3] == "" and enrichment.last_error is None
@@ -0,0 +1,36 @@
+import sys
+import os
+import sqlite3
+
+# Add the project root to the Python path (go back one folder)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from revenue_tracker import config, importer
+
+CSV = """date,city,declared_revenue,revenue,kind,who,notes
+2024-05-04,Zurich,1200,1350.5,,"Marco, Liam",
+2024-05-04,Zurich,999,,,Marco,duplicate in file
+2024-13-01,Zurich,10,,,Marco,invalid date
+2024-05-07,Basel,800,,market,Sofia,
+"""
+
+
+def test_import_csv(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+    path = tmp_path / "revenues.csv"
+    path.write_text(CSV)
+
+    summary = importer.import_revenues(path, chunksize=2, progress=False)
+    assert (summary["read"], summary["inserted"], summary["duplicates"], summary["invalid"]) == (4, 2, 1, 1)
+
+    # Importing the same file again only finds duplicates
+    summary = importer.import_revenues(path, progress=False)
+    assert (summary["inserted"], summary["duplicates"]) == (0, 3)
+
+    conn = sqlite3.connect(tmp_path / "revenues.db")
+    rows = conn.execute("SELECT date, city, declared_revenue, revenue, kind, who FROM revenues ORDER BY date").fetchall()
+    conn.close()
+    assert rows == [
+        ("2024-05-04", "Zurich", 1200.0, 1350.5, "ordinary", "Marco, Liam"),
+        ("2024-05-07", "Basel", 800.0, None, "market", "Sofia"),
+    ]
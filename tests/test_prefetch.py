@@ -0,0 +1,135 @@
+import sys
+import os
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+# Add the project root to the Python path (go back one folder)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from revenue_tracker import config, database, enrichment, prefetch, utils, weather
+from benchmarks.fake_openweather import FakeOpenWeather
+
+# Tuesday noon UTC: the Zurich market of the day is still open
+NOW = datetime(2025, 3, 4, 12, tzinfo=timezone.utc).timestamp()
+
+
+@pytest.fixture
+def fake_api(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+    monkeypatch.setattr(config, "OPENWEATHER_API_KEY", "test")
+    monkeypatch.setattr(weather, "rate_limiter", weather.TokenBucket(rate_per_minute=1e6))
+    monkeypatch.setattr(weather.time, "sleep", lambda seconds: None)
+    weather.timezone_at.cache_clear()
+    path = tmp_path / "who_defaults.json"
+    path.write_text(json.dumps({"Zurich": {"Saturday": "Marco", "Tuesday": "Liam"}, "Nowhere Town": {"Monday": "Mia"}}))
+    monkeypatch.setattr(config, "WHO_DEFAULTS_PATH", path)
+    with FakeOpenWeather() as fake:
+        monkeypatch.setattr(config, "OPENWEATHER_BASE_URL", fake.url)
+        yield fake
+
+
+def test_scheduled_days(fake_api):
+    assert utils.scheduled_days("2025-03-01", "2025-03-04") == [
+        ("zurich", "2025-03-01"), ("nowhere town", "2025-03-03"), ("zurich", "2025-03-04")
+    ]
+
+
+@pytest.mark.parametrize("hourly", [False, True])
+def test_entering_a_prefetched_day_makes_no_request(fake_api, monkeypatch, hourly):
+    monkeypatch.setattr(config, "WEATHER_HOURLY", hourly)
+    summary = prefetch.prefetch("2025-03-01", "2025-03-04", now=NOW)
+    assert summary == {"scheduled": 3, "entered": 0, "open": 1, "warm": 0, "warmed": 1, "failed": 1,
+                       "hit_ratio": 0.0}
+
+    # A second pass finds the closed day warm and asks for nothing
+    requests = fake_api.counters
+    assert prefetch.prefetch("2025-03-01", "2025-03-04", now=NOW)["hit_ratio"] == 1.0
+    assert fake_api.counters == requests
+
+    database.create_table()
+    database.add_revenue("2025-03-01", "Zurich", 100.0)
+    assert enrichment.drain_queue()["enriched"] == 1
+    assert fake_api.counters == requests
+    assert prefetch.prefetch("2025-03-01", "2025-03-04", now=NOW)["entered"] == 1
+
+
+@pytest.mark.parametrize("hourly", [False, True])
+def test_an_unentered_day_is_fetched_twice_at_most(fake_api, monkeypatch, hourly):
+    monkeypatch.setattr(config, "WEATHER_HOURLY", hourly)
+    clock = {"now": datetime(2025, 3, 4, 15, 30, tzinfo=timezone.utc).timestamp()}
+    monkeypatch.setattr(prefetch.cache.time, "time", lambda: clock["now"])
+
+    def requests():
+        return fake_api.counters.get(weather.TIMEMACHINE_PATH, 0)
+
+    # Tuesday evening in Zurich: the market closed, the weather is still recent
+    assert prefetch.prefetch("2025-03-04", "2025-03-04", now=clock["now"])["warmed"] == 1
+    fetched = requests()
+    assert fetched > 0
+    clock["now"] += 3 * 3600
+    assert prefetch.prefetch("2025-03-04", "2025-03-04", now=clock["now"])["warm"] == 1
+    assert requests() == fetched
+
+    # After midnight the day is fetched one last time and kept for good
+    clock["now"] += 5 * 3600
+    assert prefetch.prefetch("2025-03-04", "2025-03-04", now=clock["now"])["warmed"] == 1
+    assert requests() == 2 * fetched
+    clock["now"] += 12 * 3600
+    assert prefetch.prefetch("2025-03-04", "2025-03-04", now=clock["now"])["warm"] == 1
+    assert requests() == 2 * fetched
+
+    database.create_table()
+    database.add_revenue("2025-03-04", "Zurich", 100.0)
+    assert enrichment.drain_queue()["enriched"] == 1
+    assert requests() == 2 * fetched
+
+
+@pytest.mark.parametrize("hourly", [False, True])
+def test_entering_the_evening_after_the_prefetch_makes_no_request(fake_api, monkeypatch, hourly):
+    monkeypatch.setattr(config, "WEATHER_HOURLY", hourly)
+    clock = {"now": datetime(2025, 3, 4, 14, 30, tzinfo=timezone.utc).timestamp()}
+    monkeypatch.setattr(prefetch.cache.time, "time", lambda: clock["now"])
+    assert prefetch.prefetch("2025-03-04", "2025-03-04", now=clock["now"])["warmed"] == 1
+
+    # Three hours after the close, well past RECENT_TTL, with the network down
+    clock["now"] += 3 * 3600
+
+    def offline(*args, **kwargs):
+        raise ConnectionError("offline")
+
+    monkeypatch.setattr(weather, "api_get", offline)
+    database.create_table()
+    database.add_revenue("2025-03-04", "Zurich", 100.0)
+    assert enrichment.drain_queue()["enriched"] == 1
+
+
+def test_the_scheduler_reports_its_last_pass(monkeypatch, capsys):
+    for name in ("last_summary", "last_error", "last_run"):
+        monkeypatch.setattr(prefetch, name, None)
+    assert prefetch.format_status() is None
+    outcomes = [ConnectionError("no API key"), ConnectionError("no API key"),
+                {"scheduled": 2, "entered": 0, "open": 0, "warm": 1, "warmed": 1, "failed": 0, "hit_ratio": 0.5}]
+
+    def fake_prefetch():
+        outcome = outcomes.pop(0)
+        if not outcomes:
+            prefetch._stop.set()
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(prefetch, "prefetch", fake_prefetch)
+    prefetch._stop.clear()
+    seen = []
+    monkeypatch.setattr(prefetch._stop, "wait", lambda interval: seen.append(
+        (capsys.readouterr().out, prefetch.format_status())))
+    prefetch._run_scheduler(0)
+    prefetch._stop.clear()
+
+    # The same failure is only reported once
+    assert "WARNING: the weather prefetch failed: no API key" in seen[0][0]
+    assert seen[0][1].endswith("failed (no API key)")
+    assert seen[1][0] == ""
+    assert seen[2][1].endswith("1 days cached, 1 warmed, 0 failed, hit ratio 50%")
@@ -0,0 +1,156 @@
+import sys
+import os
+import random
+
+import pytest
+from pandas.testing import assert_frame_equal
+
+# Add the project root to the Python path (go back one folder)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from revenue_tracker import config, database, importer, rollups
+from revenue_tracker.backfill import write_weather
+
+
+def _rollup_rows(conn):
+    return {d: conn.execute(f"SELECT * FROM {rollups.table(d)} ORDER BY city, key").fetchall()
+            for d in rollups.DIMENSIONS}
+
+
+def _assert_same(actual, expected):
+    assert actual.keys() == expected.keys()
+    for dimension in actual:
+        assert len(actual[dimension]) == len(expected[dimension]), dimension
+        for a, e in zip(actual[dimension], expected[dimension]):
+            assert a[:2] == e[:2]
+            assert a[2:] == pytest.approx(e[2:]), (dimension, a[:2])
+
+
+def test_triggers_keep_rollups_up_to_date(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+    database.create_table()
+    conn = database.get_connection()
+    rng = random.Random(1)
+    with conn:
+        conn.executemany(
+            "INSERT INTO revenues (date, city, declared_revenue, revenue, main_weather) VALUES (?, ?, ?, ?, ?)",
+            [(f"2025-{m:02d}-{d:02d}", city, rng.choice([None, rng.uniform(10, 500)]),
+              rng.choice([None, rng.uniform(10, 500)]), rng.choice([None, "Rain", "Clear"]))
+             for m in (1, 2) for d in range(1, 29) for city in ("Zurich", "Basel", "Bern")]
+        )
+        # Deletes, weather filled in later and corrected revenues
+        conn.execute("DELETE FROM revenues WHERE id % 7 = 0")
+        conn.execute("UPDATE revenues SET revenue = revenue * 2 WHERE id % 5 = 0")
+        conn.execute("UPDATE revenues SET date = '2025-03-01' WHERE id = 3")
+    with conn:
+        write_weather(conn, {("Basel", f"2025-01-{d:02d}"): (5.0, 3.0, 1.0, "Snow", "light snow")
+                             for d in range(1, 29)})
+    database.del_revenue_by_date("2025-02-03", "Zurich")
+
+    maintained = _rollup_rows(conn)
+    database.rebuild_rollups()
+    _assert_same(maintained, _rollup_rows(conn))
+
+    # Groups are looked up in the entries of their city, not in the whole view
+    for (sql,) in conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name LIKE '%rollup%'"):
+        assert "FROM revenues " not in sql
+
+
+def test_grouped_queries_from_rollups_match_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+    database.create_table()
+    conn = database.get_connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO revenues (date, city, declared_revenue, revenue, main_weather) VALUES (?, ?, ?, ?, ?)",
+            [
+                ("2025-03-01", "Zurich", 100.0, 110.0, "Rain"),
+                ("2025-03-08", "Zurich", 200.0, None, "Clear"),
+                ("2025-03-15", "Zurich", 300.0, 330.0, "Rain"),
+                ("2025-03-04", "Zurich", 50.0, None, None),
+                ("2025-04-01", "Basel", 80.0, None, "Rain"),
+            ]
+        )
+
+    cases = [
+        dict(group_by=["city", "weekday"]),
+        dict(group_by="month"),
+        dict(group_by=["city", "weather"], city="Zurich"),
+        dict(group_by="city", weather="rain"),
+        dict(aggregate=True, weekday=["Saturday", "Tuesday"]),
+    ]
+    for case in cases:
+        assert database._rollup_query(database._as_list(case.get("group_by")), city=case.get("city"),
+                                      weekday=case.get("weekday"), weather=case.get("weather"))
+        fast = database.query_revenues(**case)
+        # Filtering on the start date forces the scan of the rows
+        slow = database.query_revenues(**case, start="2000-01-01")
+        assert_frame_equal(fast, slow, check_dtype=False, obj=str(case))
+
+    df = database.get_rollups("weekday", city="Zurich")
+    saturday = df[df["weekday"] == "Saturday"].iloc[0]
+    assert saturday["entries"] == 3
+    assert (saturday["declared_revenue_mean"], saturday["declared_revenue_std"]) == (200.0, 100.0)
+    assert (saturday["revenue_min"], saturday["revenue_max"], saturday["revenue_count"]) == (110.0, 330.0, 2)
+
+
+def test_weekdays_of_malformed_dates_are_missing(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+    database.create_table()
+    conn = database.get_connection()
+    with conn:
+        conn.executemany("INSERT INTO revenues (date, city, declared_revenue) VALUES (?, 'Zurich', ?)",
+                         [("2025-03-01", 100.0), ("2025-02-30x", 50.0)])
+
+    for df in (database.query_revenues(group_by="weekday"),
+               database.query_revenues(group_by="weekday", city="Zurich"),
+               database.query_revenues(group_by="weekday", start="2025-01-01"),
+               database.get_rollups("weekday")):
+        assert list(df["weekday"].dropna()) == ["Saturday"] and df["weekday"].isna().sum() == 1
+
+
+def test_bulk_import_updates_rollups(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+    database.create_table()
+    database.add_revenue("2025-03-01", "Zurich", 100.0, 90.0, who="Marco")
+    path = tmp_path / "revenues.csv"
+    path.write_text("date,city,declared_revenue,revenue,who\n"
+                    "2025-03-01,Zurich,1,1,Marco\n"  # duplicate
+                    "2025-03-08,Zurich,300,,Marco\n"
+                    "2025-03-02,Basel,80,85,Sofia\n")
+    conn = database.get_connection()
+    schema = conn.execute("PRAGMA schema_version").fetchone()[0]
+    importer.import_revenues(path, chunksize=2, progress=False)
+    # The triggers were paused, not dropped and created again
+    assert conn.execute("PRAGMA schema_version").fetchone()[0] == schema
+
+    maintained = _rollup_rows(conn)
+    database.rebuild_rollups()
+    _assert_same(maintained, _rollup_rows(conn))
+    # The insert trigger is back on after the import
+    database.add_revenue("2025-03-15", "Zurich", 50.0, who="Marco")
+    assert database.get_rollups("month", city="Zurich")["entries"].tolist() == [3]
+
+
+def test_bulk_blocks_inside_others(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+    database.create_table()
+    conn = database.get_connection()
+    insert = "INSERT INTO revenues (date, city, declared_revenue) VALUES (?, ?, ?)"
+    with conn, rollups.bulk_insert(conn):
+        conn.execute(insert, ("2025-03-01", "Zurich", 100.0))
+        with rollups.bulk_insert(conn):
+            conn.execute(insert, ("2025-03-02", "Basel", 80.0))
+        conn.execute(insert, ("2025-03-03", "Bern", 60.0))
+    # Each entry is counted once, by the outer block
+    maintained = _rollup_rows(conn)
+    database.rebuild_rollups()
+    _assert_same(maintained, _rollup_rows(conn))
+    assert len(database.get_table()) == 3
+
+    with pytest.raises(RuntimeError, match="cannot be nested"):
+        with conn, rollups.bulk_delete(conn, "city = ?", ("Zurich",)):
+            with rollups.bulk_delete(conn, "city = ?", ("Basel",)):
+                pass
+    _assert_same(maintained, _rollup_rows(conn))
+    assert not conn.execute("SELECT 1 FROM trigger_pauses").fetchone()
@@ -0,0 +1,133 @@
+import sys
+import os
+import json
+import socket
+import urllib.error
+import urllib.request
+
+import pytest
+
+# Add the project root to the Python path (go back one folder)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from revenue_tracker import config, database, server
+
+
+def _get(url, etag=None):
+    request = urllib.request.Request(url, headers={"If-None-Match": etag} if etag else {})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+    database.create_table()
+    conn = database.get_connection()
+    with conn:
+        conn.executemany("INSERT INTO revenues (date, city, declared_revenue, who) VALUES (?, ?, ?, ?)",
+                         [("2025-03-01", "Zurich", 100.0, "Marco"), ("2025-03-01", "Basel", 50.0, None),
+                          ("2025-03-02", "Zurich", 80.0, "Liam")])
+    with server.ApiServer("127.0.0.1", 0) as api:
+        yield api
+
+
+def test_serves_reads_as_json_and_ndjson(api):
+    status, _, body = _get(f"{api.url}/revenues/last?n=2")
+    assert status == 200
+    assert [row["date"] for row in json.loads(body)] == ["2025-03-02", "2025-03-01"]
+
+    status, headers, body = _get(f"{api.url}/revenues/2025-03-01?format=ndjson")
+    assert headers["Content-Type"] == "application/x-ndjson"
+    assert sorted(json.loads(line)["city"] for line in body.splitlines()) == ["Basel", "Zurich"]
+
+    _, _, body = _get(f"{api.url}/revenues?city=Zurich&start=2025-03-02")
+    assert [(row["date"], row["who"]) for row in json.loads(body)] == [("2025-03-02", "Liam")]
+    _, _, body = _get(f"{api.url}/summary?group_by=city")
+    assert {row["city"]: row["declared_revenue_sum"] for row in json.loads(body)} == {"Basel": 50.0, "Zurich": 180.0}
+    _, _, body = _get(f"{api.url}/summary?group_by=weekday&city=Zurich")
+    assert [row["weekday"] for row in json.loads(body)] == ["Sunday", "Saturday"]
+
+    assert _get(f"{api.url}/revenues/2025-04-01")[2] == b"[]\n"
+    status, _, body = _get(f"{api.url}/summary?group_by=year")
+    assert status == 400 and "Cannot group by year" in json.loads(body)["error"]
+    assert _get(f"{api.url}/nothing")[0] == 404
+
+
+def test_streams_large_responses(api, monkeypatch):
+    monkeypatch.setattr(server, "STREAM_BATCH", 2)
+    _, headers, body = _get(f"{api.url}/revenues")
+    assert headers["Transfer-Encoding"] == "chunked"
+    assert [row["declared_revenue"] for row in json.loads(body)] == [80.0, 50.0, 100.0]
+    _, _, lines = _get(f"{api.url}/revenues?format=ndjson")
+    assert [json.loads(line) for line in lines.splitlines()] == json.loads(body)
+
+    # The streamed bodies were cached whole
+    assert len(api.cache._bodies) == 2
+    _, headers, cached = _get(f"{api.url}/revenues")
+    assert cached == body and "Transfer-Encoding" not in headers
+
+
+def test_cache_and_etags_follow_the_data_version(api):
+    status, headers, body = _get(f"{api.url}/revenues/last?n=5")
+    etag = headers["ETag"]
+    # Polling with the ETag costs no query, and the cached body is reused
+    assert _get(f"{api.url}/revenues/last?n=5", etag)[0] == 304
+    assert _get(f"{api.url}/revenues/last?n=5")[2] == body
+    assert len(api.cache._bodies) == 1
+
+    database.add_revenue("2025-03-03", "Bern", 20.0, who="Mia")
+    status, headers, body = _get(f"{api.url}/revenues/last?n=5", etag)
+    assert status == 200 and headers["ETag"] != etag
+    assert json.loads(body)[0]["city"] == "Bern"
+
+    etag = headers["ETag"]
+    database.del_revenue_by_date("2025-03-03", "Bern")
+    status, headers, body = _get(f"{api.url}/revenues/last?n=5", etag)
+    assert status == 200 and len(json.loads(body)) == 3
+
+    version = json.loads(_get(f"{api.url}/version")[2])["version"]
+    database.del_table()
+    assert _get(f"{api.url}/revenues/last")[0] == 404
+    database.create_table()
+    assert json.loads(_get(f"{api.url}/version")[2])["version"] > version
+
+
+def test_writes_are_seen_while_a_stream_is_open(api, monkeypatch):
+    monkeypatch.setattr(server, "STREAM_BATCH", 10)
+    conn = database.get_connection()
+    with conn:
+        conn.executemany("INSERT INTO revenues (date, city, declared_revenue, notes) VALUES (?, 'Bern', 1.0, ?)",
+                         [(f"2024-{1 + i // 28:02}-{1 + i % 28:02}", "x" * 20000) for i in range(300)])
+    version = json.loads(_get(f"{api.url}/version")[2])["version"]
+    _, headers, _ = _get(f"{api.url}/revenues/last")
+    etag = headers["ETag"]
+
+    # A client that stops reading early keeps its stream open
+    client = socket.socket()
+    client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    client.connect((api.host, api.port))
+    try:
+        client.sendall(b"GET /revenues?format=ndjson HTTP/1.1\r\nHost: test\r\n\r\n")
+        assert client.recv(1024).startswith(b"HTTP/1.1 200")
+        database.add_revenue("2025-03-03", "Bern", 20.0)
+        assert json.loads(_get(f"{api.url}/version")[2])["version"] > version
+        status, _, body = _get(f"{api.url}/revenues/last", etag)
+        assert status == 200 and json.loads(body)[0]["date"] == "2025-03-03"
+    finally:
+        client.close()
+
+
+@pytest.mark.parametrize("length", ["abc", "-5"])
+def test_a_malformed_content_length_is_a_bad_request(api, length):
+    with socket.create_connection((api.host, api.port), timeout=5) as client:
+        client.sendall(f"GET /version HTTP/1.1\r\nHost: test\r\nContent-Length: {length}\r\n\r\n".encode())
+        response = b""
+        while chunk := client.recv(4096):
+            response += chunk
+    assert response.startswith(b"HTTP/1.1 400")
+    assert b"Content-Length" in response.split(b"\r\n\r\n", 1)[1]
+    assert _get(f"{api.url}/version")[0] == 200
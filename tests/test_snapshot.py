@@ -0,0 +1,77 @@
+import sys
+import os
+import json
+
+import pytest
+
+# Add the project root to the Python path (go back one folder)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+pytest.importorskip("pyarrow")
+
+from revenue_tracker import cli, config, database, snapshot
+
+
+def _insert(rows):
+    conn = database.get_connection()
+    with conn:
+        conn.executemany("INSERT INTO revenues (date, city, declared_revenue, kind, who, main_weather) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+
+@pytest.fixture
+def revenues(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+    database.create_table()
+    _insert([
+        ("2024-12-31", "Zurich", 100.0, "ordinary", "Marco", "Rain"),
+        ("2025-01-01", "Zurich", 200.0, "market", "Marco, Anna", None),
+        ("2025-01-02", "Basel", 50.0, "ordinary", None, "Clear"),
+        ("31.01.2025", "Basel", 10.0, "ordinary", "Sofia", "Clear"),  # not a valid date
+    ])
+    return tmp_path / "snapshot"
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_export_append_and_load(revenues, fmt):
+    assert snapshot.export_snapshot(revenues, fmt)["rows"] == 4
+    df = snapshot.load_snapshot(revenues).sort_values("id", ignore_index=True)
+    assert df["id"].tolist() == [1, 2, 3, 4]
+    assert df["year"].tolist()[:3] == [2024, 2025, 2025] and df["date"].isna().tolist()[3]
+    assert str(df["city"].dtype) == "category" and str(df["who"].dtype) == "category"
+    assert df["declared_revenue"].sum() == 360.0
+
+    # Only the new ids are written by the next export
+    _insert([("2025-01-03", "Bern", 70.0, "ordinary", "Luca", "Snow")])
+    assert snapshot.export_snapshot(revenues, fmt) == {"format": fmt, "rows": 1, "files": 1, "last_id": 5}
+    assert snapshot.export_snapshot(revenues, fmt)["rows"] == 0
+    assert len(snapshot.read_manifest(revenues)["files"]) == 4  # 2024, 2025 and invalid dates, then 2025
+
+    df = snapshot.load_snapshot(revenues, columns=["id", "declared_revenue"], cities=["Zurich", "Bern"], years=2025)
+    assert sorted(df["id"]) == [2, 5] and list(df.columns) == ["id", "declared_revenue"]
+
+
+def test_city_partitions_full_rewrite_and_leftovers(revenues):
+    snapshot.export_snapshot(revenues, partition_by=["city", "year"])
+    assert (revenues / "city=Basel" / "year=2025").is_dir()
+    with pytest.raises(ValueError):
+        snapshot.export_snapshot(revenues, "arrow")
+
+    # A file left by an interrupted export is removed, not loaded
+    leftover = revenues / "city=Bern" / "year=2025" / "part-9-9-0.parquet"
+    leftover.parent.mkdir(parents=True)
+    leftover.write_bytes(b"")
+    snapshot.export_snapshot(revenues)
+    assert not leftover.exists()
+
+    database.del_revenue_by_id(1)
+    assert snapshot.export_snapshot(revenues, "arrow", full=True)["rows"] == 3
+    assert not list(revenues.rglob("*.parquet"))
+    df = snapshot.load_snapshot(revenues, cities="Basel")
+    assert sorted(df["id"]) == [3, 4]
+
+
+def test_cli_snapshot(revenues, capsys):
+    assert cli.main(["snapshot", str(revenues), "--format", "arrow"]) == cli.EXIT_OK
+    assert json.loads(capsys.readouterr().out)["rows"] == 4
+    assert cli.main(["snapshot", str(revenues), "--partition-by", "weekday"]) == cli.EXIT_USAGE
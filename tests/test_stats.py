@@ -0,0 +1,66 @@
+import sys
+import os
+import json
+
+# Add the project root to the Python path (go back one folder)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from revenue_tracker import cli, config, stats, weather
+from benchmarks.fake_openweather import FakeOpenWeather
+
+
+def test_histogram_percentiles():
+    histogram = stats.Histogram()
+    for ms in [0.2] * 90 + [40] * 9 + [3000]:
+        histogram.add(ms)
+    summary = histogram.summary()
+    assert summary["count"] == 100
+    assert (summary["p50_ms"], summary["p95_ms"], summary["p99_ms"], summary["max_ms"]) == (0.25, 50, 50, 3000)
+
+
+def test_nothing_is_recorded_while_disabled(monkeypatch):
+    monkeypatch.setattr(stats, "enabled", False)
+    stats.reset()
+    stats.timed("test.function")(lambda: None)()
+    with stats.timer("test.block"):
+        pass
+    stats.incr("test.counter")
+    assert stats.snapshot()["timers"] == {} and stats.snapshot()["counters"] == {}
+
+
+def test_weather_timings_and_cache_hits(tmp_path, monkeypatch):
+    monkeypatch.setattr(stats, "enabled", True)
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+    monkeypatch.setattr(config, "OPENWEATHER_API_KEY", "test")
+    monkeypatch.setattr(weather, "rate_limiter", weather.TokenBucket(rate_per_minute=1e6))
+    weather.timezone_at.cache_clear()
+    stats.reset()
+    with FakeOpenWeather() as fake:
+        monkeypatch.setattr(config, "OPENWEATHER_BASE_URL", fake.url)
+        weather.get_day_weather("Zurich", "2025-03-01")
+        weather.get_day_weather("Zurich", "2025-03-01")
+
+    data = stats.snapshot()
+    assert data["timers"]["weather.get_day_weather"]["count"] == 2
+    assert data["timers"]["http.geocode"]["count"] == 1
+    assert data["timers"]["http.timemachine"]["count"] == 1
+    assert data["caches"]["geocode"] == {"hits": 1, "misses": 1, "hit_ratio": 0.5}
+    assert data["caches"]["observation"]["hits"] == 1
+    assert data["counters"]["http.bytes_received"] > 0
+    assert data["counters"]["http.status.200"] == 2
+
+
+def test_cli_stats_file(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(stats, "enabled", False)
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+    path = tmp_path / "stats.jsonl"
+
+    argv = ["--stats-file", str(path), "add", "2025-03-01", "Zurich", "100", "--who", "Marco", "--no-enrich"]
+    assert cli.main(argv) == cli.EXIT_OK
+    capsys.readouterr()
+    assert cli.main(["stats", "--file", str(path), "--format", "json"]) == cli.EXIT_OK
+    data = json.loads(capsys.readouterr().out)
+    assert data["timers"]["db.add_revenue"]["count"] == 1
+    assert "db.connect" in data["timers"]
+
+    assert cli.main(["stats", "--file", str(tmp_path / "missing.jsonl")]) == cli.EXIT_NOT_FOUND
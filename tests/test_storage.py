@@ -0,0 +1,110 @@
+import sys
+import os
+
+import pytest
+
+# Add the project root to the Python path (go back one folder)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from revenue_tracker import config, connection, database, migrations, rollups, storage
+
+
+def _rollup_rows(conn):
+    return {d: conn.execute(f"SELECT * FROM {rollups.table(d)} ORDER BY city, key").fetchall()
+            for d in rollups.DIMENSIONS}
+
+
+@pytest.fixture
+def revenues(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+    database.create_table()
+    return database.get_connection()
+
+
+def test_converts_revenues_table(tmp_path, monkeypatch):
+    path = tmp_path / "revenues.db"
+    monkeypatch.setattr(config, "DATABASE_PATH", path)
+    conn = connection._open(str(path))
+    for index, migration in enumerate(migrations.MIGRATIONS[:6]):
+        with conn:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {index + 1}")
+    with conn:
+        conn.executemany(
+            "INSERT INTO revenues (date, city, declared_revenue, kind, who, temperature, main_weather, "
+            "weather_description, weather_status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [("2025-01-01", "Zurich", 100.0, "ordinary", "Marco,Liam", 3.0, "Rain", "light rain", "ok"),
+             ("2025-01-02", "Zurich", 150.0, "market", "Liam", None, None, None, "pending"),
+             ("2025-01-01", "Basel", 80.0, "ordinary", None, 4.0, "Rain", "light rain", "ok"),
+             ("2025-01-03", "Basel", 60.0, "ordinary", "Mia", None, None, None, None)]
+        )
+        conn.execute("DELETE FROM revenues WHERE id = 4")
+    # Version 6 keeps the rollups with triggers on the revenues table
+    assert conn.execute("SELECT SUM(entries), SUM(declared_revenue_sum) FROM revenue_rollup_month").fetchone() == \
+        (3, 330.0)
+    conn.close()
+
+    conn = database.get_connection()
+    assert migrations.get_version(conn) == migrations.LATEST_VERSION
+    df = database.get_table().sort_values("id", ignore_index=True)
+    assert df.columns.tolist() == database.REVENUE_COLUMNS
+    assert df["id"].tolist() == [1, 2, 3]
+    assert conn.execute("SELECT who, weather_description FROM revenues ORDER BY id").fetchall() == [
+        ("Marco, Liam", "light rain"), ("Liam", None), (None, "light rain")
+    ]
+    assert conn.execute("SELECT COUNT(*) FROM weather_conditions").fetchone()[0] == 1
+    assert not conn.execute("SELECT name FROM sqlite_master WHERE name IN "
+                            f"({', '.join('?' * len(rollups.LEGACY_TRIGGERS))})", rollups.LEGACY_TRIGGERS).fetchall()
+
+    # Ids of deleted rows are not reused, and the rollups match the rows
+    database.add_revenue("2025-01-04", "Bern", 20.0, who="Mia")
+    assert database.get_last_revenues()["id"].tolist() == [5]
+    maintained = _rollup_rows(conn)
+    database.rebuild_rollups()
+    assert maintained == _rollup_rows(conn)
+
+
+def test_insert_entries_and_staff_queries(revenues):
+    rows = [{"date": "2025-01-01", "city": "Zurich", "revenue": None, "declared_revenue": 10.0,
+             "kind": "ordinary", "who": who, "notes": None, "weather_status": "pending"}
+            for who in ("Marco, Liam", "Mia")]
+    rows.append(dict(rows[0], city="Basel", who=" Liam ,, Sofia", main_weather="Clear"))
+    schema, version = revenues.execute("PRAGMA schema_version").fetchone()[0], storage.get_version(revenues)
+    with revenues:
+        ids = storage.insert_entries(revenues, rows)
+        assert ids[0] is not None and ids[1] is None and ids[2] > ids[0]
+    # One change for the batch, with the version triggers paused rather than dropped
+    assert storage.get_version(revenues) == version + 1
+    assert revenues.execute("PRAGMA schema_version").fetchone()[0] == schema
+    with revenues:
+        assert storage.insert_entries(revenues, rows[:1]) == [None]
+
+    df = database.query_revenues(who="Liam")
+    assert sorted(df["city"]) == ["Basel", "Zurich"]
+    assert df.set_index("city").loc["Basel", "who"] == "Liam, Sofia"
+    assert df.set_index("city").loc["Basel", "main_weather"] == "Clear"
+    assert database.query_revenues(who="Mia").empty
+    assert database.del_revenue_by_date("2025-01-01", "Zurich") == 1
+    assert revenues.execute("SELECT COUNT(*) FROM revenue_staff").fetchone()[0] == 2
+
+    # A batch inside another is part of it
+    version = storage.get_version(revenues)
+    with revenues, storage.versioned_once(revenues):
+        storage.insert_entries(revenues, [dict(row, date="2025-01-02") for row in rows])
+    assert storage.get_version(revenues) == version + 1
+
+
+def test_view_stays_writable(revenues):
+    with revenues:
+        revenues.execute("INSERT INTO revenues (date, city, declared_revenue, who, main_weather) "
+                         "VALUES ('2025-01-01', 'Zurich', 10, 'Marco, Liam', 'Rain')")
+        # Like the former unique index, a second entry for the date and city is ignored
+        revenues.execute("INSERT INTO revenues (date, city, declared_revenue) VALUES ('2025-01-01', 'Zurich', 99)")
+        revenues.execute("UPDATE revenues SET city = 'Basel', who = 'Mia' WHERE id = 1")
+    assert revenues.execute("SELECT city, declared_revenue, who, main_weather FROM revenues").fetchall() == [
+        ("Basel", 10.0, "Mia", "Rain")
+    ]
+    with revenues:
+        revenues.execute("DELETE FROM revenues WHERE city = 'Basel'")
+    assert revenues.execute("SELECT COUNT(*) FROM revenue_entries").fetchone()[0] == 0
+    assert all(not rows for rows in _rollup_rows(revenues).values())
@@ -0,0 +1,135 @@
+import sys
+import os
+import gzip
+import json
+
+import pytest
+
+# Add the project root to the Python path (go back one folder)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from revenue_tracker import config, database, sync
+
+
+@pytest.fixture
+def stalls(tmp_path, monkeypatch):
+    """Two copies of the database; use(name) makes one of them the current one."""
+    def use(name):
+        monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / f"{name}.db")
+        database.create_table()
+    return use
+
+
+def _rows():
+    conn = database.get_connection()
+    return conn.execute("SELECT date, city, declared_revenue, who FROM revenues ORDER BY date, city").fetchall()
+
+
+def _add(*rows):
+    for date, city, amount, who in rows:
+        database.add_revenue(date, city, amount, who=who)
+
+
+def test_exchanges_changes_both_ways(stalls, tmp_path):
+    stalls("zurich")
+    _add(("2025-03-01", "Zurich", 100.0, "Marco"), ("2025-03-02", "Zurich", 80.0, None))
+    assert sync.export_delta(tmp_path / "z1.gz", peer="basel")["changes"] == 2
+
+    stalls("basel")
+    _add(("2025-03-01", "Basel", 50.0, "Liam"))
+    summary = sync.apply_delta(tmp_path / "z1.gz")
+    assert (summary["changes"], summary["applied"]) == (2, 2)
+    sync.export_delta(tmp_path / "b1.gz", peer="zurich")
+    # Applying the same file again changes nothing
+    assert sync.apply_delta(tmp_path / "z1.gz")["known"] == 2
+    basel = _rows()
+
+    stalls("zurich")
+    summary = sync.apply_delta(tmp_path / "b1.gz")
+    # The file also holds Zurich's own changes, which are known already
+    assert (summary["known"], summary["applied"]) == (2, 1)
+    assert _rows() == basel == [("2025-03-01", "Basel", 50.0, "Liam"), ("2025-03-01", "Zurich", 100.0, "Marco"),
+                                ("2025-03-02", "Zurich", 80.0, None)]
+    # Received entries without weather are queued for enrichment
+    conn = database.get_connection()
+    assert conn.execute("SELECT weather_status FROM revenues WHERE city = 'Basel'").fetchall() == [("pending",)]
+
+
+def test_exports_only_new_changes_to_a_peer(stalls, tmp_path):
+    stalls("zurich")
+    _add(("2025-03-01", "Zurich", 100.0, "Marco"))
+    sync.export_delta(tmp_path / "1.gz", peer="basel")
+    _add(("2025-03-02", "Zurich", 80.0, None))
+    database.del_revenue_by_date("2025-03-01", "Zurich")
+    assert sync.sync_status()["unsent"] == {"basel": 2}
+
+    assert sync.export_delta(tmp_path / "2.gz", peer="basel")["changes"] == 2
+    with gzip.open(tmp_path / "2.gz", "rt") as f:
+        header, *changes = [json.loads(line) for line in f]
+    assert header["format"] == sync.FORMAT
+    assert [(op, date, city) for _, _, op, date, city, _, _ in changes] == [
+        ("insert", "2025-03-02", "Zurich"), ("delete", "2025-03-01", "Zurich")]
+    assert sync.sync_status()["unsent"] == {"basel": 0}
+
+    # The second file cannot be applied without the first
+    stalls("basel")
+    with pytest.raises(ValueError, match="missing"):
+        sync.apply_delta(tmp_path / "2.gz")
+    assert _rows() == []
+    sync.apply_delta(tmp_path / "1.gz")
+    sync.apply_delta(tmp_path / "2.gz")
+    assert _rows() == [("2025-03-02", "Zurich", 80.0, None)]
+
+
+def test_later_change_of_an_entry_wins(stalls, tmp_path):
+    stalls("zurich")
+    _add(("2025-03-01", "Zurich", 100.0, "Marco"))
+    sync.export_delta(tmp_path / "z1.gz", peer="basel")
+    stalls("basel")
+    sync.apply_delta(tmp_path / "z1.gz")
+
+    # Both stalls correct the same entry; Basel does it last
+    stalls("zurich")
+    database.del_revenue_by_date("2025-03-01", "Zurich")
+    _add(("2025-03-01", "Zurich", 110.0, "Marco"))
+    sync.export_delta(tmp_path / "z2.gz", peer="basel")
+    stalls("basel")
+    database.del_revenue_by_date("2025-03-01", "Zurich")
+    _add(("2025-03-01", "Zurich", 120.0, "Liam"))
+    sync.export_delta(tmp_path / "b1.gz", peer="zurich")
+
+    summary = sync.apply_delta(tmp_path / "z2.gz")
+    assert summary["superseded"] == 2
+    assert _rows() == [("2025-03-01", "Zurich", 120.0, "Liam")]
+    stalls("zurich")
+    sync.apply_delta(tmp_path / "b1.gz")
+    assert _rows() == [("2025-03-01", "Zurich", 120.0, "Liam")]
+
+
+def test_clear_keeps_entries_changed_after_it(stalls, tmp_path):
+    stalls("zurich")
+    _add(("2025-03-01", "Zurich", 100.0, None), ("2025-03-02", "Zurich", 80.0, None))
+    sync.export_delta(tmp_path / "z1.gz", peer="basel")
+    stalls("basel")
+    sync.apply_delta(tmp_path / "z1.gz")
+
+    stalls("zurich")
+    database.del_table()
+    database.create_table()
+    sync.export_delta(tmp_path / "z2.gz", peer="basel")
+    stalls("basel")
+    _add(("2025-03-03", "Basel", 50.0, None))
+    sync.apply_delta(tmp_path / "z2.gz")
+    assert _rows() == [("2025-03-03", "Basel", 50.0, None)]
+
+
+def test_rejects_other_files(stalls, tmp_path):
+    stalls("zurich")
+    path = tmp_path / "other.gz"
+    with gzip.open(path, "wt") as f:
+        f.write('{"hello": 1}\n')
+    with pytest.raises(ValueError, match="not a revenue tracker delta"):
+        sync.apply_delta(path)
+    path.write_text("date,city\n")
+    with pytest.raises(ValueError):
+        sync.apply_delta(path)
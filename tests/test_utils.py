@@ -0,0 +1,52 @@
+import sys
+import os
+import json
+
+import pytest
+
+# Add the project root to the Python path (go back one folder)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from revenue_tracker import config, utils
+
+
+@pytest.fixture
+def rules(tmp_path, monkeypatch):
+    path = tmp_path / "who_defaults.json"
+    monkeypatch.setattr(config, "WHO_DEFAULTS_PATH", path)
+
+    def write(data, mtime):
+        path.write_text(json.dumps(data) if isinstance(data, dict) else data, encoding="utf-8")
+        os.utime(path, (mtime, mtime))
+    return write
+
+
+def test_rules_match_any_case_and_fall_back(rules):
+    rules({"Zurich": {"Tuesday": "Marco, Sofia", "saturday": "Liam", "*": "Mia"}, " basel ": {"*": "Anna"}}, 1)
+    assert utils.default_who("zurich", "2025-03-04") == "Marco, Sofia"  # Tuesday
+    assert utils.default_who("ZURICH ", "2025-03-01") == "Liam"
+    assert utils.default_who("Zurich", "2025-03-02") == "Mia"
+    assert utils.default_who("Basel", "2025-03-02") == "Anna"
+    assert utils.default_who("Bern", "2025-03-02") is None
+    assert utils.default_who_many([("Zurich", "2025-03-04"), ("Bern", "2025-03-04"), (None, "2025-03-04")]) == [
+        "Marco, Sofia", None, None
+    ]
+    days = utils.default_who_range("Zurich", "2025-03-01", "2025-03-04")
+    assert days == {"2025-03-01": "Liam", "2025-03-02": "Mia", "2025-03-03": "Mia", "2025-03-04": "Marco, Sofia"}
+
+
+def test_reload_on_change_and_keep_rules_when_invalid(rules, capsys):
+    rules({"Zurich": {"*": "Marco"}}, 1)
+    assert utils.default_who("Zurich", "2025-03-01") == "Marco"
+    rules({"Zurich": {"*": "Liam"}}, 2)
+    assert utils.default_who("Zurich", "2025-03-01") == "Liam"
+
+    rules({"Zurich": {"Caturday": "Mia", "*": 3}, "zurich ": {}}, 3)
+    assert utils.default_who("Zurich", "2025-03-01") == "Liam"
+    out = capsys.readouterr().out
+    assert "Caturday" in out and "Zurich.*" in out and "listed twice" in out
+    rules("{not json", 4)
+    assert utils.default_who("Zurich", "2025-03-01") == "Liam"
+
+    os.remove(config.WHO_DEFAULTS_PATH)
+    assert utils.default_who("Zurich", "2025-03-01") is None
@@ -1,26 +1,82 @@
 import sys
 import os
 
-# Add the 'src' directory to the Python path (go back one folder, then into 'src')
+import pytest
+
+# Add the project root to the Python path (go back one folder)
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from src.weather import get_day_weather
+from revenue_tracker import config, weather
+from benchmarks.fake_openweather import FakeOpenWeather, geocode, observation
+
+TEST_DATE = '2025-03-01'
+
+
+@pytest.fixture
+def fake_api(tmp_path, monkeypatch):
+    """Serve the weather endpoints from the local stand-in instead of the live API."""
+    monkeypatch.setattr(config, "DATABASE_PATH", tmp_path / "revenues.db")
+    monkeypatch.setattr(config, "OPENWEATHER_API_KEY", "test")
+    monkeypatch.setattr(weather, "rate_limiter", weather.TokenBucket(rate_per_minute=1e6))
+    monkeypatch.setattr(weather.time, "sleep", lambda seconds: None)
+    weather.timezone_at.cache_clear()
+    with FakeOpenWeather() as fake:
+        monkeypatch.setattr(config, "OPENWEATHER_BASE_URL", fake.url)
+        yield fake
+
+
+def test_get_day_weather(fake_api):
+    city = 'Romano di Lombardia'
+    lat, lon = geocode(city)[0]["lat"], geocode(city)[0]["lon"]
+    expected = observation(lat, lon, weather.local_to_utc_timestamp(TEST_DATE, lat, lon))["data"][0]
+
+    result = weather.get_day_weather(city, TEST_DATE)
+    assert result == (expected["temp"], expected["feels_like"], expected["wind_speed"],
+                      expected["weather"][0]["main"], expected["weather"][0]["description"])
+
+    # Coordinates and the observation are served from the cache the second time
+    requests = fake_api.counters
+    assert weather.get_day_weather(city, TEST_DATE) == result
+    assert fake_api.counters == requests
+
+
+def test_get_day_weather_unknown_city(fake_api):
+    with pytest.raises(ValueError, match="Impossible to find coordinates"):
+        weather.get_day_weather('Nowhere Town', TEST_DATE)
+    assert "/data/3.0/onecall/timemachine" not in fake_api.counters
+
+
+def test_get_many_day_weather_retries_rate_limited_requests(fake_api, monkeypatch):
+    fake_api.rate_limit_rate = 0.3
+    monkeypatch.setattr(config, "OPENWEATHER_MAX_RETRIES", 20)
+    pairs = [(city, f'2025-03-0{day}') for city in ('Zurich', 'Basel') for day in range(1, 6)]
+
+    results = weather.get_many_day_weather(pairs, max_workers=4)
+    assert set(results) == set(pairs)
+    assert not any(isinstance(r, Exception) for r in results.values())
+    assert fake_api.counters.get("status_429", 0) > 0
 
-TEST_CITY = ['Romano di Lombardia']
-TEST_DATE = '2025-03-01'  # Example date for testing
 
+def test_get_many_day_series(fake_api, monkeypatch):
+    monkeypatch.setattr(config, "MARKET_OPEN_HOUR", 8)
+    monkeypatch.setattr(config, "MARKET_CLOSE_HOUR", 11)
+    pairs = [('Zurich', TEST_DATE), ('Zurich', '2025-03-02'), ('Nowhere Town', TEST_DATE)]
 
-def test_get_day_weather(city, date):
-    # Test the weather data retrieval for a known city (e.g., "Rome")
-    day_temp, day_felt_temp, wind_speed, main_weather, weather_description = get_day_weather(city, date)
-    print(f"City: {city}", 'Day Temperature:', day_temp, '°C, ', 'Felt Temperature:', day_felt_temp, '°C, ',
-          'Wind Speed:', wind_speed, 'm/s, ', 'Main Weather:', main_weather, ', Weather Description:', weather_description)
- 
+    results = weather.get_many_day_series(pairs, max_workers=4)
+    assert isinstance(results[('Nowhere Town', TEST_DATE)], ValueError)
+    first_hour, blob, mean, maximum, rain_hours = results[('Zurich', TEST_DATE)]
+    assert first_hour == 8 and len(blob) == 4 * 3 * 4
 
-# Call the test functions
-if __name__ == "__main__":
+    lat, lon = geocode('Zurich')[0]["lat"], geocode('Zurich')[0]["lon"]
+    hours = [observation(lat, lon, weather.local_to_utc_timestamp(TEST_DATE, lat, lon, hour=hour))["data"][0]
+             for hour in range(8, 12)]
+    series = weather.unpack_series(blob)
+    assert [t for t, _, _ in series] == pytest.approx([h["temp"] for h in hours], abs=1e-4)
+    assert mean == pytest.approx(sum(h["temp"] for h in hours) / 4, abs=1e-4)
+    assert maximum == pytest.approx(max(h["temp"] for h in hours), abs=1e-4)
+    assert rain_hours == sum(1 for h in hours if (h.get("rain") or h.get("snow") or {}).get("1h", 0) >= 0.1)
 
-    print("-" * 40, f'\nDate: {TEST_DATE}\n')
-    for city in TEST_CITY:
-        test_get_day_weather(city=city, date=TEST_DATE)
-        print("-" * 40)
+    # The hours are served from the cache the second time
+    requests = fake_api.counters
+    assert weather.get_many_day_series(pairs[:2]) == {pair: results[pair] for pair in pairs[:2]}
+    assert fake_api.counters == requests
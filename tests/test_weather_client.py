@@ -0,0 +1,64 @@
+import sys
+import os
+
+# Add the project root to the Python path (go back one folder)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from revenue_tracker import weather
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class FakeSession:
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def get(self, url, params=None, timeout=None):
+        self.calls += 1
+        return FakeResponse(self.statuses.pop(0))
+
+
+def test_api_get_retries_transient_errors(monkeypatch):
+    session = FakeSession([429, 503, 200])
+    monkeypatch.setattr(weather, "get_session", lambda: session)
+    monkeypatch.setattr(weather, "rate_limiter", weather.TokenBucket(rate_per_minute=1e6))
+    monkeypatch.setattr(weather.time, "sleep", lambda seconds: None)
+
+    assert weather.api_get("http://example", {}).status_code == 200
+    assert session.calls == 3
+
+
+def test_api_get_returns_last_response_when_retries_run_out(monkeypatch):
+    session = FakeSession([500] * (weather.config.OPENWEATHER_MAX_RETRIES + 1))
+    monkeypatch.setattr(weather, "get_session", lambda: session)
+    monkeypatch.setattr(weather, "rate_limiter", weather.TokenBucket(rate_per_minute=1e6))
+    monkeypatch.setattr(weather.time, "sleep", lambda seconds: None)
+
+    assert weather.api_get("http://example", {}).status_code == 500
+    assert session.calls == weather.config.OPENWEATHER_MAX_RETRIES + 1
+
+
+def test_api_get_does_not_retry_client_errors(monkeypatch):
+    session = FakeSession([401])
+    monkeypatch.setattr(weather, "get_session", lambda: session)
+    monkeypatch.setattr(weather, "rate_limiter", weather.TokenBucket(rate_per_minute=1e6))
+
+    assert weather.api_get("http://example", {}).status_code == 401
+    assert session.calls == 1
+
+
+def test_token_bucket_limits_rate(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(weather.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(weather.time, "sleep", lambda seconds: clock.__setitem__(0, clock[0] + seconds))
+
+    bucket = weather.TokenBucket(rate_per_minute=60, capacity=2)
+    for _ in range(5):
+        bucket.acquire()
+    # Two requests fit in the burst, the other three wait one second each
+    assert abs(clock[0] - 3.0) < 1e-6